@@ -1,10 +1,12 @@
 from django.contrib import admin
 
 from django.contrib import admin
-from .models import Category, Book, CartItem, CustomUser
+from .models import Category, Book, CartItem, CustomUser, Order, OrderLine
 
 admin.site.register(Category)
 admin.site.register(Book)
 admin.site.register(CartItem)
 admin.site.register(CustomUser)
+admin.site.register(Order)
+admin.site.register(OrderLine)
 
@@ -4,3 +4,13 @@ from django.apps import AppConfig
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+        from django.db.models.signals import post_migrate
+        from . import signals
+        from .querywatch import install_query_observers
+        from .sqlite import configure_sqlite
+        post_migrate.connect(signals.create_search_index, sender=self)
+        connection_created.connect(configure_sqlite)
+        connection_created.connect(install_query_observers)
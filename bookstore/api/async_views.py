@@ -0,0 +1,134 @@
+"""
+Async versions of the hot read and auth views, routed instead of their
+sync counterparts in ``views`` when ``settings.ASYNC_VIEWS`` is on. They use
+the async ORM so they don't each hold a thread from the sync_to_async pool
+under an ASGI server. Needs Django 5.0 or later.
+"""
+from asgiref.sync import sync_to_async
+from django.contrib.auth import aauthenticate, alogin, alogout
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from .catalog_cache import acached_listing, listing_etag, listing_last_modified
+from .category_map import acategory_map
+from .models import CartItem
+from .pagination import apaginate, BOOK_ORDERINGS
+from .serializers import book_values, serialize_book_rows
+from .validators import validate_book_list_get_payload, validate_post_login_payload
+from .views import login_required_json, hashing_busy, in_stock_books, read_condition
+from .tokens import issue_token, revoke_token, token_auth_enabled
+from .hashers import HashingBusy
+from .querybudget import query_budget
+from .routers import replica_reads
+from .reservations import add_book_to_cart, discard_cart_items, ALREADY_IN_CART, UNAVAILABLE
+import json
+
+
+async def abook_page(request, books):
+    page = await apaginate(request, book_values(books), BOOK_ORDERINGS, 'title')
+    categories = await acategory_map({row['category_id'] for row in page.object_list})
+    return {'books': serialize_book_rows(page.object_list, categories), **page.meta()}
+
+
+# add to cart by admin or member
+@query_budget(5)
+@csrf_exempt
+@login_required_json
+async def add_to_cart(request, book_id):
+    try:
+        if request.method == "POST":
+            user = await request.auser()
+            # the reservation needs a transaction, which the async ORM can't open
+            result = await sync_to_async(add_book_to_cart)(user, book_id)
+            if result == ALREADY_IN_CART:
+                return JsonResponse({'message': 'Book already exists in cart!'}, status=409)
+            if result == UNAVAILABLE:
+                return JsonResponse({'error': 'No Book matches the given query.'}, status=400)
+            return JsonResponse({'message': 'Book added to cart successfully'}, status=201)
+        else:
+            return JsonResponse({'error': 'Method not allowed'}, status=405)
+    except Exception as e:
+        return JsonResponse({"error": str(e)}, status=400)
+
+
+# view cart by member or admin
+@query_budget(5)
+@login_required_json
+async def view_cart(request):
+    try:
+        if request.method == 'GET':
+            user = await request.auser()
+            cutoff = CartItem.expiry_cutoff()
+            await sync_to_async(discard_cart_items)(
+                CartItem.objects.filter(user=user, added_at__lt=cutoff))
+            cart_items = CartItem.objects.filter(
+                user=user, added_at__gte=cutoff).order_by('id')
+            cart_items_data = [{'book_id': item['book_id'], 'title': item['book__title'],
+                                'price': item['book__price']}
+                               async for item in cart_items.values('book_id', 'book__title', 'book__price')]
+            return JsonResponse({'cart_items': cart_items_data}, status=200)
+        else:
+            return JsonResponse({'error': 'Method not allowed'}, status=405)
+    except Exception as e:
+        return JsonResponse({"error": str(e)}, status=400)
+
+
+# list all books that are in stock
+@query_budget(4)
+@replica_reads
+@read_condition(etag_func=listing_etag, last_modified_func=listing_last_modified)
+async def list_books(request):
+    try:
+        if request.method == 'GET':
+            data = json.loads(request.body)
+            validate_book_list_get_payload(data)
+            category_names = data['categories']
+            books = in_stock_books(category_names, await acategory_map())
+            params = dict(request.GET.dict(), categories=sorted(category_names))
+            payload = await acached_listing('list_books', params,
+                                            lambda: abook_page(request, books))
+            return JsonResponse(payload, status=200)
+        else:
+            return JsonResponse({'error': 'Method not allowed'}, status=405)
+    except Exception as e:
+        return JsonResponse({"error": str(e)}, status=400)
+
+
+# login user
+@query_budget(10)
+async def login_user(request):
+    try:
+        if request.method == 'POST':
+            data = json.loads(request.body)
+            validate_post_login_payload(data)
+            email = data.get('email')
+            password = data.get('password')
+            user = await aauthenticate(request, email=email, password=password)
+            if user is not None:
+                if token_auth_enabled():
+                    return JsonResponse({'message': 'Login successful',
+                                         'token': issue_token(user)}, status=200)
+                await alogin(request, user)
+                return JsonResponse({'message': 'Login successful'}, status=200)
+            else:
+                return JsonResponse({'error': 'Invalid username or password'}, status=400)
+        else:
+            return JsonResponse({'error': 'Method not allowed'}, status=405)
+    except HashingBusy as e:
+        return hashing_busy(e)
+    except Exception as e:
+        return JsonResponse({"error": str(e)}, status=400)
+
+
+# logout user
+@query_budget(4)
+async def logout_user(request):
+    try:
+        if request.method == 'POST':
+            if getattr(request, 'auth_token', None):
+                revoke_token(request.auth_token)
+            else:
+                await alogout(request)
+            return JsonResponse({'message': 'Logout Success'}, status=200)
+        return JsonResponse({'error': 'Method not allowed'}, status=405)
+    except Exception as e:
+        return JsonResponse({"error": str(e)}, status=400)
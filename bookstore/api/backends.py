@@ -0,0 +1,107 @@
+import copy
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from .hashers import hash_password, verify_password
+
+
+class TTLCache:
+    """A small thread-safe in-process cache whose entries expire after ``ttl`` seconds."""
+
+    def __init__(self, ttl, max_size):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires < time.monotonic():
+                del self._data[key]
+                return None
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            if len(self._data) >= self.max_size:
+                # drop the entry closest to expiring
+                oldest = min(self._data, key=lambda k: self._data[k][1])
+                del self._data[oldest]
+            self._data[key] = (value, time.monotonic() + self.ttl)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+user_cache = TTLCache(settings.USER_CACHE_TTL, settings.USER_CACHE_MAX_SIZE)
+
+
+def invalidate_cached_user(user_id):
+    user_cache.delete(user_id)
+
+
+class CachedUserBackend(ModelBackend):
+    """
+    ModelBackend that keeps the users AuthenticationMiddleware loads in a
+    per-process TTL cache, so a warm request does not query the user table.
+    Saving or deleting a user evicts it in this process, other processes
+    see the change within ``USER_CACHE_TTL`` seconds.
+
+    Passwords are checked on the bounded hashing pool, and rehashed with the
+    current hasher settings when they were hashed with older ones.
+    """
+
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        UserModel = get_user_model()
+        if username is None:
+            username = kwargs.get(UserModel.USERNAME_FIELD)
+        if username is None or password is None:
+            return None
+        try:
+            user = UserModel._default_manager.get_by_natural_key(username)
+        except UserModel.DoesNotExist:
+            # hash anyway so unknown emails take as long as wrong passwords
+            hash_password(password)
+            return None
+        is_correct, must_update = verify_password(password, user.password)
+        if not is_correct or not self.user_can_authenticate(user):
+            return None
+        if must_update:
+            user.password = hash_password(password)
+            user.save(update_fields=['password'])
+        return user
+
+    async def aauthenticate(self, request, username=None, password=None, **kwargs):
+        return await sync_to_async(self.authenticate)(request, username, password, **kwargs)
+
+    def get_user(self, user_id):
+        user = user_cache.get(user_id)
+        if user is None:
+            user = super().get_user(user_id)
+            if user is None:
+                return None
+            user_cache.set(user_id, user)
+        # each request gets its own copy of the cached instance
+        return copy.copy(user)
+
+    async def aget_user(self, user_id):
+        user = user_cache.get(user_id)
+        if user is None:
+            user = await super().aget_user(user_id)
+            if user is None:
+                return None
+            user_cache.set(user_id, user)
+        return copy.copy(user)
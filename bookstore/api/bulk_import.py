@@ -0,0 +1,181 @@
+import csv
+import json
+import math
+
+from django.db import connection, transaction
+from .catalog_cache import bump_catalog_version
+from .category_map import category_map
+from .models import Book
+from .querybudget import extend_query_budget
+from .validators import VALIDATORS
+
+
+DEFAULT_CHUNK_SIZE = 500
+
+# stop collecting row errors past this many so the report stays small
+MAX_REPORTED_ERRORS = 1000
+
+UPDATE_FIELDS = ['year_published', 'author_name', 'price', 'category', 'stock', 'updated_at']
+
+CSV_TYPES = {'year_published': int, 'price': float, 'stock': int}
+
+
+def _decode(lines, bad_lines):
+    # undecodable lines are replaced and their numbers added to bad_lines,
+    # so the row they belong to is reported instead of ending the import
+    for line_number, line in enumerate(lines, start=1):
+        if isinstance(line, bytes):
+            try:
+                line = line.decode('utf-8')
+            except UnicodeDecodeError:
+                bad_lines.add(line_number)
+                line = line.decode('utf-8', 'replace')
+        yield line
+
+
+def iter_ndjson_rows(lines):
+    """Yield ``(line_number, row)`` for each non-blank NDJSON line."""
+    bad_lines = set()
+    for line_number, line in enumerate(_decode(lines, bad_lines), start=1):
+        if line_number in bad_lines:
+            yield line_number, ValueError('Invalid UTF-8')
+            continue
+        if not line.strip():
+            continue
+        try:
+            yield line_number, json.loads(line)
+        except ValueError as e:
+            yield line_number, ValueError(f'Invalid JSON: {e}')
+
+
+def iter_csv_rows(lines):
+    """Yield ``(line_number, row)`` for each CSV record after the header."""
+    bad_lines = set()
+    reader = csv.DictReader(_decode(lines, bad_lines))
+    while True:
+        # the first next() also reads the header on line 1
+        first_line = max(reader.line_num, 1) + 1
+        try:
+            row = next(reader)
+        except StopIteration:
+            return
+        except csv.Error as e:
+            # the reader has skipped the bad record and can go on
+            yield first_line, ValueError(f'Invalid CSV: {e}')
+            continue
+        # a record can span lines
+        if bad_lines.intersection(range(first_line, reader.line_num + 1)):
+            yield reader.line_num, ValueError('Invalid UTF-8')
+            continue
+        for field, cast in CSV_TYPES.items():
+            try:
+                row[field] = cast(row[field])
+            except (KeyError, TypeError, ValueError):
+                # left as is, the schema reports the bad value
+                pass
+        row = {key: value for key, value in row.items() if key is not None}
+        yield reader.line_num, row
+
+
+ROW_READERS = {'ndjson': iter_ndjson_rows, 'csv': iter_csv_rows}
+
+
+class ImportReport:
+    def __init__(self):
+        self.rows = 0
+        self.upserted = 0
+        self.error_count = 0
+        self.errors = []
+
+    def add_error(self, line_number, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'line': line_number, 'error': message})
+
+    def as_dict(self):
+        return {
+            'rows': self.rows,
+            'upserted': self.upserted,
+            'error_count': self.error_count,
+            'errors': self.errors,
+        }
+
+
+def _flush(chunk, report):
+    # later rows for the same title win, an upsert can't touch a row twice
+    books = list(chunk.values())
+    chunk.clear()
+    if not books:
+        return
+    try:
+        _upsert(books)
+    except Exception:
+        # find the rows at fault, one savepoint each
+        for book in books:
+            try:
+                _upsert([book])
+            except Exception as e:
+                report.add_error(book[0], str(e))
+            else:
+                report.upserted += 1
+        return
+    report.upserted += len(books)
+
+
+def _upsert(books):
+    objs = [book for _, book in books]
+    fields = [field for field in Book._meta.concrete_fields if not field.primary_key]
+    batch_size = connection.ops.bulk_batch_size(fields, objs)
+    # one INSERT per batch, plus starting and ending the transaction
+    extend_query_budget(math.ceil(len(objs) / batch_size) + 2)
+    with transaction.atomic():
+        Book.objects.bulk_create(
+            objs, update_conflicts=True,
+            unique_fields=['title'], update_fields=UPDATE_FIELDS)
+
+
+def import_books(lines, fmt='ndjson', chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Upsert books on title from an iterable of NDJSON or CSV lines.
+
+    Rows are validated one at a time and written in chunks of
+    ``chunk_size``, so memory use does not depend on the size of the
+    input. Bad rows, including lines that aren't valid UTF-8 and rows the
+    database refuses, are reported by line number and do not stop the
+    import.
+
+    ``stock`` is the number of copies free to sell, as in exports. Copies
+    held by carts stay in ``held`` and are not part of it.
+    """
+    if fmt not in ROW_READERS:
+        raise ValueError(f"Unsupported format '{fmt}', use ndjson or csv")
+    validator = VALIDATORS['manage_books_post']
+    categories = category_map().by_name
+    report = ImportReport()
+    chunk = {}
+    for line_number, row in ROW_READERS[fmt](lines):
+        report.rows += 1
+        try:
+            if isinstance(row, Exception):
+                raise row
+            if isinstance(row, dict):
+                # exports carry the id, upserts key on title instead
+                row.pop('id', None)
+            validator.validate(row)
+            category_id = categories.get(row['category'])
+            if category_id is None:
+                raise ValueError(f"Category '{row['category']}' not found")
+        except ValueError as e:
+            report.add_error(line_number, str(e))
+            continue
+        chunk[row['title']] = (line_number, Book(
+            title=row['title'], year_published=row['year_published'],
+            author_name=row['author_name'], price=row['price'],
+            category_id=category_id, stock=row['stock']))
+        if len(chunk) >= chunk_size:
+            _flush(chunk, report)
+    _flush(chunk, report)
+    if report.upserted:
+        # bulk_create sends no signals
+        bump_catalog_version()
+    return report
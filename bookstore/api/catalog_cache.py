@@ -0,0 +1,182 @@
+import hashlib
+import json
+import threading
+import time
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+from .models import Book, Category
+from .routers import track_replica_reads
+
+
+VERSION_KEY = 'catalog:version'
+MODIFIED_KEY = 'catalog:modified'
+
+_MISSING = object()
+
+_stats = {'hits': 0, 'misses': 0, 'invalidations': 0}
+_stats_lock = threading.Lock()
+
+
+def _cache():
+    return caches[settings.CATALOG_CACHE_ALIAS]
+
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def catalog_cache_stats():
+    with _stats_lock:
+        return dict(_stats, version=get_catalog_version())
+
+
+def get_version(key):
+    cache = _cache()
+    version = cache.get(key)
+    if version is None:
+        # start from the clock so a lost or evicted version never goes back
+        # to a number that old pages and ETags were built with
+        initial = time.time_ns() // 1000
+        cache.add(key, initial, timeout=None)
+        version = cache.get(key, initial)
+    return version
+
+
+def incr_version(key):
+    try:
+        _cache().incr(key)
+    except ValueError:
+        get_version(key)
+
+
+def get_catalog_version():
+    return get_version(VERSION_KEY)
+
+
+def _incr_version():
+    incr_version(VERSION_KEY)
+    _cache().set(MODIFIED_KEY, timezone.now(), timeout=None)
+    _count('invalidations')
+
+
+def bump_catalog_version():
+    """
+    Invalidate every cached listing. The version moves now and again once
+    the surrounding transaction commits, so a page built from rows read
+    before the commit can never outlive it. However many writes a
+    transaction makes, it moves the version only once on commit.
+    """
+    _incr_version()
+    connection = transaction.get_connection()
+    if connection.in_atomic_block and not any(
+            func is _incr_version for _, func, _ in connection.run_on_commit):
+        transaction.on_commit(_incr_version)
+
+
+def _listing_key(version, name, params):
+    digest = hashlib.sha1(json.dumps(params, sort_keys=True, default=str)
+                          .encode()).hexdigest()
+    return f'catalog:{version}:{name}:{digest}'
+
+
+def listing_key(name, params):
+    return _listing_key(get_catalog_version(), name, params)
+
+
+def _storable(version, reads):
+    """
+    Whether a payload built under catalog ``version`` can be cached. A
+    replica may not have the write behind the current version yet, so
+    replica builds are only kept if the version didn't move during the build
+    and the last catalog write is older than ``REPLICA_STICKY_SECONDS``, the
+    lag read pinning already allows for.
+    """
+    if not reads.used:
+        return True
+    if get_catalog_version() != version:
+        return False
+    modified = catalog_last_modified()
+    return modified is None or timezone.now() - modified >= timedelta(seconds=settings.REPLICA_STICKY_SECONDS)
+
+
+def cached_listing(name, params, build):
+    """
+    Return the payload for listing ``name`` with ``params`` from the cache,
+    calling ``build()`` and storing its result on a miss if ``_storable``.
+    """
+    cache = _cache()
+    version = get_catalog_version()
+    key = _listing_key(version, name, params)
+    payload = cache.get(key)
+    if payload is not None:
+        _count('hits')
+        return payload
+    _count('misses')
+    with track_replica_reads() as reads:
+        payload = build()
+    if _storable(version, reads):
+        cache.set(key, payload, settings.CATALOG_CACHE_TIMEOUT)
+    return payload
+
+
+async def acached_listing(name, params, build):
+    """Async version of ``cached_listing``, ``build`` is a coroutine function."""
+    cache = _cache()
+    version = await cache.aget(VERSION_KEY)
+    if version is None:
+        version = await sync_to_async(get_catalog_version)()
+    key = _listing_key(version, name, params)
+    payload = await cache.aget(key)
+    if payload is not None:
+        _count('hits')
+        return payload
+    _count('misses')
+    with track_replica_reads() as reads:
+        payload = await build()
+    if not reads.used or await sync_to_async(_storable)(version, reads):
+        await cache.aset(key, payload, settings.CATALOG_CACHE_TIMEOUT)
+    return payload
+
+
+def catalog_last_modified():
+    """Time of the last catalog write, falling back to the newest row."""
+    cache = _cache()
+    modified = cache.get(MODIFIED_KEY, _MISSING)
+    if modified is _MISSING:
+        with track_replica_reads() as reads:
+            stamps = [model.objects.aggregate(latest=Max('updated_at'))['latest']
+                      for model in (Book, Category)]
+        modified = max((stamp for stamp in stamps if stamp), default=None)
+        # None is cached too, an empty catalog stays empty until the next
+        # write. A replica's answer may be behind, keep it only as long as
+        # replicas are allowed to lag.
+        cache.add(MODIFIED_KEY, modified,
+                  timeout=settings.REPLICA_STICKY_SECONDS if reads.used else None)
+    return modified
+
+
+def listing_etag(request, *args, **kwargs):
+    """
+    ETag for a catalog listing, built from the catalog version and the
+    request's params without touching the database or the response body.
+    """
+    digest = hashlib.sha1()
+    for part in (str(get_catalog_version()), request.path,
+                 request.META.get('QUERY_STRING', '')):
+        digest.update(part.encode())
+        digest.update(b'\0')
+    if request.method in ('GET', 'HEAD'):
+        # list_books takes its category filter from the GET body
+        digest.update(request.body)
+    return digest.hexdigest()
+
+
+def listing_last_modified(request, *args, **kwargs):
+    return catalog_last_modified()
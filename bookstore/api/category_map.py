@@ -0,0 +1,77 @@
+"""
+Process-local map between category names and ids, so book listings filter
+on ``category_id`` and fill in category names without joining the category
+table. The map is loaded with one query and reused while the category
+version in the catalog cache stays the same. Category writes move that
+version through signals (bulk writers call ``invalidate_category_map``), so
+every process reloads its map on the next lookup after the write.
+"""
+import threading
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.db import router, transaction
+from .catalog_cache import get_version, incr_version
+from .models import Category
+
+
+VERSION_KEY = 'categories:version'
+
+
+class CategoryMap:
+
+    def __init__(self, version, by_name):
+        self.version = version
+        self.by_name = by_name
+        self.by_id = {category_id: name for name, category_id in by_name.items()}
+
+    def ids(self, names):
+        """Ids of the categories in ``names``, unknown names are left out."""
+        return [self.by_name[name] for name in names if name in self.by_name]
+
+    def knows(self, category_ids):
+        return all(category_id in self.by_id for category_id in category_ids)
+
+
+_current = CategoryMap(None, {})
+_lock = threading.Lock()
+
+
+def category_map(category_ids=()):
+    """
+    The current map, reloaded if a category changed since it was loaded or
+    if it is missing one of ``category_ids`` (rows read after the map).
+    """
+    global _current
+    version = get_version(VERSION_KEY)
+    current = _current
+    if current.version == version and current.knows(category_ids):
+        return current
+    with _lock:
+        # another thread may have reloaded it while this one waited
+        if _current.version != version or not _current.knows(category_ids):
+            # from the primary: a lagging replica would pin old names to the new version
+            categories = Category.objects.db_manager(router.db_for_write(Category))
+            _current = CategoryMap(version, dict(categories.values_list('name', 'id')))
+        return _current
+
+
+async def acategory_map(category_ids=()):
+    """Async version of ``category_map``, only a reload leaves the event loop."""
+    version = await caches[settings.CATALOG_CACHE_ALIAS].aget(VERSION_KEY)
+    current = _current
+    if version is not None and current.version == version and current.knows(category_ids):
+        return current
+    return await sync_to_async(category_map)(category_ids)
+
+
+def invalidate_category_map():
+    """
+    Make every process reload its map. The version moves now and again once
+    the surrounding transaction commits, so a map loaded from rows read
+    before the commit is reloaded too.
+    """
+    incr_version(VERSION_KEY)
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(lambda: incr_version(VERSION_KEY))
@@ -0,0 +1,76 @@
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from .catalog_cache import bump_catalog_version
+from .models import Book, CartItem, Order, OrderLine
+from .reservations import release, sell_held
+
+
+def checkout_cart(user):
+    """
+    Buy everything in the user's cart with a fixed number of queries.
+    Copies reserved at add_to_cart are sold without touching stock, so only
+    items added before reservations existed can be out of stock.
+
+    The books bought are recorded as an ``Order`` with one ``OrderLine``
+    per book at its current price, written with two INSERTs.
+
+    Returns None for an empty cart, otherwise a dict with the titles that
+    were purchased, had expired or were out of stock, in cart order, and the
+    id of the order (None if nothing was bought).
+    """
+    with transaction.atomic():
+        cutoff = CartItem.expiry_cutoff()
+        # locked so a concurrent checkout or sweep can't sell or release the same holds
+        items = list(CartItem.objects.filter(user=user)
+                     .select_for_update(of=('self',))
+                     .order_by('id')
+                     .values_list('id', 'book_id', 'book__title', 'added_at', 'holds_stock', 'book__price'))
+        if not items:
+            return None
+
+        held = [book_id for _, book_id, _, added_at, holds_stock, _ in items
+                if holds_stock and added_at >= cutoff]
+        sell_held(held)
+        release([book_id for _, book_id, _, added_at, holds_stock, _ in items
+                 if holds_stock and added_at < cutoff])
+
+        unheld_book_ids = {book_id for _, book_id, _, added_at, holds_stock, _ in items
+                           if not holds_stock and added_at >= cutoff}
+        in_stock = set()
+        if unheld_book_ids:
+            in_stock = set(Book.objects.select_for_update()
+                           .filter(id__in=unheld_book_ids, stock__gt=0)
+                           .values_list('id', flat=True))
+        if in_stock:
+            Book.objects.filter(id__in=in_stock, stock__gt=0) \
+                .update(stock=F('stock') - 1, updated_at=timezone.now())
+            # update() sends no signals, invalidate cached listings here
+            bump_catalog_version()
+        in_stock.update(held)
+
+        expired_books, order_summary, out_of_stock, lines = [], [], [], []
+        for _, book_id, title, added_at, _, price in items:
+            if added_at < cutoff:
+                expired_books.append(title)
+            elif book_id in in_stock:
+                order_summary.append(title)
+                lines.append(OrderLine(book_id=book_id, title=title, price=price))
+            else:
+                out_of_stock.append(title)
+
+        order = None
+        if lines:
+            order = Order.objects.create(user=user, total=sum(line.price for line in lines))
+            for line in lines:
+                line.order = order
+            OrderLine.objects.bulk_create(lines)
+
+        CartItem.objects.filter(id__in=[item[0] for item in items]).delete()
+
+    return {
+        'order_summary': order_summary,
+        'expired_books': expired_books,
+        'out_of_stock': out_of_stock,
+        'order_id': order.id if order else None,
+    }
@@ -0,0 +1,52 @@
+import csv
+import json
+
+from .models import Book
+
+
+EXPORT_FIELDS = ['id', 'title', 'year_published', 'author_name', 'price', 'category', 'stock']
+
+DEFAULT_CHUNK_SIZE = 2000
+
+CONTENT_TYPES = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+
+
+class _Echo:
+    # csv.writer target that hands back each line instead of storing it
+    def write(self, value):
+        return value
+
+
+def export_queryset(categories=None, in_stock=False):
+    books = Book.objects.all()
+    if categories:
+        books = books.filter(category__name__in=categories)
+    if in_stock:
+        books = books.filter(stock__gt=0)
+    return books.order_by('id').values_list(
+        'id', 'title', 'year_published', 'author_name', 'price',
+        'category__name', 'stock')
+
+
+def iter_export_lines(books, fmt='ndjson', chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Return an iterator over the lines of the export of ``books`` (an
+    ``export_queryset``). Rows are fetched with a server-side iterator in chunks of
+    ``chunk_size``, so memory use does not depend on the catalog size.
+    """
+    if fmt not in CONTENT_TYPES:
+        raise ValueError(f"Unsupported format '{fmt}', use ndjson or csv")
+    rows = books.iterator(chunk_size=chunk_size)
+    return _csv_lines(rows) if fmt == 'csv' else _ndjson_lines(rows)
+
+
+def _csv_lines(rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(EXPORT_FIELDS)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def _ndjson_lines(rows):
+    for row in rows:
+        yield json.dumps(dict(zip(EXPORT_FIELDS, row)), default=str) + '\n'
@@ -0,0 +1,78 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.hashers import (
+    PBKDF2PasswordHasher, get_hasher, identify_hasher, is_password_usable, make_password,
+)
+
+
+class ConfigurablePBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    """
+    PBKDF2 with the iteration count taken from ``PASSWORD_HASH_ITERATIONS``
+    (Django's default when unset). It keeps the ``pbkdf2_sha256`` algorithm
+    name, so existing hashes still verify and are rehashed on the next
+    login once the iteration count changes.
+    """
+
+    @property
+    def iterations(self):
+        return settings.PASSWORD_HASH_ITERATIONS or PBKDF2PasswordHasher.iterations
+
+
+class HashingBusy(Exception):
+    pass
+
+
+_executor = None
+_executor_lock = threading.Lock()
+_slots = None
+
+
+def _pool():
+    global _executor, _slots
+    with _executor_lock:
+        if _executor is None:
+            workers = settings.PASSWORD_HASH_WORKERS
+            _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password-hash')
+            _slots = threading.BoundedSemaphore(workers + settings.PASSWORD_HASH_MAX_PENDING)
+    return _executor, _slots
+
+
+def run_hasher(func, *args):
+    """
+    Run a password hashing call on the bounded hashing pool and wait for it.
+    At most ``PASSWORD_HASH_WORKERS`` hashes run at once, so a login burst
+    can't take every CPU from the other endpoints. Raises ``HashingBusy``
+    when ``PASSWORD_HASH_MAX_PENDING`` calls are already waiting.
+    """
+    executor, slots = _pool()
+    if not slots.acquire(blocking=False):
+        raise HashingBusy('Too many login attempts, try again later')
+    try:
+        return executor.submit(func, *args).result()
+    finally:
+        slots.release()
+
+
+def hash_password(password):
+    return run_hasher(make_password, password)
+
+
+def _verify(password, encoded):
+    # check_password() without the setter, returns (is_correct, must_update)
+    preferred = get_hasher('default')
+    try:
+        hasher = identify_hasher(encoded) if is_password_usable(encoded) else None
+    except ValueError:
+        hasher = None
+    if hasher is None:
+        # same work as a real check, see ModelBackend.authenticate
+        make_password(password)
+        return False, False
+    must_update = hasher.algorithm != preferred.algorithm or preferred.must_update(encoded)
+    return hasher.verify(password, encoded), must_update
+
+
+def verify_password(password, encoded):
+    return run_hasher(_verify, password, encoded)
@@ -0,0 +1,72 @@
+import asyncio
+import json
+import sys
+import time
+import types
+
+from django.core.management.base import BaseCommand
+from django.test import AsyncClient, override_settings
+from django.urls import reverse
+
+from api.models import Book, CartItem, Category, CustomUser
+from api.urls import build_urlpatterns
+
+
+class Command(BaseCommand):
+    help = ('Drive concurrent requests through the ASGI handler with the sync and '
+            'the async views and compare throughput. Uses the configured database '
+            'and removes the rows it creates.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--endpoint', choices=['view_cart', 'list_books'], default='view_cart')
+        parser.add_argument('--requests', type=int, default=500)
+        parser.add_argument('--concurrency', type=int, default=50)
+
+    def handle(self, *args, **options):
+        category = Category.objects.create(name='__benchmark__')
+        user = CustomUser.objects.create_user(email='benchmark@example.com', password='benchmark')
+        try:
+            books = Book.objects.bulk_create(
+                Book(title=f'__benchmark__ {i}', year_published=2000, author_name='Author',
+                     price='9.99', category=category, stock=10)
+                for i in range(20))
+            CartItem.objects.bulk_create(CartItem(user=user, book=book) for book in books[:10])
+            results = {'endpoint': options['endpoint'], 'requests': options['requests'],
+                       'concurrency': options['concurrency']}
+            for async_views in (False, True):
+                mode = 'async' if async_views else 'sync'
+                urlconf = types.ModuleType(f'_benchmark_urls_{mode}')
+                urlconf.urlpatterns = build_urlpatterns(async_views)
+                sys.modules[urlconf.__name__] = urlconf
+                try:
+                    with override_settings(ROOT_URLCONF=urlconf.__name__,
+                                           ALLOWED_HOSTS=['testserver']):
+                        results[f'{mode}_requests_per_second'] = asyncio.run(
+                            self.drive(user, options))
+                finally:
+                    del sys.modules[urlconf.__name__]
+            self.stdout.write(json.dumps(results, indent=2))
+        finally:
+            category.delete()
+            user.delete()
+
+    async def drive(self, user, options):
+        client = AsyncClient()
+        await client.aforce_login(user)
+        semaphore = asyncio.Semaphore(options['concurrency'])
+        url = reverse(options['endpoint'])
+        body = json.dumps({'categories': ['__benchmark__']})
+
+        async def one():
+            async with semaphore:
+                if options['endpoint'] == 'list_books':
+                    response = await client.generic('GET', url, data=body,
+                                                    content_type='application/json')
+                else:
+                    response = await client.get(url)
+                assert response.status_code == 200, response.status_code
+
+        await one()  # warm up connections and caches
+        start = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(options['requests'])))
+        return round(options['requests'] / (time.perf_counter() - start))
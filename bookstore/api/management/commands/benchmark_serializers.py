@@ -0,0 +1,50 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.models import Book, Category
+from api.serializers import BookSerializer, book_values, serialize_book_rows
+
+
+class Command(BaseCommand):
+    help = ('Compare rows per second of BookSerializer and the values() fast path '
+            'on synthetic books. Nothing is left in the database.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10000)
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        rows, repeat = options['rows'], options['repeat']
+        with transaction.atomic():
+            category = Category.objects.create(name='__benchmark__')
+            Book.objects.bulk_create(
+                Book(title=f'__benchmark__ {i}', year_published=2000, author_name='Author',
+                     price='12.50', category=category, stock=i % 5)
+                for i in range(rows))
+            books = Book.objects.filter(category=category).order_by('id')
+
+            if BookSerializer(books, many=True).data != serialize_book_rows(book_values(books)):
+                self.stderr.write('Fast path output differs from BookSerializer')
+
+            results = {
+                'rows': rows,
+                'drf_rows_per_second': self.measure(
+                    lambda: json.dumps(BookSerializer(books.all(), many=True).data), rows, repeat),
+                'fast_rows_per_second': self.measure(
+                    lambda: json.dumps(serialize_book_rows(book_values(books.all()))), rows, repeat),
+            }
+            results['speedup'] = round(results['fast_rows_per_second'] / results['drf_rows_per_second'], 2)
+            transaction.set_rollback(True)
+        self.stdout.write(json.dumps(results, indent=2))
+
+    @staticmethod
+    def measure(run, rows, repeat):
+        best = float('inf')
+        for _ in range(repeat):
+            start = time.perf_counter()
+            run()
+            best = min(best, time.perf_counter() - start)
+        return round(rows / best)
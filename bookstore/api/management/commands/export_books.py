@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from api.export import DEFAULT_CHUNK_SIZE, export_queryset, iter_export_lines
+
+
+class Command(BaseCommand):
+    help = 'Stream every book (with its category name) as NDJSON or CSV.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=['ndjson', 'csv'], default='ndjson')
+        parser.add_argument('--category', action='append', default=[],
+                            help='only export books in this category, may be repeated')
+        parser.add_argument('--in-stock', action='store_true')
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+        parser.add_argument('-o', '--output', help='file to write, defaults to stdout')
+
+    def handle(self, *args, **options):
+        books = export_queryset(options['category'], options['in_stock'])
+        lines = iter_export_lines(books, options['format'], options['chunk_size'])
+        if options['output']:
+            with open(options['output'], 'w', newline='', encoding='utf-8') as out:
+                out.writelines(lines)
+        else:
+            for line in lines:
+                self.stdout.write(line, ending='')
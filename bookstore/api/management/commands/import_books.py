@@ -0,0 +1,25 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.bulk_import import DEFAULT_CHUNK_SIZE, import_books
+
+
+class Command(BaseCommand):
+    help = 'Upsert books on title from an NDJSON or CSV file.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=['ndjson', 'csv'], default=None,
+                            help='defaults to csv for .csv files, ndjson otherwise')
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or ('csv' if path.endswith('.csv') else 'ndjson')
+        try:
+            with open(path, newline='', encoding='utf-8') as lines:
+                report = import_books(lines, fmt, options['chunk_size'])
+        except OSError as e:
+            raise CommandError(str(e))
+        self.stdout.write(json.dumps(report.as_dict(), indent=2))
@@ -0,0 +1,16 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api.sweeper import purge_expired_cart_items
+
+
+class Command(BaseCommand):
+    help = 'Delete expired cart items in bounded batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int,
+                            default=settings.CART_SWEEPER_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        deleted = purge_expired_cart_items(options['batch_size'])
+        self.stdout.write(f'Deleted {deleted} expired cart items')
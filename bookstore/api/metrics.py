@@ -0,0 +1,354 @@
+"""
+Per-endpoint request metrics in the Prometheus text format.
+
+``MetricsMiddleware`` records, per URL name and method, a latency
+histogram, responses by status, database queries and the time spent in
+them, and response bytes. Samples are aggregated in process under one lock.
+When ``METRICS_DIR`` is set a background thread in each process also writes
+its totals to its own file there every ``METRICS_FLUSH_INTERVAL`` seconds,
+and ``/metrics`` adds up the files of every live worker, so the numbers are
+the same whichever gunicorn worker answers the scrape.
+"""
+import bisect
+import glob
+import hmac
+import json
+import os
+import re
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.http import HttpResponse
+from .models import CustomUser
+from .querywatch import watch_queries
+from .tokens import bearer_token
+
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+UNMATCHED = 'unmatched'
+# anything else is recorded as 'OTHER' so clients can't add label values
+METHODS = {'GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS'}
+
+
+class Metrics:
+    """Cumulative counters for one process."""
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self.requests = {}   # (view, method, status) -> count
+        self.latency = {}    # (view, method) -> [bucket counts..., +Inf, sum]
+        self.queries = {}    # (view, method) -> [count, seconds]
+        self.bytes = {}      # (view, method) -> bytes
+
+    def clear(self):
+        with self._lock:
+            self.requests.clear()
+            self.latency.clear()
+            self.queries.clear()
+            self.bytes.clear()
+
+    def observe(self, view, method, status, seconds, queries, query_seconds, size):
+        key = (view, method)
+        with self._lock:
+            status_key = (view, method, status)
+            self.requests[status_key] = self.requests.get(status_key, 0) + 1
+            latency = self.latency.get(key)
+            if latency is None:
+                latency = self.latency[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            latency[bisect.bisect_left(self.buckets, seconds)] += 1
+            latency[-1] += seconds
+            counts = self.queries.setdefault(key, [0, 0.0])
+            counts[0] += queries
+            counts[1] += query_seconds
+            if size is not None:
+                self.bytes[key] = self.bytes.get(key, 0) + size
+
+    def add_bytes(self, view, method, size):
+        with self._lock:
+            self.bytes[(view, method)] = self.bytes.get((view, method), 0) + size
+
+    def snapshot(self):
+        """The counters as JSON-friendly lists of ``[*labels, value]``."""
+        with self._lock:
+            return {
+                'buckets': list(self.buckets),
+                'requests': [[*k, v] for k, v in self.requests.items()],
+                'latency': [[*k, list(v)] for k, v in self.latency.items()],
+                'queries': [[*k, list(v)] for k, v in self.queries.items()],
+                'bytes': [[*k, v] for k, v in self.bytes.items()],
+            }
+
+
+metrics = Metrics(settings.METRICS_LATENCY_BUCKETS)
+
+_flusher_pid = None
+_flush_lock = threading.Lock()
+PROCESS_FILE = re.compile(r'metrics-(\d+)\.json$')
+
+
+def _process_file(directory):
+    return os.path.join(directory, f'metrics-{os.getpid()}.json')
+
+
+def flush():
+    """Write this process's totals to ``METRICS_DIR``."""
+    directory = settings.METRICS_DIR
+    if not directory:
+        return
+    path = _process_file(directory)
+    tmp = f'{path}.tmp'
+    with _flush_lock:
+        with open(tmp, 'w') as f:
+            json.dump(metrics.snapshot(), f)
+        # readers never see a half written file
+        os.replace(tmp, path)
+
+
+def _flush_forever():
+    while True:
+        time.sleep(settings.METRICS_FLUSH_INTERVAL)
+        try:
+            flush()
+        except OSError:
+            # the directory went away, try again next time
+            continue
+
+
+def start_flusher():
+    """
+    Start this process's flusher thread if ``METRICS_DIR`` is set. Checked
+    per pid, since workers forked from a preloaded master don't inherit it.
+    """
+    global _flusher_pid
+    if not settings.METRICS_DIR or _flusher_pid == os.getpid():
+        return
+    with _flush_lock:
+        if _flusher_pid == os.getpid():
+            return
+        _flusher_pid = os.getpid()
+    os.makedirs(settings.METRICS_DIR, exist_ok=True)
+    threading.Thread(target=_flush_forever, name='metrics-flusher', daemon=True).start()
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # exists, owned by another user
+        return True
+    return True
+
+
+def merge(snapshots):
+    """Add up snapshots from several processes."""
+    total = Metrics(settings.METRICS_LATENCY_BUCKETS)
+    for snapshot in snapshots:
+        if snapshot['buckets'] != list(total.buckets):
+            # written with other bucket settings, can't be added bucket by bucket
+            continue
+        for *labels, value in snapshot['requests']:
+            key = tuple(labels)
+            total.requests[key] = total.requests.get(key, 0) + value
+        for *labels, value in snapshot['latency']:
+            current = total.latency.setdefault(tuple(labels), [0] * len(value))
+            for i, v in enumerate(value):
+                current[i] += v
+        for *labels, value in snapshot['queries']:
+            current = total.queries.setdefault(tuple(labels), [0, 0.0])
+            current[0] += value[0]
+            current[1] += value[1]
+        for *labels, value in snapshot['bytes']:
+            key = tuple(labels)
+            total.bytes[key] = total.bytes.get(key, 0) + value
+    return total
+
+
+def collect():
+    """Totals for every worker sharing ``METRICS_DIR``, or this process alone."""
+    snapshots = [metrics.snapshot()]
+    directory = settings.METRICS_DIR
+    if directory:
+        own = _process_file(directory)
+        for path in glob.glob(os.path.join(directory, 'metrics-*.json')):
+            match = PROCESS_FILE.search(path)
+            if path == own or not match:
+                continue
+            if not _alive(int(match.group(1))):
+                # left by a worker that exited, its counts went with it
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                continue
+            try:
+                with open(path) as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+    return merge(snapshots)
+
+
+def _labels(view, method, **extra):
+    pairs = dict(view=view, method=method, **extra)
+    return ','.join(f'{k}="{v}"' for k, v in pairs.items())
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render(totals):
+    lines = [
+        '# HELP bookstore_http_requests_total Responses by view, method and status.',
+        '# TYPE bookstore_http_requests_total counter',
+    ]
+    for (view, method, status), value in sorted(totals.requests.items()):
+        lines.append(f'bookstore_http_requests_total{{{_labels(view, method, status=status)}}} {value}')
+
+    lines += [
+        '# HELP bookstore_http_request_duration_seconds Time spent handling requests.',
+        '# TYPE bookstore_http_request_duration_seconds histogram',
+    ]
+    for (view, method), values in sorted(totals.latency.items()):
+        cumulative = 0
+        bounds = [_number(float(b)) for b in totals.buckets] + ['+Inf']
+        for bound, count in zip(bounds, values):
+            cumulative += count
+            lines.append('bookstore_http_request_duration_seconds_bucket'
+                         f'{{{_labels(view, method, le=bound)}}} {cumulative}')
+        lines.append(f'bookstore_http_request_duration_seconds_sum{{{_labels(view, method)}}} {_number(values[-1])}')
+        lines.append(f'bookstore_http_request_duration_seconds_count{{{_labels(view, method)}}} {cumulative}')
+
+    lines += [
+        '# HELP bookstore_db_queries_total Database queries run by requests.',
+        '# TYPE bookstore_db_queries_total counter',
+    ]
+    for (view, method), (count, _) in sorted(totals.queries.items()):
+        lines.append(f'bookstore_db_queries_total{{{_labels(view, method)}}} {count}')
+
+    lines += [
+        '# HELP bookstore_db_query_duration_seconds_total Time requests spent in database queries.',
+        '# TYPE bookstore_db_query_duration_seconds_total counter',
+    ]
+    for (view, method), (_, seconds) in sorted(totals.queries.items()):
+        lines.append(f'bookstore_db_query_duration_seconds_total{{{_labels(view, method)}}} {_number(seconds)}')
+
+    lines += [
+        '# HELP bookstore_http_response_bytes_total Response body bytes sent.',
+        '# TYPE bookstore_http_response_bytes_total counter',
+    ]
+    for (view, method), value in sorted(totals.bytes.items()):
+        lines.append(f'bookstore_http_response_bytes_total{{{_labels(view, method)}}} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+def can_scrape(request):
+    """Admins can read the metrics, and so can scrapers sending ``METRICS_TOKEN`` as a bearer token."""
+    token = bearer_token(request)
+    if settings.METRICS_TOKEN and token and hmac.compare_digest(token.encode(), settings.METRICS_TOKEN.encode()):
+        return True
+    return request.user.is_authenticated and request.user.role == CustomUser.ADMIN
+
+
+def metrics_view(request):
+    if request.method != 'GET':
+        return HttpResponse('Method not allowed', status=405)
+    if not can_scrape(request):
+        if request.user.is_authenticated:
+            return HttpResponse('Forbidden', status=403)
+        response = HttpResponse('Authentication required', status=401)
+        response['WWW-Authenticate'] = 'Bearer'
+        return response
+    return HttpResponse(render(collect()), content_type=CONTENT_TYPE)
+
+
+class QueryTimer:
+    """``execute_wrapper`` that counts queries and the time they take."""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.seconds += time.perf_counter() - start
+            self.count += 1
+
+
+def _count_streamed_bytes(content, view, method):
+    size = 0
+    try:
+        for chunk in content:
+            size += len(chunk)
+            yield chunk
+    finally:
+        metrics.add_bytes(view, method, size)
+
+
+async def _acount_streamed_bytes(content, view, method):
+    size = 0
+    try:
+        async for chunk in content:
+            size += len(chunk)
+            yield chunk
+    finally:
+        metrics.add_bytes(view, method, size)
+
+
+class MetricsMiddleware:
+    """
+    Records every request in ``metrics``. Goes first in ``MIDDLEWARE`` so
+    the latency includes the other middleware. Streaming responses are timed
+    until the view returns, their bytes are counted as they are sent.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not settings.METRICS_ENABLED:
+            return self.get_response(request)
+        start = time.perf_counter()
+        with watch_queries(QueryTimer()) as timer:
+            response = self.get_response(request)
+        return self.record(request, response, time.perf_counter() - start, timer)
+
+    async def __acall__(self, request):
+        if not settings.METRICS_ENABLED:
+            return await self.get_response(request)
+        start = time.perf_counter()
+        with watch_queries(QueryTimer()) as timer:
+            response = await self.get_response(request)
+        return self.record(request, response, time.perf_counter() - start, timer)
+
+    def record(self, request, response, elapsed, timer):
+        start_flusher()
+        match = getattr(request, 'resolver_match', None)
+        view = (match and match.url_name) or UNMATCHED
+        method = request.method if request.method in METHODS else 'OTHER'
+        size = None
+        if not getattr(response, 'streaming', False):
+            size = len(response.content)
+        elif response.is_async:
+            response.streaming_content = _acount_streamed_bytes(
+                response.streaming_content, view, method)
+        else:
+            response.streaming_content = _count_streamed_bytes(
+                response.streaming_content, view, method)
+        metrics.observe(view, method, response.status_code, elapsed,
+                        timer.count, timer.seconds, size)
+        return response
@@ -1,8 +1,14 @@
 from django.contrib.auth.models import AbstractUser, PermissionsMixin, BaseUserManager
 from django.db import models
-from bookstore import settings
+from django.conf import settings
 from django.utils import timezone
 import uuid
+from .hashers import hash_password
+
+
+def cart_item_ttl():
+    # how long a book stays in a cart before it expires
+    return timezone.timedelta(seconds=settings.CART_ITEM_TTL_SECONDS)
 
 
 class CustomUserManager(BaseUserManager):
@@ -11,7 +17,7 @@ class CustomUserManager(BaseUserManager):
             raise ValueError('The Email field must be set')
         email = self.normalize_email(email)
         user = self.model(email=email, **extra_fields)
-        user.set_password(password)
+        user.password = hash_password(password)
         user.save(using=self._db)
         return user
 
@@ -55,6 +61,7 @@ class CustomUser(AbstractUser, PermissionsMixin):
 
 class Category(models.Model):
     name = models.CharField(max_length=100, unique=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     def __str__(self):
         return self.name
@@ -67,16 +74,76 @@ class Book(models.Model):
     price = models.DecimalField(max_digits=6, decimal_places=2)
     category = models.ForeignKey(Category, on_delete=models.CASCADE)
     stock = models.PositiveIntegerField()
+    # copies reserved by cart items, already taken out of stock
+    held = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    class Meta:
+        indexes = [
+            # keyset pagination seeks on (sort key, id)
+            models.Index(fields=['price', 'id'], name='book_price_id_idx'),
+            models.Index(fields=['year_published', 'id'],
+                         name='book_year_id_idx'),
+            models.Index(fields=['author_name', 'id'],
+                         name='book_author_id_idx'),
+            # list_books: in-stock books of some categories by title
+            models.Index(fields=['category', 'title', 'id'],
+                         condition=models.Q(stock__gt=0),
+                         name='book_instock_cat_title_idx'),
+        ]
 
     def __str__(self):
         return self.title
 
 
 class CartItem(models.Model):
+    # user lookups use the (user, book) and (user, added_at) indexes
     user = models.ForeignKey(settings.AUTH_USER_MODEL,
-                             on_delete=models.CASCADE)
+                             on_delete=models.CASCADE, db_index=False)
     book = models.ForeignKey(Book, on_delete=models.CASCADE)
     added_at = models.DateTimeField(auto_now_add=True)
+    # True when adding the item moved a copy from the book's stock to held
+    holds_stock = models.BooleanField(default=False)
+
+    class Meta:
+        indexes = [
+            # per-user cart reads and the sweeper's added_at range scan
+            models.Index(fields=['user', 'added_at'],
+                         name='cartitem_user_added_idx'),
+            models.Index(fields=['added_at'], name='cartitem_added_idx'),
+        ]
+        constraints = [
+            # a book is in a cart at most once, see add_book_to_cart
+            models.UniqueConstraint(fields=['user', 'book'],
+                                    name='cartitem_user_book_uniq'),
+        ]
+
+    @staticmethod
+    def expiry_cutoff(now=None):
+        return (now or timezone.now()) - cart_item_ttl()
 
     def is_expired(self):
-        return timezone.now() > self.added_at + timezone.timedelta(minutes=1)
+        return timezone.now() > self.added_at + cart_item_ttl()
+
+
+class Order(models.Model):
+    # the user's history is read through the (user, created_at, id) index
+    user = models.ForeignKey(settings.AUTH_USER_MODEL,
+                             on_delete=models.CASCADE, db_index=False)
+    created_at = models.DateTimeField(default=timezone.now)
+    total = models.DecimalField(max_digits=10, decimal_places=2)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'created_at', 'id'],
+                         name='order_user_created_idx'),
+        ]
+
+
+class OrderLine(models.Model):
+    order = models.ForeignKey(Order, on_delete=models.CASCADE,
+                              related_name='lines')
+    # title and price as they were at checkout, kept if the book goes
+    book = models.ForeignKey(Book, on_delete=models.SET_NULL, null=True)
+    title = models.CharField(max_length=200)
+    price = models.DecimalField(max_digits=6, decimal_places=2)
@@ -0,0 +1,156 @@
+import base64
+import json
+
+from django.db.models import Q
+
+
+# sort orders each listing accepts, every one is backed by an index
+BOOK_ORDERINGS = ('title', 'price', 'year_published', 'author_name', 'id')
+CATEGORY_ORDERINGS = ('name', 'id')
+ORDER_ORDERINGS = ('created_at',)
+
+DEFAULT_PAGE_SIZE = 10
+
+# larger page_size values are capped to this
+MAX_PAGE_SIZE = 100
+
+TRUE_VALUES = ('1', 'true', 'True', 'yes')
+
+
+def encode_cursor(order_by, key, pk):
+    data = json.dumps([order_by, key, pk], default=str, separators=(',', ':'))
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        order_by, key, pk = json.loads(base64.urlsafe_b64decode(padded))
+        return order_by, key, int(pk)
+    except (ValueError, TypeError):
+        raise ValueError('Invalid cursor')
+
+
+def _value(row, field):
+    return row[field] if isinstance(row, dict) else getattr(row, field)
+
+
+class Page:
+    def __init__(self, object_list, next_cursor=None, total=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.total = total
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def meta(self):
+        meta = {'next_cursor': self.next_cursor}
+        if self.total is not None:
+            meta['total'] = self.total
+        return meta
+
+
+class PagePlan:
+    """
+    The queries for one page, worked out from the request's query params.
+    Running them is left to ``paginate`` and ``apaginate`` so sync and async
+    views share the same rules.
+    """
+
+    def __init__(self, request, queryset, orderings, default_order):
+        order_by = request.GET.get('order_by', default_order)
+        field = order_by.lstrip('-')
+        if field not in orderings or order_by.count('-') > 1:
+            raise ValueError(f"Invalid order_by '{order_by}', allowed: "
+                             + ', '.join(orderings))
+        descending = order_by.startswith('-')
+        prefix = '-' if descending else ''
+        if field == 'id':
+            ordering = [order_by]
+        else:
+            ordering = [order_by, prefix + 'id']
+        page_size = min(int(request.GET.get('page_size', DEFAULT_PAGE_SIZE)), MAX_PAGE_SIZE)
+        if page_size < 1:
+            raise ValueError('page_size must be a positive integer')
+
+        self.order_by = order_by
+        self.field = field
+        self.page_size = page_size
+        self.ordered = queryset.order_by(*ordering)
+        self.count_queryset = None
+        if request.GET.get('include_total') in TRUE_VALUES:
+            self.count_queryset = queryset
+
+        self.page_number = None
+        cursor = request.GET.get('cursor')
+        if cursor:
+            cursor_order, key, pk = decode_cursor(cursor)
+            if cursor_order != order_by:
+                raise ValueError('Cursor does not match order_by')
+            op = 'lt' if descending else 'gt'
+            if field == 'id':
+                seek = Q(**{f'id__{op}': pk})
+            else:
+                seek = Q(**{f'{field}__{op}': key}) | Q(**{field: key, f'id__{op}': pk})
+            self.rows = self.ordered.filter(seek)[:page_size + 1]
+        else:
+            try:
+                self.page_number = max(int(request.GET.get('page', 1)), 1)
+            except ValueError:
+                self.page_number = 1
+            offset = (self.page_number - 1) * page_size
+            self.rows = self.ordered[offset:offset + page_size + 1]
+
+    def past_the_end(self, object_list):
+        return not object_list and self.page_number is not None and self.page_number > 1
+
+    def last_page_rows(self, count):
+        # past the end, serve the last page like Paginator.get_page
+        offset = max(count - 1, 0) // self.page_size * self.page_size
+        return self.ordered[offset:offset + self.page_size]
+
+    def page(self, object_list, total, last_page=False):
+        next_cursor = None
+        if not last_page and len(object_list) > self.page_size:
+            object_list = object_list[:self.page_size]
+            last = object_list[-1]
+            next_cursor = encode_cursor(self.order_by, _value(last, self.field),
+                                        _value(last, 'id'))
+        return Page(object_list, next_cursor, total)
+
+
+def paginate(request, queryset, orderings, default_order):
+    """
+    Paginate ``queryset`` from the request's query params.
+
+    Clients pass an opaque ``cursor`` taken from the previous page's
+    ``next_cursor`` and the next page is found by seeking on
+    ``(sort_key, id)``, so deep pages cost the same as the first one.
+    The old ``page`` param still works as an offset. ``order_by`` must be
+    one of ``orderings`` (optionally prefixed with ``-``) and the total row
+    count is only computed when ``include_total`` is set.
+    """
+    plan = PagePlan(request, queryset, orderings, default_order)
+    total = None
+    if plan.count_queryset is not None:
+        total = plan.count_queryset.count()
+    object_list = list(plan.rows)
+    if plan.past_the_end(object_list):
+        count = total if total is not None else plan.ordered.count()
+        return plan.page(list(plan.last_page_rows(count)), total, last_page=True)
+    return plan.page(object_list, total)
+
+
+async def apaginate(request, queryset, orderings, default_order):
+    """Async version of ``paginate`` using the async ORM."""
+    plan = PagePlan(request, queryset, orderings, default_order)
+    total = None
+    if plan.count_queryset is not None:
+        total = await plan.count_queryset.acount()
+    object_list = [row async for row in plan.rows]
+    if plan.past_the_end(object_list):
+        count = total if total is not None else await plan.ordered.acount()
+        object_list = [row async for row in plan.last_page_rows(count)]
+        return plan.page(object_list, total, last_page=True)
+    return plan.page(object_list, total)
@@ -0,0 +1,129 @@
+"""
+Per-view query budgets. ``@query_budget(n)`` declares how many database
+queries a request to the view may make, counting the session and user
+lookups done by middleware. ``QueryBudgetMiddleware`` counts the queries of
+every request and, depending on ``QUERY_BUDGET_MODE``, logs the ones over
+budget ('log') or fails them with a 500 ('reject', for development and
+CI), so an N+1 regression shows up before it reaches prod. In 'reject' mode
+the query past the budget raises ``QueryBudgetExceeded`` instead of running,
+so the transaction it was part of rolls back. Writes committed on their own
+before the budget ran out stay. Views whose work grows with the input, like
+bulk imports, call ``extend_query_budget`` as they go.
+"""
+import logging
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.http import JsonResponse
+from .querywatch import watch_queries
+
+logger = logging.getLogger(__name__)
+
+
+def query_budget(max_queries):
+    """Declare the most queries a request to the decorated view may make."""
+    def decorator(view_func):
+        # functools.wraps copies __dict__, so the budget survives the
+        # decorators applied on top of this one
+        view_func.query_budget = max_queries
+        return view_func
+    return decorator
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+_counter = ContextVar('query_counter', default=None)
+
+# still let an over-budget request undo what it did
+UNDO_STATEMENTS = ('ROLLBACK', 'RELEASE')
+
+
+def extend_query_budget(queries):
+    """Allow the current request ``queries`` more queries than its view declared."""
+    counter = _counter.get()
+    if counter is not None:
+        counter.extra += queries
+
+
+class QueryCounter:
+
+    def __init__(self, request, enforce):
+        self.request = request
+        self.enforce = enforce
+        self.count = 0
+        self.extra = 0
+
+    @property
+    def budget(self):
+        # set in process_view, after this counter started
+        budget = getattr(self.request, 'query_budget', None)
+        return None if budget is None else budget + self.extra
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        budget = self.budget
+        if (self.enforce and budget is not None and self.count > budget
+                and not sql.lstrip()[:8].upper().startswith(UNDO_STATEMENTS)):
+            raise QueryBudgetExceeded(f'Query budget of {budget} exceeded')
+        return execute(sql, params, many, context)
+
+
+class QueryBudgetMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if settings.QUERY_BUDGET_MODE == 'off':
+            return self.get_response(request)
+        counter = QueryCounter(request, settings.QUERY_BUDGET_MODE == 'reject')
+        token = _counter.set(counter)
+        try:
+            with watch_queries(counter):
+                response = self.get_response(request)
+        finally:
+            _counter.reset(token)
+        return self.check(request, response, counter)
+
+    async def __acall__(self, request):
+        if settings.QUERY_BUDGET_MODE == 'off':
+            return await self.get_response(request)
+        counter = QueryCounter(request, settings.QUERY_BUDGET_MODE == 'reject')
+        token = _counter.set(counter)
+        try:
+            with watch_queries(counter):
+                response = await self.get_response(request)
+        finally:
+            _counter.reset(token)
+        return self.check(request, response, counter)
+
+    def check(self, request, response, counter):
+        budget = counter.budget
+        if budget is None or counter.count <= budget:
+            return response
+        view = request.resolver_match.view_name
+        message = f'{view} made {counter.count} queries, budget is {budget}'
+        if counter.enforce:
+            logger.error(message)
+            return JsonResponse({'error': f'Query budget exceeded: {message}'}, status=500)
+        logger.warning(message)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.query_budget = getattr(view_func, 'query_budget', None)
+        return None
+
+    def process_exception(self, request, exception):
+        # raised outside the view's own error handling, check() answers it
+        if isinstance(exception, QueryBudgetExceeded):
+            return JsonResponse({'error': str(exception)}, status=500)
+        return None
@@ -0,0 +1,45 @@
+"""
+Query observers that follow a request into every thread it uses.
+``connection.execute_wrapper`` only sees the queries of the thread that
+installed it, while an async view's ORM calls run in a sync_to_async
+thread. ``watch_queries`` keeps the observers in a context variable instead,
+which sync_to_async copies into that thread, and ``observe_queries``,
+installed on every connection as it is created, passes each query through
+the observers of the current context.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import partial
+
+
+_observers = ContextVar('query_observers', default=())
+
+
+def _run(observers, execute, sql, params, many, context):
+    if not observers:
+        return execute(sql, params, many, context)
+    return observers[0](partial(_run, observers[1:], execute), sql, params, many, context)
+
+
+def observe_queries(execute, sql, params, many, context):
+    return _run(_observers.get(), execute, sql, params, many, context)
+
+
+def install_query_observers(sender, connection, **kwargs):
+    # connection_created fires again on reconnect. First in the list, so an
+    # execute_wrapper() block that was open during the connect pops its own
+    if observe_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, observe_queries)
+
+
+@contextmanager
+def watch_queries(observer):
+    """
+    Pass every query run in this context, in this thread or a sync_to_async
+    one, through ``observer``, which has the ``execute_wrapper`` signature.
+    """
+    token = _observers.set(_observers.get() + (observer,))
+    try:
+        yield observer
+    finally:
+        _observers.reset(token)
@@ -0,0 +1,203 @@
+"""
+Rate limiting and admission control.
+
+Each request is charged one token from a bucket keyed on its route and
+client, where the client is the authenticated user or else the remote
+address. Cookies are never trusted on their own: a client could send a new
+session id with every request to get a fresh bucket each time.
+Routes listed in ``CONCURRENCY_LIMITS`` also get a cap on requests in
+flight. Both answer 429 with ``Retry-After`` when exceeded.
+"""
+import math
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import caches
+from django.http import JsonResponse
+
+
+class MemoryBuckets:
+    """Token buckets in process memory."""
+
+    def __init__(self):
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst):
+        """Take one token, returning 0 or the seconds until one is available."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated, _ = self._buckets.get(key, (burst, now, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            wait = 0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / rate
+            # the third item is when the bucket will be full again
+            self._buckets[key] = (tokens, now, now + (burst - tokens) / rate)
+            if len(self._buckets) > settings.RATE_LIMIT_MAX_KEYS:
+                self._prune(now)
+            return wait
+
+    def _prune(self, now):
+        # drop buckets that have refilled, they behave like new ones
+        for key, (_, _, full_at) in list(self._buckets.items()):
+            if full_at <= now:
+                del self._buckets[key]
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+class CacheBuckets:
+    """
+    Fixed-window counters in a Django cache, shared by every process using
+    the same cache. Allows ``burst`` requests per ``burst / rate`` seconds.
+    """
+
+    def take(self, key, rate, burst):
+        cache = caches[settings.RATE_LIMIT_CACHE_ALIAS]
+        window = burst / rate
+        now = time.time()
+        slot = int(now // window)
+        cache_key = f'ratelimit:{key}:{slot}'
+        cache.add(cache_key, 0, timeout=math.ceil(window) + 1)
+        try:
+            count = cache.incr(cache_key)
+        except ValueError:
+            count = 1
+        if count <= burst:
+            return 0
+        return (slot + 1) * window - now
+
+    def clear(self):
+        pass
+
+
+memory_buckets = MemoryBuckets()
+cache_buckets = CacheBuckets()
+
+_in_flight = {}
+_in_flight_lock = threading.Lock()
+
+
+def _buckets():
+    return cache_buckets if settings.RATE_LIMIT_STORE == 'cache' else memory_buckets
+
+
+def client_key(request, user):
+    if user.is_authenticated:
+        return f'user:{user.pk}'
+    return f"ip:{request.META.get('REMOTE_ADDR', '')}"
+
+
+def too_many_requests(retry_after):
+    response = JsonResponse({'error': 'Too many requests'}, status=429)
+    response['Retry-After'] = str(max(math.ceil(retry_after), 1))
+    return response
+
+
+def _acquire(route, limit):
+    with _in_flight_lock:
+        count = _in_flight.get(route, 0)
+        if count >= limit:
+            return False
+        _in_flight[route] = count + 1
+        return True
+
+
+def _release(route):
+    with _in_flight_lock:
+        _in_flight[route] -= 1
+
+
+def _release_when_done(response, route):
+    # a streamed body is still being produced after the view returns
+    if not getattr(response, 'streaming', False):
+        _release(route)
+    elif response.is_async:
+        response.streaming_content = _arelease_after_streaming(response.streaming_content, route)
+    else:
+        response.streaming_content = _release_after_streaming(response.streaming_content, route)
+    return response
+
+
+def _release_after_streaming(content, route):
+    try:
+        yield from content
+    finally:
+        _release(route)
+
+
+async def _arelease_after_streaming(content, route):
+    try:
+        async for chunk in content:
+            yield chunk
+    finally:
+        _release(route)
+
+
+class RateLimitMiddleware:
+    """
+    Admits requests in ``process_view``, where Django has already resolved
+    the route, and releases their concurrency slot in ``__call__`` once the
+    rest of the chain has answered, so sync and async views are capped the
+    same way and a streamed body keeps its slot until it is sent.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        try:
+            response = self.get_response(request)
+        except BaseException:
+            self.release(request)
+            raise
+        return self.release(request, response)
+
+    async def __acall__(self, request):
+        try:
+            response = await self.get_response(request)
+        except BaseException:
+            self.release(request)
+            raise
+        return self.release(request, response)
+
+    def release(self, request, response=None):
+        route = getattr(request, '_in_flight_route', None)
+        if route is None:
+            return response
+        del request._in_flight_route
+        if response is None:
+            _release(route)
+            return None
+        return _release_when_done(response, route)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if not settings.RATE_LIMIT_ENABLED:
+            return None
+        route = request.resolver_match.url_name or request.path
+        limits = settings.RATE_LIMITS
+        rate, burst = limits.get(route) or limits['default']
+        wait = _buckets().take(f'{route}:{client_key(request, request.user)}', rate, burst)
+        if wait:
+            return too_many_requests(wait)
+        limit = settings.CONCURRENCY_LIMITS.get(route)
+        if limit is None:
+            return None
+        if not _acquire(route, limit):
+            return too_many_requests(1)
+        # released by __call__ after the view and the inner middleware
+        request._in_flight_route = route
+        return None
@@ -0,0 +1,199 @@
+"""
+Stock reservations. Adding a book to a cart moves one copy from
+``Book.stock`` to ``Book.held`` with a single conditional UPDATE, so the race
+for the last copy is settled there and never at checkout. Checkout turns the
+held copies into sales, and cart items that expire or are removed give
+theirs back. Cart items created before reservations existed have
+``holds_stock`` False and are still bought from stock at checkout.
+"""
+from collections import Counter
+
+from django.db import connections, router, transaction
+from django.db.models import F
+from django.utils import timezone
+from .catalog_cache import bump_catalog_version
+from .models import Book, CartItem
+
+
+ADDED = 'added'
+ALREADY_IN_CART = 'already_in_cart'
+UNAVAILABLE = 'unavailable'
+# batch results tell the two reasons for UNAVAILABLE apart
+OUT_OF_STOCK = 'out_of_stock'
+MISSING = 'missing'
+REMOVED = 'removed'
+NOT_IN_CART = 'not_in_cart'
+
+CART_ITEM_TABLE = CartItem._meta.db_table
+
+
+def _by_count(book_ids):
+    # one UPDATE per distinct number of copies, usually just one
+    groups = {}
+    for book_id, count in Counter(book_ids).items():
+        groups.setdefault(count, []).append(book_id)
+    return groups.items()
+
+
+def reserve(book_id):
+    """Hold one copy of the book. Returns False if none is in stock."""
+    reserved = Book.objects.filter(id=book_id, stock__gt=0).update(
+        stock=F('stock') - 1, held=F('held') + 1, updated_at=timezone.now())
+    if reserved:
+        # stock is shown in listings, see checkout_cart
+        bump_catalog_version()
+    return bool(reserved)
+
+
+def release(book_ids):
+    """Put the copies held for ``book_ids`` (one per occurrence) back in stock."""
+    if not book_ids:
+        return
+    now = timezone.now()
+    for count, ids in _by_count(book_ids):
+        Book.objects.filter(id__in=ids).update(
+            stock=F('stock') + count, held=F('held') - count, updated_at=now)
+    bump_catalog_version()
+
+
+def sell_held(book_ids):
+    """Turn the copies held for ``book_ids`` into sales. Stock doesn't change."""
+    for count, ids in _by_count(book_ids):
+        Book.objects.filter(id__in=ids).update(held=F('held') - count)
+
+
+def insert_cart_item(user, book_id):
+    """
+    Add a cart item holding stock unless the user already has the book,
+    in one INSERT that leaves conflicts with ``cartitem_user_book_uniq``
+    alone. Returns False if the book was already in the cart.
+    """
+    connection = connections[router.db_for_write(CartItem)]
+    if connection.vendor not in ('sqlite', 'postgresql'):
+        if CartItem.objects.filter(user=user, book_id=book_id).exists():
+            return False
+        CartItem.objects.create(user=user, book_id=book_id, holds_stock=True)
+        return True
+    added_at = connection.ops.adapt_datetimefield_value(timezone.now())
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""INSERT INTO {CART_ITEM_TABLE} (user_id, book_id, added_at, holds_stock)
+                VALUES (%s, %s, %s, %s) ON CONFLICT (user_id, book_id) DO NOTHING""",
+            [user.pk, book_id, added_at, True])
+        return cursor.rowcount == 1
+
+
+def add_book_to_cart(user, book_id):
+    """Reserve a copy and add it to the cart, returning ADDED, ALREADY_IN_CART or UNAVAILABLE."""
+    # no savepoint: callers don't catch errors from here inside their own transaction
+    with transaction.atomic(savepoint=False):
+        if not insert_cart_item(user, book_id):
+            return ALREADY_IN_CART
+        if not reserve(book_id):
+            # rare, so undoing the insert beats checking stock first
+            CartItem.objects.filter(user=user, book_id=book_id).delete()
+            return UNAVAILABLE
+    return ADDED
+
+
+def _discard(queryset):
+    # returns the (id, book_id, holds_stock) rows deleted
+    with transaction.atomic(savepoint=False):
+        rows = list(queryset.select_for_update(of=('self',)).values_list('id', 'book_id', 'holds_stock'))
+        if rows:
+            CartItem.objects.filter(id__in=[row[0] for row in rows]).delete()
+            release([book_id for _, book_id, holds_stock in rows if holds_stock])
+    return rows
+
+
+def discard_cart_items(queryset):
+    """
+    Delete the cart items in ``queryset`` and release the copies they hold.
+    The rows are locked first, so two callers racing over the same items
+    can't both release them. Returns the number of items deleted.
+    """
+    return len(_discard(queryset))
+
+
+def insert_cart_items(user, book_ids):
+    """
+    Add cart items holding stock for ``book_ids`` in one INSERT that leaves
+    conflicts with ``cartitem_user_book_uniq`` alone, like
+    ``insert_cart_item``. Returns the ids of the books it inserted.
+    """
+    if not book_ids:
+        return set()
+    connection = connections[router.db_for_write(CartItem)]
+    if connection.vendor not in ('sqlite', 'postgresql'):
+        in_cart = set(CartItem.objects.filter(user=user, book_id__in=book_ids).values_list('book_id', flat=True))
+        new = [book_id for book_id in book_ids if book_id not in in_cart]
+        CartItem.objects.bulk_create([CartItem(user=user, book_id=book_id, holds_stock=True) for book_id in new])
+        return set(new)
+    added_at = connection.ops.adapt_datetimefield_value(timezone.now())
+    values = ', '.join(['(%s, %s, %s, %s)'] * len(book_ids))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""INSERT INTO {CART_ITEM_TABLE} (user_id, book_id, added_at, holds_stock)
+                VALUES {values} ON CONFLICT (user_id, book_id) DO NOTHING RETURNING book_id""",
+            [value for book_id in book_ids for value in (user.pk, book_id, added_at, True)])
+        return {row[0] for row in cursor.fetchall()}
+
+
+def add_books_to_cart(user, book_ids):
+    """
+    Add many books to the cart with at most four queries whatever their
+    number. Returns ``{book_id: status}`` in the order given, the status
+    being ADDED, ALREADY_IN_CART, OUT_OF_STOCK or MISSING.
+    """
+    book_ids = list(dict.fromkeys(book_ids))
+    if not book_ids:
+        return {}
+    with transaction.atomic(savepoint=False):
+        # locked so the copies counted here are still there for the UPDATE
+        stock = dict(Book.objects.select_for_update().filter(id__in=book_ids).values_list('id', 'stock'))
+        # only the rows this INSERT created get a copy, the others were already in the cart
+        added = insert_cart_items(user, [book_id for book_id in book_ids if stock.get(book_id, 0) > 0])
+        if added:
+            Book.objects.filter(id__in=added).update(
+                stock=F('stock') - 1, held=F('held') + 1, updated_at=timezone.now())
+        sold_out = [book_id for book_id in book_ids if stock.get(book_id) == 0]
+        in_cart = set()
+        if sold_out:
+            in_cart = set(CartItem.objects.filter(user=user, book_id__in=sold_out)
+                          .values_list('book_id', flat=True))
+    results = {}
+    for book_id in book_ids:
+        if book_id not in stock:
+            results[book_id] = MISSING
+        elif book_id in added:
+            results[book_id] = ADDED
+        elif stock[book_id] > 0 or book_id in in_cart:
+            results[book_id] = ALREADY_IN_CART
+        else:
+            results[book_id] = OUT_OF_STOCK
+    if added:
+        bump_catalog_version()
+    return results
+
+
+def remove_books_from_cart(user, book_ids):
+    """
+    Remove books from the cart and release their copies. Returns
+    ``{book_id: status}`` in the order given, REMOVED or NOT_IN_CART.
+    """
+    book_ids = list(dict.fromkeys(book_ids))
+    if not book_ids:
+        return {}
+    removed = {book_id for _, book_id, _ in _discard(CartItem.objects.filter(user=user, book_id__in=book_ids))}
+    return {book_id: REMOVED if book_id in removed else NOT_IN_CART for book_id in book_ids}
+
+
+def replace_cart(user, book_ids):
+    """
+    Make the cart hold exactly ``book_ids``: remove the other items, then add
+    the new ones. Returns the add results and the ids of the books removed.
+    """
+    with transaction.atomic(savepoint=False):
+        rows = _discard(CartItem.objects.filter(user=user).exclude(book_id__in=book_ids))
+        results = add_books_to_cart(user, book_ids)
+    return results, [book_id for _, book_id, _ in rows]
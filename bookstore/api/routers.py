@@ -0,0 +1,153 @@
+"""
+Read replicas for the catalog. Views decorated with ``@replica_reads`` read
+books and categories from one of ``settings.DATABASE_REPLICAS`` on GET and
+HEAD requests. Everything else goes to the primary: writes, other models,
+queries inside ``transaction.atomic`` and requests from clients that wrote
+something in the last ``REPLICA_STICKY_SECONDS`` seconds, so users read their
+own writes. ``ReplicaPinningMiddleware`` tracks those writes with a cookie,
+which works across processes without a shared cache.
+"""
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from .querywatch import watch_queries
+
+
+CATALOG_MODELS = {'api.book', 'api.category'}
+READ_METHODS = {'GET', 'HEAD'}
+
+WRITE_STATEMENTS = ('INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+
+# set while a @replica_reads view handles a read request
+_use_replica = ContextVar('use_replica', default=False)
+# set inside track_replica_reads()
+_replica_reads = ContextVar('replica_reads', default=None)
+
+
+def _replica_allowed(request):
+    return (settings.DATABASE_REPLICAS and request.method in READ_METHODS
+            and not getattr(request, 'replica_pinned', False))
+
+
+def replica_reads(view_func):
+    """Let the view's catalog reads go to a replica."""
+    if iscoroutinefunction(view_func):
+        @wraps(view_func)
+        async def _async_wrapped_view(request, *args, **kwargs):
+            token = _use_replica.set(bool(_replica_allowed(request)))
+            try:
+                return await view_func(request, *args, **kwargs)
+            finally:
+                _use_replica.reset(token)
+        return _async_wrapped_view
+
+    @wraps(view_func)
+    def _wrapped_view(request, *args, **kwargs):
+        token = _use_replica.set(bool(_replica_allowed(request)))
+        try:
+            return view_func(request, *args, **kwargs)
+        finally:
+            _use_replica.reset(token)
+    return _wrapped_view
+
+
+class ReplicaReads:
+    """Whether a catalog read inside a ``track_replica_reads`` block went to a replica."""
+
+    def __init__(self):
+        self.used = False
+
+
+@contextmanager
+def track_replica_reads():
+    reads = ReplicaReads()
+    token = _replica_reads.set(reads)
+    try:
+        yield reads
+    finally:
+        _replica_reads.reset(token)
+
+
+class ReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        if not _use_replica.get() or model._meta.label_lower not in CATALOG_MODELS:
+            return None
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            # a transaction must see its own writes
+            return None
+        reads = _replica_reads.get()
+        if reads is not None:
+            reads.used = True
+        return random.choice(settings.DATABASE_REPLICAS)
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # replicas hold the same rows as the primary
+        databases = {DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in settings.DATABASE_REPLICAS:
+            return False
+        return None
+
+
+class WriteDetector:
+
+    def __init__(self):
+        self.wrote = False
+
+    def __call__(self, execute, sql, params, many, context):
+        # select_for_update also goes through db_for_write, so look at the SQL
+        if (context['connection'].alias == DEFAULT_DB_ALIAS
+                and sql.lstrip()[:7].upper().startswith(WRITE_STATEMENTS)):
+            self.wrote = True
+        return execute(sql, params, many, context)
+
+
+class ReplicaPinningMiddleware:
+    """
+    Sends a client's reads to the primary for ``REPLICA_STICKY_SECONDS``
+    after a request of theirs wrote to the database.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not settings.DATABASE_REPLICAS:
+            return self.get_response(request)
+        request.replica_pinned = settings.REPLICA_PIN_COOKIE in request.COOKIES
+        with watch_queries(WriteDetector()) as detector:
+            response = self.get_response(request)
+        return self.pin(response, detector)
+
+    async def __acall__(self, request):
+        if not settings.DATABASE_REPLICAS:
+            return await self.get_response(request)
+        request.replica_pinned = settings.REPLICA_PIN_COOKIE in request.COOKIES
+        with watch_queries(WriteDetector()) as detector:
+            response = await self.get_response(request)
+        return self.pin(response, detector)
+
+    def pin(self, response, detector):
+        if detector.wrote:
+            response.set_cookie(settings.REPLICA_PIN_COOKIE, '1', max_age=settings.REPLICA_STICKY_SECONDS,
+                                httponly=True, samesite='Lax')
+        return response
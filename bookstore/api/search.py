@@ -0,0 +1,123 @@
+import re
+
+from django.db import connections, router
+from .models import Book
+from .serializers import book_values
+
+
+BOOK_TABLE = Book._meta.db_table
+FTS_TABLE = f'{BOOK_TABLE}_fts'
+
+# triggers keep the FTS table in step with every write to the book table,
+# including bulk_create() and update() which send no model signals
+SQLITE_SCHEMA = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        title, author_name, tokenize='unicode61 remove_diacritics 2')""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON {BOOK_TABLE} BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, title, author_name)
+        VALUES (new.id, new.title, new.author_name);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON {BOOK_TABLE} BEGIN
+        DELETE FROM {FTS_TABLE} WHERE rowid = old.id;
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au
+        AFTER UPDATE OF title, author_name ON {BOOK_TABLE} BEGIN
+        UPDATE {FTS_TABLE} SET title = new.title, author_name = new.author_name
+        WHERE rowid = old.id;
+    END""",
+]
+
+POSTGRES_SCHEMA = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    f"""CREATE INDEX IF NOT EXISTS {BOOK_TABLE}_title_trgm
+        ON {BOOK_TABLE} USING gin (title gin_trgm_ops)""",
+    f"""CREATE INDEX IF NOT EXISTS {BOOK_TABLE}_author_trgm
+        ON {BOOK_TABLE} USING gin (author_name gin_trgm_ops)""",
+]
+
+
+def _connection():
+    return connections[router.db_for_write(Book)]
+
+
+def ensure_search_index(using=None):
+    """Create the search index for the current backend if it is missing."""
+    connection = connections[using] if using else _connection()
+    if BOOK_TABLE not in connection.introspection.table_names():
+        # api migrations not created or applied yet
+        return
+    if connection.vendor == 'sqlite':
+        statements = SQLITE_SCHEMA
+    elif connection.vendor == 'postgresql':
+        statements = POSTGRES_SCHEMA
+    else:
+        return
+    with connection.cursor() as cursor:
+        for statement in statements:
+            cursor.execute(statement)
+
+
+def rebuild_search_index(using=None):
+    """Drop and rebuild the search index from the book table."""
+    connection = connections[using] if using else _connection()
+    if connection.vendor != 'sqlite':
+        ensure_search_index(using)
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+        for suffix in ('ai', 'ad', 'au'):
+            cursor.execute(f'DROP TRIGGER IF EXISTS {FTS_TABLE}_{suffix}')
+    ensure_search_index(using)
+    with connection.cursor() as cursor:
+        cursor.execute(f"""INSERT INTO {FTS_TABLE}(rowid, title, author_name)
+                           SELECT id, title, author_name FROM {BOOK_TABLE}""")
+        cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('optimize')")
+
+
+def fts_query(text):
+    # quote every word so user input can never be read as FTS5 syntax,
+    # and let the last word match as a prefix for search-as-you-type
+    words = re.findall(r'\w+', text)
+    if not words:
+        return None
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def search_book_ids(text, offset, limit):
+    """Ids of in-stock books matching ``text``, best match first."""
+    connection = _connection()
+    if connection.vendor == 'sqlite':
+        query = fts_query(text)
+        if query is None:
+            return []
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""SELECT f.rowid FROM {FTS_TABLE} f
+                    JOIN {BOOK_TABLE} b ON b.id = f.rowid
+                    WHERE {FTS_TABLE} MATCH %s AND b.stock > 0
+                    ORDER BY f.rank LIMIT %s OFFSET %s""",
+                [query, limit, offset])
+            return [row[0] for row in cursor.fetchall()]
+
+    books = Book.objects.filter(stock__gt=0)
+    if connection.vendor == 'postgresql':
+        from django.contrib.postgres.search import TrigramWordSimilarity
+        from django.db.models.functions import Greatest
+        books = books.annotate(similarity=Greatest(
+            TrigramWordSimilarity(text, 'title'),
+            TrigramWordSimilarity(text, 'author_name'),
+        )).filter(similarity__gt=0.3).order_by('-similarity', 'id')
+    else:
+        from django.db.models import Q
+        books = books.filter(Q(title__icontains=text) | Q(author_name__icontains=text)) \
+            .order_by('title', 'id')
+    return list(books.values_list('id', flat=True)[offset:offset + limit])
+
+
+def search_books(text, offset, limit):
+    """``book_values`` rows of the matching books, in rank order."""
+    ids = search_book_ids(text, offset, limit)
+    books = {row['id']: row for row in book_values(Book.objects.filter(id__in=ids))}
+    return [books[book_id] for book_id in ids if book_id in books]
@@ -1,5 +1,7 @@
+from decimal import Decimal
 from rest_framework import serializers
 from .models import Book , Category
+from .category_map import category_map
 
 class BookSerializer(serializers.ModelSerializer):
     category = serializers.CharField(source='category.name')
@@ -12,3 +14,55 @@ class CategorySerializer(serializers.ModelSerializer):
     class Meta:
         model = Category
         fields = ['id', 'name']
+
+
+# Fast path for listings: rows are read with values(), category names come
+# from the process-local category map, and the rows are turned into the
+# exact dicts BookSerializer returns, without DRF's per-field machinery, a
+# join or a per-row category fetch.
+
+BOOK_VALUES = ('id', 'title', 'year_published', 'author_name', 'price', 'category_id', 'stock')
+
+_CENTS = Decimal('0.01')
+
+
+def book_values(queryset):
+    return queryset.values(*BOOK_VALUES)
+
+
+def serialize_book_rows(rows, categories=None):
+    """
+    Serialize ``book_values`` rows the same way as ``BookSerializer``.
+    ``categories`` is a category map that knows every row's category. Rows
+    are never left out, the page is already sliced: a book a lagging
+    replica still returns after the primary deleted its category is listed
+    with no category.
+    """
+    rows = list(rows)
+    if categories is None:
+        categories = category_map({row['category_id'] for row in rows})
+    names = categories.by_id
+    return [{
+        'id': row['id'],
+        'title': row['title'],
+        'year_published': row['year_published'],
+        'author_name': row['author_name'],
+        'price': _money(row['price']),
+        'category': names.get(row['category_id']),
+        'stock': row['stock'],
+    } for row in rows]
+
+
+def _money(value):
+    return f"{Decimal(value).quantize(_CENTS):f}"
+
+
+def serialize_orders(orders):
+    """Serialize orders with their prefetched lines."""
+    return [{
+        'id': order.id,
+        'created_at': order.created_at,
+        'total': _money(order.total),
+        'lines': [{'book_id': line.book_id, 'title': line.title, 'price': _money(line.price)}
+                  for line in order.lines.all()],
+    } for order in orders]
@@ -0,0 +1,40 @@
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from .backends import invalidate_cached_user
+from .catalog_cache import bump_catalog_version
+from .category_map import invalidate_category_map
+from .search import ensure_search_index
+from .models import Book, CartItem, Category, CustomUser
+from .reservations import discard_cart_items
+
+
+@receiver(post_save, sender=Book)
+@receiver(post_delete, sender=Book)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_catalog(sender, **kwargs):
+    bump_catalog_version()
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_categories(sender, **kwargs):
+    invalidate_category_map()
+
+
+@receiver(post_save, sender=CustomUser)
+@receiver(post_delete, sender=CustomUser)
+def invalidate_user(sender, instance, **kwargs):
+    # password and role changes must not be served from the user cache
+    invalidate_cached_user(instance.pk)
+
+
+@receiver(pre_delete, sender=CustomUser)
+def release_held_stock(sender, instance, **kwargs):
+    # the cascade would delete the cart without giving its holds back
+    discard_cart_items(CartItem.objects.filter(user=instance))
+
+
+def create_search_index(sender, using, **kwargs):
+    ensure_search_index(using)
@@ -0,0 +1,29 @@
+"""
+SQLite tuning for concurrent traffic. ``configure_sqlite`` runs on every new
+SQLite connection and applies ``settings.SQLITE_PRAGMAS``: WAL so readers
+don't block the writer, a busy timeout so writers wait for the lock instead
+of failing with "database is locked", ``synchronous=NORMAL`` (safe with WAL)
+and larger mmap and page caches. Together with ``CONN_MAX_AGE`` the pragmas
+run once per connection, not once per request.
+"""
+from django.conf import settings
+
+
+def configure_sqlite(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for name, value in settings.SQLITE_PRAGMAS.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+
+
+def sqlite_pragmas(connection):
+    """The current value of each pragma in ``SQLITE_PRAGMAS``, for checks and benchmarks."""
+    with connection.cursor() as cursor:
+        values = {}
+        for name in settings.SQLITE_PRAGMAS:
+            cursor.execute(f'PRAGMA {name}')
+            row = cursor.fetchone()
+            # some pragmas, like mmap_size on an in-memory database, return nothing
+            values[name] = row[0] if row else None
+    return values
@@ -0,0 +1,70 @@
+import logging
+import threading
+
+from django.conf import settings
+from django.db import close_old_connections
+from .models import CartItem
+from .reservations import discard_cart_items
+
+logger = logging.getLogger(__name__)
+
+
+def purge_expired_cart_items(batch_size=None, now=None, user=None):
+    """
+    Delete expired cart items in batches of at most ``batch_size`` rows so
+    a large backlog never holds the write lock for long, releasing the stock
+    they held. Returns the number of rows deleted.
+    """
+    batch_size = batch_size or settings.CART_SWEEPER_BATCH_SIZE
+    expired = CartItem.objects.filter(added_at__lt=CartItem.expiry_cutoff(now))
+    if user is not None:
+        expired = expired.filter(user=user)
+    deleted = 0
+    while True:
+        ids = list(expired.values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return deleted
+        deleted += discard_cart_items(CartItem.objects.filter(id__in=ids))
+        if len(ids) < batch_size:
+            return deleted
+
+
+class CartSweeper(threading.Thread):
+    """Daemon thread that purges expired cart items every ``interval`` seconds."""
+
+    def __init__(self, interval, batch_size=None):
+        super().__init__(name='cart-sweeper', daemon=True)
+        self.interval = interval
+        self.batch_size = batch_size
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            close_old_connections()
+            try:
+                deleted = purge_expired_cart_items(self.batch_size)
+                if deleted:
+                    logger.info('Purged %d expired cart items', deleted)
+            except Exception:
+                logger.exception('Expired cart sweep failed')
+            finally:
+                close_old_connections()
+
+    def stop(self):
+        self._stopped.set()
+
+
+_sweeper = None
+_sweeper_lock = threading.Lock()
+
+
+def start_cart_sweeper():
+    global _sweeper
+    interval = settings.CART_SWEEPER_INTERVAL
+    if not interval:
+        return None
+    with _sweeper_lock:
+        if _sweeper is None:
+            _sweeper = CartSweeper(interval)
+            _sweeper.start()
+    return _sweeper
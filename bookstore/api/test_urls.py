@@ -0,0 +1,4 @@
+# urlconf for AsyncViewTests, routes the hot views to api.async_views
+from .urls import build_urlpatterns
+
+urlpatterns = build_urlpatterns(async_views=True)
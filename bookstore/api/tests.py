@@ -1,8 +1,41 @@
-from django.test import TestCase, Client
-from django.urls import reverse
-from .models import CustomUser, Category, Book, CartItem
+from django.test import TestCase, TransactionTestCase, Client, override_settings
+from django.core.management import call_command
+from django.urls import resolve, reverse
+from asgiref.sync import iscoroutinefunction
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.http import http_date
+from .models import CustomUser, Category, Book, CartItem, Order, OrderLine
 import json
 from .validators import *
+from .sweeper import purge_expired_cart_items
+from .catalog_cache import (bump_catalog_version, cached_listing, catalog_cache_stats, catalog_last_modified,
+                            get_catalog_version, listing_key)
+from .bulk_import import import_books
+from .serializers import BookSerializer, book_values, serialize_book_rows
+from .backends import user_cache
+from .ratelimit import memory_buckets, _acquire, _release
+from .sqlite import sqlite_pragmas
+from .hashers import HashingBusy, run_hasher
+from .querybudget import QueryBudgetMiddleware
+from .tokens import TokenAuthenticationMiddleware
+from .routers import ReplicaPinningMiddleware, ReplicaRouter, replica_reads
+from .reservations import add_book_to_cart, add_books_to_cart
+from benchmarks.seed import clear_seed_data
+from .category_map import category_map, invalidate_category_map
+from . import catalog_cache, views
+from unittest import mock
+from contextlib import ExitStack
+from io import StringIO
+from . import metrics as request_metrics
+import csv
+from decimal import Decimal
+import os
+import subprocess
+import sys
+import tempfile
 
 class ViewTests(TestCase):
 
@@ -127,4 +160,1288 @@ class ViewTests(TestCase):
         self.client.login(email='user@example.com', password='password')
         response = self.client.post(reverse('logout_user'))
         self.assertEqual(response.status_code, 200)
-        self.assertIn('Logout Success', response.content.decode())
\ No newline at end of file
+        self.assertIn('Logout Success', response.content.decode())
+
+class ValidatorTests(TestCase):
+
+    def test_schemas_are_compiled_once(self):
+        validator = VALIDATORS['manage_books_post']
+        self.assertIs(get_validator('manage_books_post'), validator)
+        validate_manage_books_post_payload({
+            'title': 'Book', 'year_published': 2020, 'author_name': 'Author',
+            'price': 1.5, 'category': 'Fiction', 'stock': 1})
+        self.assertIs(VALIDATORS['manage_books_post'], validator)
+
+    def test_error_messages_unchanged(self):
+        with self.assertRaisesMessage(ValueError, "manage_category_post_payload validation error: 'name' is a required property"):
+            validate_manage_category_post_payload({})
+        with self.assertRaisesMessage(ValueError, 'manage_books_post_payload validation error'):
+            validate_manage_books_put_payload({})
+        with self.assertRaisesMessage(ValueError, 'Invalid email'):
+            validate_post_login_payload({'email': 'not-an-email', 'password': 'x'})
+        with self.assertRaisesMessage(ValueError, 'Invalid email'):
+            validate_post_login_payload({'email': 1, 'password': 'x'})
+
+    def test_all_errors_reported_in_one_pass(self):
+        with self.assertRaises(ValueError) as ctx:
+            validate_manage_category_put_payload({'old_name': ''}, all_errors=True)
+        message = str(ctx.exception)
+        self.assertIn("'new_name' is a required property", message)
+        self.assertIn('should be non-empty', message)
+
+
+class CheckoutTests(TestCase):
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(email='buyer@example.com', password='password')
+        self.category = Category.objects.create(name='Fiction')
+        self.client.force_login(self.user)
+
+    def fill_cart(self, count, stock=1):
+        for i in range(count):
+            book = Book.objects.create(title=f'Book {i}', year_published=2020, author_name='Author',
+                                       price=10, category=self.category, stock=stock)
+            CartItem.objects.create(user=self.user, book=book)
+
+    def checkout_queries(self, count):
+        self.fill_cart(count)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.put(reverse('checkout'), content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        CartItem.objects.all().delete()
+        Book.objects.all().delete()
+        return len(ctx.captured_queries)
+
+    def test_query_count_independent_of_cart_size(self):
+        self.client.get(reverse('view_cart'))  # warm the session and user caches
+        self.assertEqual(self.checkout_queries(1), self.checkout_queries(10))
+
+    def test_sorts_expired_out_of_stock_and_purchased(self):
+        self.fill_cart(3)
+        Book.objects.filter(title='Book 1').update(stock=0)
+        CartItem.objects.filter(book__title='Book 2').update(
+            added_at=timezone.now() - timezone.timedelta(minutes=5))
+        response = self.client.put(reverse('checkout'), content_type='application/json')
+        self.assertEqual(response.json(), {
+            'message': 'Transaction Summary',
+            'order_summary': ['Book 0'],
+            'expired_books': ['Book 2'],
+            'out_of_stock': ['Book 1'],
+            'order_id': Order.objects.get().id,
+        })
+        self.assertEqual(Book.objects.get(title='Book 0').stock, 0)
+        self.assertEqual(Book.objects.get(title='Book 2').stock, 1)
+        self.assertEqual(CartItem.objects.count(), 0)
+
+    def test_empty_cart(self):
+        response = self.client.put(reverse('checkout'), content_type='application/json')
+        self.assertEqual(response.json(), {'message': 'Cart is empty'})
+
+
+class CartExpiryTests(TestCase):
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(email='cart@example.com', password='password')
+        category = Category.objects.create(name='Fiction')
+        self.books = [Book.objects.create(title=f'Book {i}', year_published=2020, author_name='Author',
+                                          price=10, category=category, stock=3) for i in range(5)]
+        self.client.force_login(self.user)
+
+    def add_items(self, age_minutes):
+        for book in self.books:
+            item = CartItem.objects.create(user=self.user, book=book)
+            CartItem.objects.filter(id=item.id).update(
+                added_at=timezone.now() - timezone.timedelta(minutes=age_minutes))
+
+    def test_purge_deletes_expired_in_batches(self):
+        self.add_items(age_minutes=10)
+        other = CustomUser.objects.create_user(email='other@example.com', password='password')
+        fresh = CartItem.objects.create(user=other, book=self.books[0])
+        out = StringIO()
+        call_command('purge_expired_carts', batch_size=2, stdout=out)
+        self.assertIn('Deleted 5 expired cart items', out.getvalue())
+        self.assertEqual(list(CartItem.objects.values_list('id', flat=True)), [fresh.id])
+
+    def test_view_cart_hides_expired_items(self):
+        self.add_items(age_minutes=10)
+        response = self.client.get(reverse('view_cart'))
+        self.assertEqual(response.json(), {'cart_items': []})
+        self.assertEqual(CartItem.objects.count(), 0)
+
+    @override_settings(CART_ITEM_TTL_SECONDS=3600)
+    def test_ttl_is_configurable(self):
+        self.add_items(age_minutes=10)
+        self.assertEqual(purge_expired_cart_items(), 0)
+        response = self.client.get(reverse('view_cart'))
+        self.assertEqual(len(response.json()['cart_items']), 5)
+
+
+class PaginationTests(TestCase):
+
+    def setUp(self):
+        self.admin_user = CustomUser.objects.create_user(email='admin@example.com', password='password', role=CustomUser.ADMIN)
+        self.category = Category.objects.create(name='Fiction')
+        for i in range(7):
+            Book.objects.create(title=f'Book {i}', year_published=2020, author_name='Author',
+                                price=10 + i % 3, category=self.category, stock=1)
+        self.client.force_login(self.admin_user)
+
+    def walk(self, **params):
+        titles, cursor = [], None
+        while True:
+            query = dict(params, page_size=3)
+            if cursor:
+                query['cursor'] = cursor
+            data = self.client.get(reverse('manage_books'), query).json()
+            titles += [book['title'] for book in data['books']]
+            cursor = data['next_cursor']
+            if not cursor:
+                return titles
+
+    def test_cursor_walk_matches_full_ordering(self):
+        expected = list(Book.objects.order_by('-price', '-id').values_list('title', flat=True))
+        self.assertEqual(self.walk(order_by='-price'), expected)
+        self.assertEqual(self.walk(), sorted(expected))
+
+    def test_page_params_still_work(self):
+        data = self.client.get(reverse('manage_books'), {'page': 2, 'page_size': 3}).json()
+        self.assertEqual([b['title'] for b in data['books']], ['Book 3', 'Book 4', 'Book 5'])
+        data = self.client.get(reverse('manage_books'), {'page': 9, 'page_size': 3}).json()
+        self.assertEqual([b['title'] for b in data['books']], ['Book 6'])
+        self.assertNotIn('total', data)
+
+    def test_include_total_and_order_allow_list(self):
+        data = self.client.get(reverse('manage_categories'), {'include_total': 'true'}).json()
+        self.assertEqual(data['total'], 1)
+        response = self.client.get(reverse('manage_books'), {'order_by': 'stock'})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get(reverse('manage_books'), {'cursor': 'garbage'})
+        self.assertEqual(response.status_code, 400)
+
+
+class CatalogCacheTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.admin_user = CustomUser.objects.create_user(email='admin@example.com', password='password', role=CustomUser.ADMIN)
+        self.user = CustomUser.objects.create_user(email='user@example.com', password='password')
+        self.category = Category.objects.create(name='Fiction')
+        self.book = Book.objects.create(title='Sample Book', year_published=2021, author_name='Author',
+                                        price=10, category=self.category, stock=1)
+
+    def list_books(self):
+        payload = json.dumps({'categories': []})
+        return self.client.generic('GET', reverse('list_books'), data=payload, content_type='application/json').json()
+
+    def test_repeat_listing_is_served_from_cache(self):
+        before = catalog_cache_stats()
+        self.list_books()
+        with self.assertNumQueries(0):
+            self.list_books()
+        after = catalog_cache_stats()
+        self.assertEqual(after['misses'] - before['misses'], 1)
+        self.assertEqual(after['hits'] - before['hits'], 1)
+
+    def test_writes_invalidate_listing(self):
+        self.assertEqual(len(self.list_books()['books']), 1)
+        Book.objects.create(title='Second Book', year_published=2021, author_name='Author',
+                            price=10, category=self.category, stock=1)
+        self.assertEqual(len(self.list_books()['books']), 2)
+
+    def test_checkout_stock_change_invalidates_listing(self):
+        self.assertEqual(len(self.list_books()['books']), 1)
+        CartItem.objects.create(user=self.user, book=self.book)
+        self.client.force_login(self.user)
+        self.client.put(reverse('checkout'), content_type='application/json')
+        self.assertEqual(self.list_books()['books'], [])
+
+    def test_stats_endpoint_is_admin_only(self):
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(reverse('cache_stats')).status_code, 403)
+        self.client.force_login(self.admin_user)
+        self.assertIn('invalidations', self.client.get(reverse('cache_stats')).json())
+
+
+class SearchTests(TestCase):
+
+    def setUp(self):
+        self.admin_user = CustomUser.objects.create_user(email='admin@example.com', password='password', role=CustomUser.ADMIN)
+        self.category = Category.objects.create(name='Fiction')
+        Book.objects.create(title='The Hobbit', year_published=1937, author_name='J. R. R. Tolkien',
+                            price=10, category=self.category, stock=1)
+        Book.objects.create(title='Dune', year_published=1965, author_name='Frank Herbert',
+                            price=10, category=self.category, stock=1)
+        Book.objects.create(title='Sold Out Hobbit', year_published=1937, author_name='Someone',
+                            price=10, category=self.category, stock=0)
+
+    def search(self, q, **params):
+        return self.client.get(reverse('search_books'), dict(params, q=q)).json()
+
+    def test_search_title_and_author(self):
+        self.assertEqual([b['title'] for b in self.search('hobb')['books']], ['The Hobbit'])
+        self.assertEqual([b['title'] for b in self.search('herbert')['books']], ['Dune'])
+        self.assertEqual(self.search('"unbalanced (')['books'], [])
+
+    def test_index_follows_manage_books_writes(self):
+        self.client.force_login(self.admin_user)
+        book = Book.objects.get(title='Dune')
+        data = {'id': book.id, 'title': 'Dune Messiah', 'year_published': 1969, 'author_name': 'Frank Herbert',
+                'price': 10.0, 'category': 'Fiction', 'stock': 1}
+        self.client.put(reverse('manage_books'), data=json.dumps(data), content_type='application/json')
+        self.assertEqual([b['title'] for b in self.search('messiah')['books']], ['Dune Messiah'])
+        self.client.delete(reverse('manage_books'), data=json.dumps({'title': 'Dune Messiah'}), content_type='application/json')
+        self.assertEqual(self.search('messiah')['books'], [])
+
+    def test_rebuild_command_and_paging(self):
+        call_command('rebuild_search_index', stdout=StringIO())
+        first = self.search('hobbit', page_size=1)
+        self.assertEqual(len(first['books']), 1)
+        self.assertFalse(first['has_more'])
+
+
+class BulkImportTests(TestCase):
+
+    def setUp(self):
+        self.admin_user = CustomUser.objects.create_user(email='admin@example.com', password='password', role=CustomUser.ADMIN)
+        self.category = Category.objects.create(name='Fiction')
+        Book.objects.create(title='Existing', year_published=2000, author_name='Old',
+                            price=5, category=self.category, stock=1)
+        self.client.force_login(self.admin_user)
+
+    def test_ndjson_upsert_with_row_errors(self):
+        rows = [
+            {'title': 'Existing', 'year_published': 2001, 'author_name': 'New', 'price': 6.5, 'category': 'Fiction', 'stock': 4},
+            {'title': 'Fresh', 'year_published': 2020, 'author_name': 'A', 'price': 1, 'category': 'Fiction', 'stock': 2},
+            {'title': 'Lost', 'year_published': 2020, 'author_name': 'A', 'price': 1, 'category': 'Missing', 'stock': 2},
+            {'title': 'Bad'},
+        ]
+        body = '\n'.join(json.dumps(row) for row in rows) + '\n{not json\n'
+        response = self.client.post(reverse('import_books'), data=body, content_type='application/x-ndjson')
+        report = response.json()
+        self.assertEqual((report['rows'], report['upserted'], report['error_count']), (5, 2, 3))
+        self.assertEqual([error['line'] for error in report['errors']], [3, 4, 5])
+        existing = Book.objects.get(title='Existing')
+        self.assertEqual((existing.author_name, existing.stock), ('New', 4))
+        self.assertTrue(Book.objects.filter(title='Fresh').exists())
+
+    def test_csv_import_in_chunks(self):
+        lines = ['title,year_published,author_name,price,category,stock']
+        lines += [f'Book {i},2020,Author,9.99,Fiction,{i}' for i in range(7)]
+        report = import_books(iter(lines), 'csv', chunk_size=3)
+        self.assertEqual((report.upserted, report.error_count), (7, 0))
+        self.assertEqual(Book.objects.get(title='Book 6').stock, 6)
+
+    def test_bad_bytes_and_records_are_reported_per_line(self):
+        ndjson = [json.dumps({'title': f'Book {i}', 'year_published': 2020, 'author_name': 'A', 'price': 1,
+                              'category': 'Fiction', 'stock': 1}).encode() for i in range(3)]
+        ndjson[1] = b'{"title": "\xff"}'
+        report = import_books(iter(ndjson))
+        self.assertEqual((report.upserted, report.errors), (2, [{'line': 2, 'error': 'Invalid UTF-8'}]))
+
+        csv_lines = [b'title,year_published,author_name,price,category,stock',
+                     b'Caf\xe9,2020,A,1,Fiction,1', b'x' * (csv.field_size_limit() + 1),
+                     b'Good,2020,A,1,Fiction,1']
+        report = import_books(iter(csv_lines), 'csv')
+        self.assertEqual(report.upserted, 1)
+        self.assertEqual([error['line'] for error in report.errors], [2, 3])
+        self.assertTrue(Book.objects.filter(title='Good').exists())
+
+    def test_failed_chunk_is_retried_row_by_row(self):
+        lines = ['title,year_published,author_name,price,category,stock']
+        lines += [f'Book {i},2020,Author,9.99,Fiction,{i}' for i in range(4)]
+        refuse = Book.objects.bulk_create
+
+        def bulk_create(books, **kwargs):
+            if any(book.title == 'Book 2' for book in books):
+                raise ValueError('refused')
+            return refuse(books, **kwargs)
+
+        with mock.patch.object(Book.objects, 'bulk_create', side_effect=bulk_create):
+            report = import_books(iter(lines), 'csv')
+        self.assertEqual((report.upserted, report.errors), (3, [{'line': 4, 'error': 'refused'}]))
+
+    def test_imported_stock_leaves_held_copies_alone(self):
+        Book.objects.filter(title='Existing').update(held=2)
+        report = import_books(iter(['title,year_published,author_name,price,category,stock',
+                                    'Existing,2000,Old,5,Fiction,3']), 'csv')
+        self.assertEqual(report.upserted, 1)
+        existing = Book.objects.get(title='Existing')
+        self.assertEqual((existing.stock, existing.held), (3, 2))
+
+
+class ExportTests(TestCase):
+
+    def setUp(self):
+        self.admin_user = CustomUser.objects.create_user(email='admin@example.com', password='password', role=CustomUser.ADMIN)
+        fiction = Category.objects.create(name='Fiction')
+        poetry = Category.objects.create(name='Poetry')
+        Book.objects.create(title='Novel', year_published=2000, author_name='A', price=5, category=fiction, stock=1)
+        Book.objects.create(title='Sold Out', year_published=2000, author_name='B', price=5, category=fiction, stock=0)
+        Book.objects.create(title='Poems', year_published=2000, author_name='C', price=7.5, category=poetry, stock=2)
+        self.client.force_login(self.admin_user)
+
+    def test_streams_ndjson_with_filters(self):
+        response = self.client.get(reverse('export_books'), {'category': 'Fiction', 'in_stock': 'true'})
+        self.assertTrue(response.streaming)
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual(rows, [{'id': Book.objects.get(title='Novel').id, 'title': 'Novel', 'year_published': 2000,
+                                 'author_name': 'A', 'price': '5.00', 'category': 'Fiction', 'stock': 1}])
+
+    def test_csv_export_round_trips_through_import(self):
+        out = StringIO()
+        call_command('export_books', format='csv', stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(lines[0], 'id,title,year_published,author_name,price,category,stock')
+        self.assertEqual(len(lines), 4)
+        report = import_books(iter(lines), 'csv')
+        self.assertEqual((report.upserted, report.error_count), (3, 0))
+        self.assertEqual(Book.objects.count(), 3)
+
+    def test_unknown_format(self):
+        response = self.client.get(reverse('export_books'), {'format': 'xml'})
+        self.assertEqual(response.status_code, 400)
+
+
+class FastSerializerTests(TestCase):
+
+    def setUp(self):
+        fiction = Category.objects.create(name='Fiction')
+        poetry = Category.objects.create(name='Poetry')
+        Book.objects.create(title='Novel', year_published=2000, author_name='A', price=5, category=fiction, stock=1)
+        Book.objects.create(title='Poems', year_published=1999, author_name='B', price=7.25, category=poetry, stock=2)
+
+    def test_matches_book_serializer(self):
+        books = Book.objects.order_by('id')
+        self.assertEqual(serialize_book_rows(book_values(books)), BookSerializer(books, many=True).data)
+
+    def test_listing_is_one_query(self):
+        payload = json.dumps({'categories': ['Fiction', 'Poetry']})
+        cache.clear()
+        category_map()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.generic('GET', reverse('list_books'), data=payload, content_type='application/json')
+        # a cold cache also looks up Last-Modified, one Max() per catalog table
+        listing = [query['sql'] for query in queries if 'MAX(' not in query['sql']]
+        self.assertEqual((len(queries), len(listing)), (3, 1))
+        self.assertNotIn('JOIN', listing[0])
+        self.assertEqual([book['category'] for book in response.json()['books']], ['Fiction', 'Poetry'])
+
+
+class ConditionalGetTests(TestCase):
+
+    def setUp(self):
+        self.admin_user = CustomUser.objects.create_user(email='admin@example.com', password='password', role=CustomUser.ADMIN)
+        self.category = Category.objects.create(name='Fiction')
+        self.book = Book.objects.create(title='Sample Book', year_published=2021, author_name='Author',
+                                        price=10, category=self.category, stock=1)
+        self.payload = json.dumps({'categories': []})
+
+    def list_books(self, **headers):
+        return self.client.generic('GET', reverse('list_books'), data=self.payload,
+                                   content_type='application/json', headers=headers)
+
+    def test_matching_etag_returns_304_without_queries(self):
+        etag = self.list_books()['ETag']
+        with self.assertNumQueries(0):
+            response = self.list_books(if_none_match=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_etag_changes_with_writes_and_params(self):
+        etag = self.list_books()['ETag']
+        self.payload = json.dumps({'categories': ['Fiction']})
+        self.assertNotEqual(self.list_books()['ETag'], etag)
+        etag = self.list_books()['ETag']
+        Book.objects.filter(id=self.book.id).delete()
+        response = self.list_books(if_none_match=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['books'], [])
+
+    def test_if_modified_since_on_categories(self):
+        self.client.force_login(self.admin_user)
+        response = self.client.get(reverse('manage_categories'))
+        last_modified = response['Last-Modified']
+        response = self.client.get(reverse('manage_categories'), headers={'if_modified_since': last_modified})
+        self.assertEqual(response.status_code, 304)
+
+    def test_writes_ignore_preconditions(self):
+        self.client.force_login(self.admin_user)
+        response = self.client.put(reverse('manage_categories'),
+                                   data=json.dumps({'old_name': 'Fiction', 'new_name': 'Drama'}),
+                                   content_type='application/json', headers={'if_match': '"stale"'})
+        self.assertEqual(response.status_code, 200)
+        response = self.client.post(reverse('manage_books'), data=json.dumps({
+            'title': 'Second Book', 'year_published': 2021, 'author_name': 'Author', 'price': 10,
+            'category': 'Drama', 'stock': 1}), content_type='application/json',
+            headers={'if_unmodified_since': 'Mon, 01 Jan 2001 00:00:00 GMT'})
+        self.assertEqual(response.status_code, 201)
+
+    def test_empty_catalog_last_modified_is_cached(self):
+        Book.objects.all().delete()
+        Category.objects.all().delete()
+        cache.clear()
+        self.assertIsNone(catalog_last_modified())
+        with self.assertNumQueries(0):
+            self.assertIsNone(catalog_last_modified())
+
+    def test_updated_at_maintained(self):
+        self.client.force_login(self.admin_user)
+        before = Category.objects.get(id=self.category.id).updated_at
+        self.client.put(reverse('manage_categories'), data=json.dumps({'old_name': 'Fiction', 'new_name': 'Drama'}),
+                        content_type='application/json')
+        self.assertGreater(Category.objects.get(id=self.category.id).updated_at, before)
+
+
+@override_settings(ROOT_URLCONF='api.test_urls')
+class AsyncViewTests(TestCase):
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(email='user@example.com', password='password')
+        self.category = Category.objects.create(name='Fiction')
+        self.book = Book.objects.create(title='Sample Book', year_published=2021, author_name='Author',
+                                        price=10, category=self.category, stock=5)
+
+    def test_routes_async_views(self):
+        self.assertTrue(iscoroutinefunction(resolve(reverse('list_books')).func))
+
+    async def test_middleware_stays_async_and_sees_the_view_queries(self):
+        async def get_response(request):
+            return None
+        for middleware in (request_metrics.MetricsMiddleware, QueryBudgetMiddleware,
+                           TokenAuthenticationMiddleware, ReplicaPinningMiddleware):
+            self.assertTrue(iscoroutinefunction(middleware(get_response)), middleware)
+        request_metrics.metrics.clear()
+        await self.async_client.aforce_login(self.user)
+        await self.async_client.get(reverse('view_cart'))
+        count, _ = request_metrics.metrics.queries[('view_cart', 'GET')]
+        self.assertGreaterEqual(count, 3)
+
+    async def test_cart_flow(self):
+        response = await self.async_client.post(reverse('add_to_cart', args=[self.book.id]))
+        self.assertEqual(response.status_code, 401)
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.post(reverse('add_to_cart', args=[self.book.id]))
+        self.assertEqual(response.status_code, 201)
+        response = await self.async_client.post(reverse('add_to_cart', args=[self.book.id]))
+        self.assertEqual(response.status_code, 409)
+        response = await self.async_client.get(reverse('view_cart'))
+        self.assertEqual(response.json()['cart_items'][0]['title'], 'Sample Book')
+
+    async def test_list_books(self):
+        response = await self.async_client.generic('GET', reverse('list_books'), data=json.dumps({'categories': ['Fiction']}),
+                                                   content_type='application/json')
+        self.assertEqual([book['title'] for book in response.json()['books']], ['Sample Book'])
+        response = await self.async_client.generic('GET', reverse('list_books'), data=json.dumps({'categories': []}),
+                                                   content_type='application/json', headers={'if_none_match': response['ETag']})
+        self.assertEqual(response.status_code, 200)
+
+    async def test_list_books_sends_last_modified_from_a_cold_cache(self):
+        await cache.aclear()
+        data = json.dumps({'categories': []})
+        response = await self.async_client.generic('GET', reverse('list_books'), data=data,
+                                                   content_type='application/json')
+        modified = max(self.book.updated_at, self.category.updated_at)
+        self.assertEqual(response['Last-Modified'], http_date(modified.timestamp()))
+        response = await self.async_client.generic('GET', reverse('list_books'), data=data,
+                                                   content_type='application/json',
+                                                   headers={'if_modified_since': response['Last-Modified']})
+        self.assertEqual(response.status_code, 304)
+
+    async def test_login_logout(self):
+        data = json.dumps({'email': 'user@example.com', 'password': 'password'})
+        response = await self.async_client.post(reverse('login_user'), data=data, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        response = await self.async_client.get(reverse('view_cart'))
+        self.assertEqual(response.status_code, 200)
+        response = await self.async_client.post(reverse('logout_user'))
+        self.assertEqual(response.status_code, 200)
+        response = await self.async_client.get(reverse('view_cart'))
+        self.assertEqual(response.status_code, 401)
+
+
+@override_settings(AUTH_MODE='token')
+class TokenAuthTests(TestCase):
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(email='user@example.com', password='password')
+        self.admin_user = CustomUser.objects.create_user(email='admin@example.com', password='password', role=CustomUser.ADMIN)
+        self.book = Book.objects.create(title='Sample Book', year_published=2021, author_name='Author',
+                                        price=10, category=Category.objects.create(name='Fiction'), stock=5)
+
+    def login(self, email):
+        data = json.dumps({'email': email, 'password': 'password'})
+        response = self.client.post(reverse('login_user'), data=data, content_type='application/json')
+        self.assertNotIn('sessionid', response.cookies)
+        return {'authorization': f"Bearer {response.json()['token']}"}
+
+    def test_token_requests_skip_session_and_user_queries(self):
+        headers = self.login('user@example.com')
+        self.client.post(reverse('add_to_cart', args=[self.book.id]), headers=headers)
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('view_cart'), headers=headers)
+        self.assertEqual(response.json()['cart_items'][0]['title'], 'Sample Book')
+
+    def test_role_comes_from_token(self):
+        response = self.client.get(reverse('manage_categories'), headers=self.login('user@example.com'))
+        self.assertEqual(response.status_code, 403)
+        response = self.client.get(reverse('manage_categories'), headers=self.login('admin@example.com'))
+        self.assertEqual(response.status_code, 200)
+
+    def test_logout_revokes_token(self):
+        headers = self.login('user@example.com')
+        self.assertEqual(self.client.post(reverse('logout_user'), headers=headers).status_code, 200)
+        self.assertEqual(self.client.get(reverse('view_cart'), headers=headers).status_code, 401)
+
+    def test_expired_or_forged_tokens_rejected(self):
+        headers = self.login('user@example.com')
+        with override_settings(TOKEN_AUTH_MAX_AGE=-1):
+            self.assertEqual(self.client.get(reverse('view_cart'), headers=headers).status_code, 401)
+        forged = {'authorization': headers['authorization'][:-2] + 'xx'}
+        self.assertEqual(self.client.get(reverse('view_cart'), headers=forged).status_code, 401)
+
+
+class CachedAuthTests(TestCase):
+
+    def setUp(self):
+        user_cache.clear()
+        self.user = CustomUser.objects.create_user(email='user@example.com', password='password')
+        self.client.login(email='user@example.com', password='password')
+
+    def test_warm_request_makes_no_auth_queries(self):
+        self.client.get(reverse('view_cart'))
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('view_cart'))
+        self.assertEqual(response.status_code, 200)
+
+    def test_role_change_evicts_cached_user(self):
+        self.assertEqual(self.client.get(reverse('manage_categories')).status_code, 403)
+        self.user.role = CustomUser.ADMIN
+        self.user.save()
+        self.assertEqual(self.client.get(reverse('manage_categories')).status_code, 200)
+
+    def test_password_change_ends_session(self):
+        self.client.get(reverse('view_cart'))
+        self.user.set_password('changed')
+        self.user.save()
+        self.assertEqual(self.client.get(reverse('view_cart')).status_code, 401)
+
+
+@override_settings(PASSWORD_HASHERS=['api.hashers.ConfigurablePBKDF2PasswordHasher'], PASSWORD_HASH_ITERATIONS=1000)
+class PasswordHashingTests(TestCase):
+
+    def login(self, password='password'):
+        data = json.dumps({'email': 'user@example.com', 'password': password})
+        return self.client.post(reverse('login_user'), data=data, content_type='application/json')
+
+    def test_iterations_come_from_settings(self):
+        user = CustomUser.objects.create_user(email='user@example.com', password='password')
+        self.assertTrue(user.password.startswith('pbkdf2_sha256$1000$'))
+
+    def test_rehash_on_login_after_settings_change(self):
+        CustomUser.objects.create_user(email='user@example.com', password='password')
+        with override_settings(PASSWORD_HASH_ITERATIONS=2000):
+            self.assertEqual(self.login().status_code, 200)
+            self.assertTrue(CustomUser.objects.get().password.startswith('pbkdf2_sha256$2000$'))
+            self.assertEqual(self.login('wrong').status_code, 400)
+
+    def test_failed_login_hashes_once_on_the_pool(self):
+        CustomUser.objects.create_user(email='user@example.com', password='password')
+        with mock.patch('api.hashers.run_hasher', wraps=run_hasher) as pooled, \
+                mock.patch('django.contrib.auth.backends.ModelBackend.authenticate') as inline:
+            self.assertEqual(self.login('wrong').status_code, 400)
+            data = json.dumps({'email': 'nobody@example.com', 'password': 'password'})
+            self.client.post(reverse('login_user'), data=data, content_type='application/json')
+        # one hash per attempt, none outside the pool
+        self.assertEqual(pooled.call_count, 2)
+        inline.assert_not_called()
+
+    def test_busy_pool_answers_503_with_retry_after(self):
+        with mock.patch('api.backends.verify_password', side_effect=HashingBusy('busy')):
+            CustomUser.objects.create_user(email='user@example.com', password='password')
+            response = self.login()
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '1')
+
+
+@override_settings(RATE_LIMIT_ENABLED=True, RATE_LIMIT_STORE='memory',
+                   RATE_LIMITS={'default': (100, 100), 'list_books': (0.01, 2)},
+                   CONCURRENCY_LIMITS={'checkout': 1})
+class RateLimitTests(TestCase):
+
+    def setUp(self):
+        memory_buckets.clear()
+        self.user = CustomUser.objects.create_user(email='user@example.com', password='password')
+        self.category = Category.objects.create(name='Fiction')
+        self.data = json.dumps({'categories': ['Fiction']})
+
+    def list_books(self, client, **extra):
+        return client.generic('GET', reverse('list_books'), self.data,
+                              content_type='application/json', **extra)
+
+    def test_burst_then_429_with_retry_after(self):
+        for _ in range(2):
+            self.assertEqual(self.list_books(self.client).status_code, 200)
+        response = self.list_books(self.client)
+        self.assertEqual(response.status_code, 429)
+        self.assertGreaterEqual(int(response['Retry-After']), 1)
+
+    def test_clients_have_separate_buckets(self):
+        for _ in range(3):
+            self.list_books(self.client)
+        self.assertEqual(self.list_books(self.client, REMOTE_ADDR='10.0.0.2').status_code, 200)
+        other = Client()
+        other.force_login(self.user)
+        self.assertEqual(self.list_books(other).status_code, 200)
+
+    def test_made_up_session_cookies_share_the_ip_bucket(self):
+        for i in range(2):
+            self.client.cookies['sessionid'] = f'random{i}'
+            self.assertEqual(self.list_books(self.client).status_code, 200)
+        self.client.cookies['sessionid'] = 'random2'
+        self.assertEqual(self.list_books(self.client).status_code, 429)
+
+    def test_concurrency_cap(self):
+        self.client.force_login(self.user)
+        self.assertTrue(_acquire('checkout', 1))
+        try:
+            response = self.client.put(reverse('checkout'))
+            self.assertEqual(response.status_code, 429)
+        finally:
+            _release('checkout')
+        self.assertEqual(self.client.put(reverse('checkout')).status_code, 200)
+
+    @override_settings(ROOT_URLCONF='api.test_urls', CONCURRENCY_LIMITS={'list_books': 1})
+    async def test_concurrency_cap_covers_async_views(self):
+        self.assertTrue(_acquire('list_books', 1))
+        try:
+            response = await self.async_client.generic('GET', reverse('list_books'), self.data,
+                                                       content_type='application/json')
+            self.assertEqual(response.status_code, 429)
+        finally:
+            _release('list_books')
+        response = await self.async_client.generic('GET', reverse('list_books'), self.data,
+                                                   content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+
+    def test_page_size_is_capped(self):
+        for i in range(3):
+            Book.objects.create(title=f'Book {i}', year_published=2020, author_name='Author',
+                                price=10, category=self.category, stock=1)
+        with self.settings(RATE_LIMITS={'default': (100, 100)}):
+            data = self.list_books(self.client, QUERY_STRING='page_size=100000').json()
+        self.assertEqual(len(data['books']), 3)
+        self.assertNotIn('error', data)
+
+
+@override_settings(METRICS_TOKEN='scrape-token')
+class MetricsTests(TestCase):
+
+    def setUp(self):
+        request_metrics.metrics.clear()
+        self.user = CustomUser.objects.create_user(email='user@example.com', password='password')
+        self.client.force_login(self.user)
+
+    def scrape(self):
+        response = self.client.get(reverse('metrics'), headers={'authorization': 'Bearer scrape-token'})
+        self.assertEqual(response.status_code, 200)
+        return response.content.decode()
+
+    def test_only_admins_and_the_scrape_token_get_in(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+        self.client.logout()
+        response = self.client.get(reverse('metrics'), headers={'authorization': 'Bearer wrong'})
+        self.assertEqual((response.status_code, response['WWW-Authenticate']), (401, 'Bearer'))
+        with override_settings(METRICS_TOKEN=None):
+            response = self.client.get(reverse('metrics'), headers={'authorization': 'Bearer scrape-token'})
+            self.assertEqual(response.status_code, 401)
+        self.client.force_login(CustomUser.objects.create_user(email='admin@example.com', password='password',
+                                                               role=CustomUser.ADMIN))
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 200)
+
+    def test_records_requests_queries_and_bytes(self):
+        response = self.client.get(reverse('view_cart'))
+        self.client.post(reverse('view_cart'))
+        text = self.scrape()
+        self.assertIn('bookstore_http_requests_total{view="view_cart",method="GET",status="200"} 1', text)
+        self.assertIn('bookstore_http_requests_total{view="view_cart",method="POST",status="405"} 1', text)
+        self.assertIn('bookstore_http_request_duration_seconds_count{view="view_cart",method="GET"} 1', text)
+        self.assertIn('bookstore_http_request_duration_seconds_bucket{view="view_cart",method="GET",le="+Inf"} 1', text)
+        self.assertIn(f'bookstore_http_response_bytes_total{{view="view_cart",method="GET"}} {len(response.content)}', text)
+        queries = [line for line in text.splitlines()
+                   if line.startswith('bookstore_db_queries_total{view="view_cart",method="GET"}')]
+        self.assertGreaterEqual(int(queries[0].split()[-1]), 2)
+
+    def test_unknown_routes_and_methods_are_grouped(self):
+        self.client.generic('BREW', reverse('view_cart'))
+        self.client.get('/no/such/page/')
+        text = self.scrape()
+        self.assertIn('view="view_cart",method="OTHER"', text)
+        self.assertIn('view="unmatched",method="GET",status="404"', text)
+
+    def test_workers_are_added_up_through_metrics_dir(self):
+        with tempfile.TemporaryDirectory() as directory, override_settings(METRICS_DIR=directory):
+            self.client.get(reverse('view_cart'))
+            other = request_metrics.Metrics(request_metrics.metrics.buckets)
+            other.observe('view_cart', 'GET', 200, 0.01, 3, 0.001, 10)
+            # any live process other than this one
+            with open(os.path.join(directory, f'metrics-{os.getppid()}.json'), 'w') as f:
+                json.dump(other.snapshot(), f)
+            text = self.scrape()
+        self.assertIn('bookstore_http_requests_total{view="view_cart",method="GET",status="200"} 2', text)
+
+    def test_files_of_exited_workers_are_dropped(self):
+        worker = subprocess.run([sys.executable, '-c', 'import os; print(os.getpid())'],
+                                capture_output=True, text=True, check=True)
+        with tempfile.TemporaryDirectory() as directory, override_settings(METRICS_DIR=directory):
+            path = os.path.join(directory, f'metrics-{worker.stdout.strip()}.json')
+            other = request_metrics.Metrics(request_metrics.metrics.buckets)
+            other.observe('view_cart', 'GET', 200, 0.01, 3, 0.001, 10)
+            with open(path, 'w') as f:
+                json.dump(other.snapshot(), f)
+            text = self.scrape()
+            self.assertFalse(os.path.exists(path))
+        self.assertNotIn('view="view_cart"', text)
+
+
+class BenchmarkSuiteTests(TestCase):
+
+    def setUp(self):
+        call_command('seed_bookstore', books=50, categories=5, users=5, carts=2, batch_size=20,
+                     stdout=StringIO())
+
+    def run_benchmarks(self, *args):
+        out = StringIO()
+        call_command('run_benchmarks', *args, stdout=out)
+        return json.loads(out.getvalue())
+
+    def test_seed_counts(self):
+        self.assertEqual(Book.objects.count(), 50)
+        self.assertEqual(Category.objects.count(), 5)
+        self.assertEqual(CustomUser.objects.count(), 6)
+        self.assertEqual(CartItem.objects.count(), 6)
+
+    def test_seeded_carts_hold_stock_and_clear_gives_holds_back(self):
+        self.assertEqual(sum(Book.objects.values_list('held', flat=True)),
+                         CartItem.objects.filter(holds_stock=True).count())
+        self.assertFalse(CartItem.objects.filter(holds_stock=False).exists())
+        real = Book.objects.create(title='Real', year_published=2020, author_name='A', price=5,
+                                   category=Category.objects.create(name='Real'), stock=2)
+        add_book_to_cart(CustomUser.objects.get(email='bench0@bench.example.com'), real.id)
+        clear_seed_data(batch_size=20)
+        self.assertEqual(list(Book.objects.values_list('title', 'stock', 'held')), [('Real', 2, 0)])
+        self.assertEqual(list(Category.objects.values_list('name', flat=True)), ['Real'])
+        self.assertFalse(CustomUser.objects.exists() or CartItem.objects.exists())
+
+    def test_scenarios_report_percentiles(self):
+        results = self.run_benchmarks('--iterations', '3')
+        self.assertEqual(results['dataset']['books'], 50)
+        for name in ('browse', 'checkout_storm', 'hot_titles', 'admin_edits'):
+            scenario = results['scenarios'][name]
+            self.assertGreater(scenario['requests'], 0)
+            self.assertLessEqual(scenario['p50_ms'], scenario['p99_ms'])
+            self.assertNotIn('500', scenario['statuses'])
+        self.assertEqual(results['scenarios']['admin_edits']['statuses'], {'200': 6})
+
+    def test_replay_skips_non_request_lines(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.jsonl', delete=False) as f:
+            f.write(json.dumps({'method': 'GET', 'path': '/books/',
+                                'body': {'categories': ['bench category 0']}}) + '\n')
+            f.write(json.dumps({'request_id': 'x', 'title': 'not a request'}) + '\n')
+            f.write(json.dumps({'method': 'GET', 'path': '/cart/', 'user': 'bench0@bench.example.com'}) + '\n')
+        try:
+            results = self.run_benchmarks('--replay', f.name)['replay']
+        finally:
+            os.unlink(f.name)
+        self.assertEqual(results['statuses'], {'200': 2})
+        self.assertEqual(results['skipped_lines'], 1)
+        self.assertEqual(sorted(results['routes']), ['list_books', 'view_cart'])
+
+
+class QueryBudgetTests(TestCase):
+    """Exact query counts per endpoint must not grow with the data."""
+
+    SIZES = (1, 10, 50)
+
+    def setUp(self):
+        user_cache.clear()
+        self.user = CustomUser.objects.create_user(email='user@example.com', password='password')
+        self.admin_user = CustomUser.objects.create_user(email='admin@example.com', password='password', role=CustomUser.ADMIN)
+        self.category = Category.objects.create(name='Fiction')
+
+    def fill(self, size):
+        CartItem.objects.all().delete()
+        Book.objects.all().delete()
+        books = Book.objects.bulk_create(
+            Book(title=f'Book {i}', year_published=2020, author_name='Author',
+                 price=10, category=self.category, stock=5)
+            for i in range(size + 1))
+        # every book but the last is in the cart
+        CartItem.objects.bulk_create(CartItem(user=self.user, book=book) for book in books[:-1])
+        return books
+
+    def assertQueriesPerSize(self, expected, client_user, request):
+        for size in self.SIZES:
+            with self.subTest(size=size):
+                books = self.fill(size)
+                self.client.force_login(client_user)
+                self.client.get(reverse('view_cart'))  # warm the session and user caches
+                category_map()
+                bump_catalog_version()
+                with self.assertNumQueries(expected):
+                    response = request(books)
+                self.assertLess(response.status_code, 300)
+
+    def test_list_books(self):
+        data = json.dumps({'categories': ['Fiction']})
+        self.assertQueriesPerSize(1, self.user, lambda books: self.client.generic(
+            'GET', reverse('list_books'), data, content_type='application/json'))
+
+    def test_search_books(self):
+        self.assertQueriesPerSize(2, self.user, lambda books: self.client.get(
+            reverse('search_books'), {'q': 'Book', 'page_size': 100}))
+
+    def test_cart_and_checkout(self):
+        self.assertQueriesPerSize(2, self.user, lambda books: self.client.get(reverse('view_cart')))
+        self.assertQueriesPerSize(2, self.user, lambda books: self.client.post(
+            reverse('add_to_cart', args=[books[-1].id])))
+        self.assertQueriesPerSize(10, self.user, lambda books: self.client.put(reverse('checkout')))
+
+    def test_admin_listings(self):
+        self.assertQueriesPerSize(1, self.admin_user, lambda books: self.client.get(
+            reverse('manage_books'), {'page_size': 100}))
+        self.assertQueriesPerSize(1, self.admin_user, lambda books: self.client.get(
+            reverse('manage_categories')))
+
+    def test_over_budget_is_rejected_or_logged(self):
+        self.client.force_login(self.user)
+        with mock.patch.object(views.view_cart, 'query_budget', 0):
+            with self.assertLogs('api.querybudget', 'ERROR'):
+                response = self.client.get(reverse('view_cart'))
+            self.assertEqual(response.status_code, 500)
+            self.assertIn('Query budget exceeded', response.json()['error'])
+            with override_settings(QUERY_BUDGET_MODE='log'), self.assertLogs('api.querybudget', 'WARNING'):
+                self.assertEqual(self.client.get(reverse('view_cart')).status_code, 200)
+
+    def test_import_budget_grows_with_the_rows(self):
+        self.client.force_login(self.admin_user)
+        lines = ['title,year_published,author_name,price,category,stock']
+        lines += [f'Book {i},2020,Author,9.99,Fiction,1' for i in range(1200)]
+        response = self.client.post(reverse('import_books'), data='\n'.join(lines), content_type='text/csv')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['upserted'], 1200)
+
+
+class QueryBudgetRollbackTests(TransactionTestCase):
+
+    def test_over_budget_writes_are_rolled_back(self):
+        user = CustomUser.objects.create_user(email='user@example.com', password='password')
+        book = Book.objects.create(title='Sample Book', year_published=2021, author_name='Author',
+                                   price=10, category=Category.objects.create(name='Fiction'), stock=5)
+        self.client.force_login(user)
+        self.client.get(reverse('view_cart'))  # warm the session and user caches
+        # BEGIN and the cart item INSERT run, reserving the copy doesn't
+        with mock.patch.object(views.add_to_cart, 'query_budget', 2), self.assertLogs('api.querybudget', 'ERROR'):
+            response = self.client.post(reverse('add_to_cart', args=[book.id]))
+        self.assertEqual(response.status_code, 500)
+        self.assertFalse(CartItem.objects.exists())
+        book.refresh_from_db()
+        self.assertEqual((book.stock, book.held), (5, 0))
+
+
+class StockReservationTests(TestCase):
+
+    def setUp(self):
+        self.users = [CustomUser.objects.create_user(email=f'user{i}@example.com', password='password')
+                      for i in range(3)]
+        self.book = Book.objects.create(title='Hot Book', year_published=2021, author_name='Author',
+                                        price=10, category=Category.objects.create(name='Fiction'), stock=2)
+
+    def add(self, user):
+        self.client.force_login(user)
+        return self.client.post(reverse('add_to_cart', args=[self.book.id]))
+
+    def assertStock(self, stock, held):
+        self.book.refresh_from_db()
+        self.assertEqual((self.book.stock, self.book.held), (stock, held))
+
+    def test_add_holds_stock_and_never_oversells(self):
+        self.assertEqual([self.add(user).status_code for user in self.users], [201, 201, 400])
+        self.assertStock(0, 2)
+        self.assertEqual(self.add(self.users[0]).status_code, 409)
+
+    def test_checkout_sells_held_copies(self):
+        self.add(self.users[0])
+        response = self.client.put(reverse('checkout'))
+        self.assertEqual(response.json()['order_summary'], ['Hot Book'])
+        self.assertEqual(response.json()['out_of_stock'], [])
+        self.assertStock(1, 0)
+
+    def test_expired_holds_are_released(self):
+        for user in self.users[:2]:
+            self.add(user)
+        CartItem.objects.update(added_at=timezone.now() - timezone.timedelta(minutes=5))
+        self.assertEqual(self.client.get(reverse('view_cart')).json()['cart_items'], [])
+        self.assertStock(1, 1)
+        self.assertEqual(purge_expired_cart_items(), 1)
+        self.assertStock(2, 0)
+
+    def test_expired_at_checkout_and_deleted_users_release(self):
+        self.add(self.users[0])
+        self.add(self.users[1])
+        self.users[0].delete()
+        self.assertStock(1, 1)
+        CartItem.objects.update(added_at=timezone.now() - timezone.timedelta(minutes=5))
+        response = self.client.put(reverse('checkout'))
+        self.assertEqual(response.json()['expired_books'], ['Hot Book'])
+        self.assertStock(2, 0)
+
+    def remove(self, user):
+        self.client.force_login(user)
+        return self.client.generic('DELETE', reverse('cart_items'), json.dumps({'book_ids': [self.book.id]}),
+                                   content_type='application/json')
+
+    def test_every_stock_change_moves_the_catalog_version(self):
+        versions = [get_catalog_version()]
+        self.add(self.users[0])
+        versions.append(get_catalog_version())
+        self.remove(self.users[0])
+        versions.append(get_catalog_version())
+        self.assertEqual(len(set(versions)), 3)
+        # the test runs in one transaction, its writes bump once on commit
+        callbacks = [func for _, func, _ in connection.run_on_commit]
+        self.assertEqual(callbacks.count(catalog_cache._incr_version), 1)
+
+
+class SqliteProfileTests(TestCase):
+
+    def test_pragmas_applied_to_new_connections(self):
+        pragmas = sqlite_pragmas(connection)
+        self.assertEqual(pragmas['busy_timeout'], 5000)
+        self.assertEqual(pragmas['synchronous'], 1)  # NORMAL
+        self.assertEqual(pragmas['cache_size'], -64000)
+        # the in-memory test database can't use WAL, a file database does
+        self.assertIn(pragmas['journal_mode'], ('wal', 'memory'))
+
+    def test_write_transactions_begin_immediate(self):
+        self.assertEqual(connection.transaction_mode, 'IMMEDIATE')
+
+
+@override_settings(DATABASE_REPLICAS=['replica'])
+class ReplicaRoutingTests(TestCase):
+
+    def setUp(self):
+        self.router = ReplicaRouter()
+        self.user = CustomUser.objects.create_user(email='user@example.com', password='password')
+        self.book = Book.objects.create(title='Book', year_published=2021, author_name='Author', price=10,
+                                        category=Category.objects.create(name='Fiction'), stock=2)
+
+    def route(self, method, model, pinned=False):
+        seen = []
+
+        @replica_reads
+        def view(request):
+            seen.append(self.router.db_for_read(model))
+
+        request = mock.Mock(method=method, replica_pinned=pinned)
+        view(request)
+        return seen[0]
+
+    def test_catalog_reads_outside_transactions_use_replica(self):
+        with mock.patch.object(connection, 'in_atomic_block', False):
+            self.assertEqual(self.route('GET', Book), 'replica')
+            self.assertEqual(self.route('HEAD', Category), 'replica')
+            self.assertIsNone(self.route('GET', CartItem))
+            self.assertIsNone(self.route('POST', Book))
+            self.assertIsNone(self.route('GET', Book, pinned=True))
+        # TestCase wraps every test in a transaction
+        self.assertIsNone(self.route('GET', Book))
+        self.assertIsNone(self.router.db_for_read(Book))
+        self.assertEqual(self.router.db_for_write(Book), 'default')
+        self.assertFalse(self.router.allow_migrate('replica', 'api'))
+
+    def test_write_pins_client_to_primary(self):
+        self.client.force_login(self.user)
+        response = self.client.post(reverse('add_to_cart', args=[self.book.id]))
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.cookies['replica_pin']['max-age'], 5)
+        response = self.client.get(reverse('view_cart'))
+        self.assertNotIn('replica_pin', response.cookies)
+
+    def on_replica(self):
+        # 'default' stands in for the replica, so every read routed to it is recorded
+        stack = ExitStack()
+        stack.enter_context(mock.patch.object(connection, 'in_atomic_block', False))
+        return stack, stack.enter_context(mock.patch('api.routers.random.choice', return_value='default'))
+
+    def list_books(self):
+        response = self.client.generic('GET', reverse('list_books'), data=json.dumps({'categories': []}),
+                                       content_type='application/json')
+        return [book['title'] for book in response.json()['books']]
+
+    def test_listing_misses_read_the_replica(self):
+        stack, choose = self.on_replica()
+        with stack:
+            # the book was just written, the replica may not have it yet
+            before = catalog_cache_stats()
+            self.assertEqual(self.list_books(), ['Book'])
+            self.assertEqual(self.list_books(), ['Book'])
+            choose.assert_called()
+            self.assertEqual(catalog_cache_stats()['misses'] - before['misses'], 2)
+            cache.set('catalog:modified', timezone.now() - timezone.timedelta(minutes=1), timeout=None)
+            before = catalog_cache_stats()
+            self.list_books()
+            self.list_books()
+            after = catalog_cache_stats()
+            self.assertEqual((after['misses'] - before['misses'], after['hits'] - before['hits']), (1, 1))
+
+    def test_replica_build_is_dropped_if_the_version_moves(self):
+        cache.set('catalog:modified', timezone.now() - timezone.timedelta(minutes=1), timeout=None)
+        key = listing_key('books', {})
+
+        @replica_reads
+        def view(request):
+            def build():
+                titles = list(Book.objects.values_list('title', flat=True))
+                bump_catalog_version()
+                return titles
+            return cached_listing('books', {}, build)
+
+        stack, choose = self.on_replica()
+        with stack:
+            self.assertEqual(view(mock.Mock(method='GET', replica_pinned=False)), ['Book'])
+        choose.assert_called()
+        self.assertIsNone(cache.get(key))
+
+    @override_settings(DATABASE_REPLICAS=[])
+    def test_no_replicas_no_cookie(self):
+        self.client.force_login(self.user)
+        response = self.client.post(reverse('add_to_cart', args=[self.book.id]))
+        self.assertNotIn('replica_pin', response.cookies)
+
+
+class IndexUsageTests(TestCase):
+    """EXPLAIN the hot queries and check each one is answered from an index."""
+
+    def setUp(self):
+        users = [CustomUser.objects.create_user(email=f'user{i}@example.com', password='password')
+                 for i in range(10)]
+        self.user = users[0]
+        categories = Category.objects.bulk_create(Category(name=f'Category {i}') for i in range(10))
+        invalidate_category_map()
+        books = Book.objects.bulk_create(
+            Book(title=f'Book {i}', year_published=2020, author_name=f'Author {i}', price=10,
+                 category=categories[i % 10], stock=i % 3) for i in range(200))
+        CartItem.objects.bulk_create(CartItem(user=user, book=book)
+                                     for user in users for book in books[:5])
+        # the planner only prefers the partial index once it has statistics
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def assertUsesIndex(self, queryset, index):
+        plan = queryset.explain()
+        self.assertIn(f'USING INDEX {index}', plan.replace('COVERING INDEX', 'INDEX'))
+
+    def test_list_books_uses_partial_index(self):
+        books = views.in_stock_books(['Category 1', 'Category 2']).order_by('title', 'id')[:11]
+        self.assertUsesIndex(books, 'book_instock_cat_title_idx')
+
+    def test_cart_queries_use_indexes(self):
+        cutoff = CartItem.expiry_cutoff()
+        self.assertUsesIndex(CartItem.objects.filter(user=self.user, added_at__gte=cutoff),
+                             'cartitem_user_added_idx')
+        self.assertUsesIndex(CartItem.objects.filter(added_at__lt=cutoff), 'cartitem_added_idx')
+        # add_to_cart's conflict target and the checkout lookup
+        plan = CartItem.objects.filter(user=self.user, book_id=1).explain()
+        self.assertIn('(user_id=? AND book_id=?)', plan)
+        self.assertRegex(CartItem.objects.filter(user=self.user).explain(), r'USING (COVERING )?INDEX')
+
+    def test_add_to_cart_conflict_keeps_one_row(self):
+        book = Book.objects.filter(stock=1).exclude(cartitem__user=self.user).first()
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.post(reverse('add_to_cart', args=[book.id])).status_code, 201)
+        self.assertEqual(self.client.post(reverse('add_to_cart', args=[book.id])).status_code, 409)
+        self.assertEqual(CartItem.objects.filter(user=self.user, book=book).count(), 1)
+        book.refresh_from_db()
+        self.assertEqual((book.stock, book.held), (0, 1))
+
+
+class BatchCartTests(TestCase):
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(email='user@example.com', password='password')
+        category = Category.objects.create(name='Fiction')
+        self.books = Book.objects.bulk_create(
+            Book(title=f'Book {i}', year_published=2020, author_name='Author', price=10,
+                 category=category, stock=i % 3) for i in range(30))
+        self.client.force_login(self.user)
+
+    def send(self, method, book_ids):
+        return self.client.generic(method, reverse('cart_items'), json.dumps({'book_ids': book_ids}),
+                                   content_type='application/json')
+
+    def statuses(self, response):
+        self.assertEqual(response.status_code, 200)
+        return [(result['book_id'], result['status']) for result in response.json()['results']]
+
+    def test_add_reports_each_book(self):
+        in_stock, sold_out = self.books[1], self.books[0]
+        self.send('POST', [self.books[2].id])
+        response = self.send('POST', [in_stock.id, sold_out.id, self.books[2].id, 9999, in_stock.id])
+        self.assertEqual(self.statuses(response), [
+            (in_stock.id, 'added'), (sold_out.id, 'out_of_stock'),
+            (self.books[2].id, 'already_in_cart'), (9999, 'missing')])
+        in_stock.refresh_from_db()
+        self.assertEqual((in_stock.stock, in_stock.held), (0, 1))
+        self.assertEqual(CartItem.objects.filter(user=self.user, holds_stock=True).count(), 2)
+
+    def test_add_query_count_is_constant(self):
+        # sold out books take one more query, to tell out_of_stock from already_in_cart
+        for books, queries in ((self.books[1:3], 3), (self.books, 4)):
+            CartItem.objects.all().delete()
+            with self.assertNumQueries(queries):
+                add_books_to_cart(self.user, [book.id for book in books])
+
+    def test_book_already_in_cart_is_not_reserved_again(self):
+        book = self.books[2]
+        CartItem.objects.create(user=self.user, book=book)
+        self.assertEqual(self.statuses(self.send('POST', [book.id])), [(book.id, 'already_in_cart')])
+        book.refresh_from_db()
+        self.assertEqual((book.stock, book.held), (2, 0))
+
+    def test_remove_and_replace(self):
+        first, second, third = self.books[1], self.books[2], self.books[4]
+        self.send('POST', [first.id, second.id])
+        self.assertEqual(self.statuses(self.send('DELETE', [first.id, third.id])),
+                         [(first.id, 'removed'), (third.id, 'not_in_cart')])
+        first.refresh_from_db()
+        self.assertEqual((first.stock, first.held), (1, 0))
+
+        response = self.send('PUT', [third.id])
+        self.assertEqual(response.json()['removed'], [second.id])
+        self.assertEqual(self.statuses(response), [(third.id, 'added')])
+        self.assertEqual(list(CartItem.objects.values_list('book_id', flat=True)), [third.id])
+
+        response = self.send('PUT', [])
+        self.assertEqual(response.json(), {'results': [], 'removed': [third.id]})
+        self.assertFalse(CartItem.objects.exists())
+
+    def test_invalid_payloads(self):
+        self.assertEqual(self.send('POST', 'all').status_code, 400)
+        self.assertEqual(self.send('POST', list(range(101))).status_code, 400)
+        self.assertEqual(self.client.get(reverse('cart_items')).status_code, 405)
+        self.client.logout()
+        self.assertEqual(self.send('POST', [1]).status_code, 401)
+
+
+class CategoryMapTests(TestCase):
+
+    def setUp(self):
+        self.fiction = Category.objects.create(name='Fiction')
+        Book.objects.create(title='Novel', year_published=2000, author_name='A', price=5,
+                            category=self.fiction, stock=1)
+
+    def list_books(self, categories):
+        response = self.client.generic('GET', reverse('list_books'), json.dumps({'categories': categories}),
+                                       content_type='application/json')
+        return [(book['title'], book['category']) for book in response.json()['books']]
+
+    def test_loaded_once_until_a_category_changes(self):
+        category_map()
+        with self.assertNumQueries(0):
+            self.assertEqual(category_map().ids(['Fiction', 'Unknown']), [self.fiction.id])
+        self.fiction.name = 'Novels'
+        self.fiction.save()
+        with self.assertNumQueries(1):
+            self.assertEqual(category_map().by_id[self.fiction.id], 'Novels')
+        self.assertEqual(self.list_books(['Novels']), [('Novel', 'Novels')])
+        self.assertEqual(self.list_books(['Fiction']), [])
+
+    def test_other_processes_see_the_version_move(self):
+        category_map()
+        # a write elsewhere: no signal here, only the shared version moves
+        Category.objects.filter(id=self.fiction.id).update(name='Prose')
+        self.assertEqual(category_map().by_id[self.fiction.id], 'Fiction')
+        invalidate_category_map()
+        self.assertEqual(category_map().by_id[self.fiction.id], 'Prose')
+
+    def test_rows_in_unknown_categories_reload_the_map(self):
+        category_map()
+        poetry, = Category.objects.bulk_create([Category(name='Poetry')])
+        Book.objects.create(title='Poems', year_published=1999, author_name='B', price=7,
+                            category=poetry, stock=1)
+        self.assertEqual(self.list_books([]), [('Novel', 'Fiction'), ('Poems', 'Poetry')])
+
+    def test_rows_in_deleted_categories_keep_their_place(self):
+        rows = list(book_values(Book.objects.all()))
+        # what a lagging replica returns after the primary deleted the category
+        rows.append(dict(rows[0], id=rows[0]['id'] + 1, category_id=self.fiction.id + 1))
+        self.assertEqual([(book['title'], book['category']) for book in serialize_book_rows(rows)],
+                         [('Novel', 'Fiction'), ('Novel', None)])
+
+    def test_manage_books_resolves_names_from_the_map(self):
+        admin = CustomUser.objects.create_user(email='admin@example.com', password='password',
+                                               role=CustomUser.ADMIN)
+        self.client.force_login(admin)
+        book = {'title': 'Epic', 'author_name': 'C', 'price': 9, 'stock': 1, 'year_published': 1990}
+        response = self.client.post(reverse('manage_books'), json.dumps(dict(book, category='Fiction')),
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Book.objects.get(title='Epic').category, self.fiction)
+        response = self.client.post(reverse('manage_books'), json.dumps(dict(book, title='Other', category='Nope')),
+                                    content_type='application/json')
+        self.assertEqual(response.json(), {'error': 'No Category matches the given query.'})
+
+
+class OrderHistoryTests(TestCase):
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(email='user@example.com', password='password')
+        category = Category.objects.create(name='Fiction')
+        self.books = [Book.objects.create(title=f'Book {i}', year_published=2020, author_name='Author',
+                                          price=f'{i + 1}.50', category=category, stock=5) for i in range(3)]
+        self.client.force_login(self.user)
+
+    def buy(self, *books):
+        for book in books:
+            self.client.post(reverse('add_to_cart', args=[book.id]))
+        return self.client.put(reverse('checkout')).json()['order_id']
+
+    def test_checkout_records_prices_paid(self):
+        order_id = self.buy(self.books[0], self.books[1])
+        Book.objects.filter(id=self.books[0].id).update(price=99)
+        self.books[1].delete()
+        response = self.client.get(reverse('list_orders'))
+        self.assertEqual(response.json()['orders'], [{
+            'id': order_id,
+            'created_at': response.json()['orders'][0]['created_at'],
+            'total': '4.00',
+            'lines': [{'book_id': self.books[0].id, 'title': 'Book 0', 'price': '1.50'},
+                      {'book_id': None, 'title': 'Book 1', 'price': '2.50'}],
+        }])
+        self.assertEqual(self.client.put(reverse('checkout')).json(), {'message': 'Cart is empty'})
+
+    def test_lines_keep_the_price_when_the_book_price_changes(self):
+        order_id = self.buy(*self.books)
+        Book.objects.update(price=99)
+        lines = OrderLine.objects.filter(order_id=order_id).order_by('id')
+        self.assertEqual([(line.book_id, line.price) for line in lines],
+                         [(book.id, Decimal(book.price)) for book in self.books])
+        self.assertEqual(Order.objects.get(id=order_id).total, sum(line.price for line in lines))
+
+    def test_history_is_keyset_paged_newest_first(self):
+        ids = [self.buy(book) for book in self.books]
+        other = CustomUser.objects.create_user(email='other@example.com', password='password')
+        Order.objects.create(user=other, total=1)
+        seen, cursor = [], None
+        while True:
+            params = {'page_size': 2, **({'cursor': cursor} if cursor else {})}
+            with self.assertNumQueries(2):
+                page = self.client.get(reverse('list_orders'), params).json()
+            seen += [order['id'] for order in page['orders']]
+            cursor = page['next_cursor']
+            if not cursor:
+                break
+        self.assertEqual(seen, ids[::-1])
+
+    def test_history_query_uses_index(self):
+        orders = Order.objects.filter(user=self.user).order_by('-created_at', '-id')[:11]
+        self.assertIn('order_user_created_idx', orders.explain())
@@ -0,0 +1,125 @@
+"""
+Stateless signed-token authentication, used when ``settings.AUTH_MODE`` is
+``'token'``. ``login_user`` hands out a signed, expiring token carrying the
+user's id and role, and ``TokenAuthenticationMiddleware`` turns an
+``Authorization: Bearer <token>`` header back into ``request.user`` without
+reading the session or user tables. Logged out tokens are kept in a small
+revocation list in the cache until they would have expired anyway.
+"""
+import secrets
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+from .models import CustomUser
+
+
+TOKEN_SALT = 'api.tokens'
+REVOKED_KEY = 'token:revoked:{}'
+
+
+def token_auth_enabled():
+    return settings.AUTH_MODE == 'token'
+
+
+def issue_token(user):
+    payload = {'uid': user.pk, 'email': user.email, 'role': user.role,
+               'jti': secrets.token_urlsafe(8),
+               'exp': int(time.time()) + settings.TOKEN_AUTH_MAX_AGE}
+    return signing.dumps(payload, salt=TOKEN_SALT, compress=True)
+
+
+def _load(token):
+    try:
+        return signing.loads(token, salt=TOKEN_SALT, max_age=settings.TOKEN_AUTH_MAX_AGE)
+    except signing.BadSignature:
+        # also covers SignatureExpired
+        return None
+
+
+def verify_token(token):
+    """Return the token's payload, or None if it is invalid, expired or revoked."""
+    payload = _load(token)
+    if payload is None or cache.get(REVOKED_KEY.format(payload['jti'])):
+        return None
+    return payload
+
+
+async def averify_token(token):
+    payload = _load(token)
+    if payload is None or await cache.aget(REVOKED_KEY.format(payload['jti'])):
+        return None
+    return payload
+
+
+def revoke_token(token):
+    payload = _load(token)
+    if payload is None:
+        return
+    # keep the entry only as long as the token could still be used
+    remaining = max(payload['exp'] - int(time.time()), 1)
+    cache.set(REVOKED_KEY.format(payload['jti']), True, timeout=remaining)
+
+
+def token_user(payload):
+    """
+    A ``CustomUser`` built from the token instead of loaded from the
+    database. It has the id, email and role, which is all the views and
+    decorators read, and must never be saved.
+    """
+    user = CustomUser(pk=payload['uid'], email=payload['email'], role=payload['role'])
+    user._state.adding = False
+    return user
+
+
+def bearer_token(request):
+    header = request.META.get('HTTP_AUTHORIZATION', '')
+    scheme, _, token = header.partition(' ')
+    if scheme.lower() == 'bearer' and token:
+        return token.strip()
+    return None
+
+
+class TokenAuthenticationMiddleware:
+    """
+    Authenticate requests that carry a bearer token. Must come after
+    ``AuthenticationMiddleware`` so it replaces the lazy session user before
+    anything reads it.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        request.auth_token = None
+        if token_auth_enabled():
+            token = bearer_token(request)
+            self.authenticate(request, token, verify_token(token) if token else None)
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        request.auth_token = None
+        if token_auth_enabled():
+            token = bearer_token(request)
+            self.authenticate(request, token, await averify_token(token) if token else None)
+        return await self.get_response(request)
+
+    def authenticate(self, request, token, payload):
+        if payload is None:
+            return
+        user = token_user(payload)
+        request.auth_token = token
+        request.user = user
+
+        async def auser():
+            return user
+        request.auser = auser
@@ -1,15 +1,33 @@
+from django.conf import settings
 from django.urls import path
 
 from . import views
+from .metrics import metrics_view
 
-urlpatterns = [
-    path('books/', views.list_books, name='list_books'),
-    path('cart/add/<int:book_id>/', views.add_to_cart, name='add_to_cart'),
-    path('cart/', views.view_cart, name='view_cart'),
-    path('checkout/', views.checkout, name='checkout'),
-    path('manage_categories/', views.manage_categories, name='manage_categories'),
-    path('manage_books/', views.manage_books, name='manage_books'),
-    path('login/', views.login_user, name='login_user'),
-    path('create_user/', views.create_user, name='create_user'),
-    path('logout/', views.logout_user, name='logout_user')
-]
\ No newline at end of file
+
+def build_urlpatterns(async_views=False):
+    if async_views:
+        from . import async_views as hot_views
+    else:
+        hot_views = views
+    return [
+        path('books/', hot_views.list_books, name='list_books'),
+        path('books/search/', views.search_books_view, name='search_books'),
+        path('cart/add/<int:book_id>/', hot_views.add_to_cart, name='add_to_cart'),
+        path('cart/', hot_views.view_cart, name='view_cart'),
+        path('cart/items/', views.cart_items, name='cart_items'),
+        path('checkout/', views.checkout, name='checkout'),
+        path('orders/', views.list_orders, name='list_orders'),
+        path('manage_categories/', views.manage_categories, name='manage_categories'),
+        path('manage_books/', views.manage_books, name='manage_books'),
+        path('manage_books/import/', views.import_books_view, name='import_books'),
+        path('manage_books/export/', views.export_books_view, name='export_books'),
+        path('login/', hot_views.login_user, name='login_user'),
+        path('create_user/', views.create_user, name='create_user'),
+        path('logout/', hot_views.logout_user, name='logout_user'),
+        path('cache_stats/', views.cache_stats, name='cache_stats'),
+        path('metrics/', metrics_view, name='metrics'),
+    ]
+
+
+urlpatterns = build_urlpatterns(settings.ASYNC_VIEWS)
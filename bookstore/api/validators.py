@@ -12,175 +12,193 @@ def validate_email(email):
         return False
 
 
-def validate_manage_category_delete_payload(payload):
-    schema = {
-        "type": "object",
-        "properties": {
-            "name": {"type": "string",  "minLength": 1}
-        },
-        "required": ["name"],
-        "additionalProperties": False
-    }
-
-    try:
-        jsonschema.validate(payload, schema)
-    except jsonschema.ValidationError as e:
-        raise ValueError(
-            f"manage_category_delete_payload validation error: {e.message}")
-    except jsonschema.SchemaError as e:
-        raise ValueError(f"Schema validation error: {e}")
-
-
-def validate_manage_category_post_payload(payload):
-    schema = {
-        "type": "object",
-        "properties": {
-            "name": {"type": "string", "minLength": 1}
-        },
-        "required": ["name"],
-        "additionalProperties": False
-    }
-
-    try:
-        jsonschema.validate(payload, schema)
-    except jsonschema.ValidationError as e:
-        raise ValueError(
-            f"manage_category_post_payload validation error: {e.message}")
-    except jsonschema.SchemaError as e:
-        raise ValueError(f"Schema validation error: {e}")
-
-
-def validate_manage_category_put_payload(payload):
-    schema = {
-        "type": "object",
-        "properties": {
-            "old_name": {"type": "string",  "minLength": 1},
-            "new_name": {"type": "string",  "minLength": 1}
-        },
-        "required": ["old_name", "new_name"],
-        "additionalProperties": False
-    }
-
-    try:
-        jsonschema.validate(payload, schema)
-    except jsonschema.ValidationError as e:
-        raise ValueError(
-            f"manage_category_put_payload validation error: {e.message}")
-    except jsonschema.SchemaError as e:
-        raise ValueError(f"Schema validation error: {e}")
-
-
-def validate_manage_books_put_payload(payload):
-    schema = {
-        "type": "object",
-        "properties": {
-            "id": {"type": "integer"},
-            "category": {"type": "string", "minLength": 1},
-            "title": {"type": "string", "minLength": 1},
-            "author_name": {"type": "string", "minLength": 1},
-            "price": {"type": "number"},
-            "stock": {"type": "integer"},
-            "year_published": {"type": "integer"}
-        },
-        "required": ["id", "category", "title", "author_name", "price", "stock", "year_published"],
-        "additionalProperties": False
-    }
-
-    try:
-        jsonschema.validate(payload, schema)
-    except jsonschema.ValidationError as e:
-        raise ValueError(
-            f"manage_books_post_payload validation error: {e.message}")
-    except jsonschema.SchemaError as e:
-        raise ValueError(f"Schema validation error: {e.message}")
-
-
-def validate_manage_books_post_payload(payload):
-    schema = {
-        "type": "object",
-        "properties": {
-            "category": {"type": "string", "minLength": 1},
-            "title": {"type": "string", "minLength": 1},
-            "author_name": {"type": "string", "minLength": 1},
-            "price": {"type": "number"},
-            "stock": {"type": "integer"},
-            "year_published": {"type": "integer"}
-        },
-        "required": ["category", "title", "author_name", "price", "stock", "year_published"],
-        "additionalProperties": False
-    }
-
-    try:
-        jsonschema.validate(payload, schema)
-    except jsonschema.ValidationError as e:
-        raise ValueError(
-            f"manage_books_post_payload validation error: {e.message}")
-    except jsonschema.SchemaError as e:
-        raise ValueError(f"Schema validation error: {e.message}")
-
-
-def validate_manage_books_delete_payload(payload):
-    schema = {
-        "type": "object",
-        "properties": {
-            "title": {"type": "string", "minLength": 1}
-        },
-        "required": ["title"],
-        "additionalProperties": False
-    }
-
-    try:
-        jsonschema.validate(payload, schema)
-    except jsonschema.ValidationError as e:
-        raise ValueError(
-            f"manage_books_delete_payload validation error: {e.message}")
-    except jsonschema.SchemaError as e:
-        raise ValueError(f"Schema validation error: {e.message}")
-
-
-def validate_book_list_get_payload(payload):
-    schema = {
-        "type": "object",
-        "properties": {
-            "categories": {
-                "type": "array",
-                "items": {"type": "string"}
-            }
-        },
-        "required": ["categories"],
-        "additionalProperties": False
-
-    }
-
-    try:
-        jsonschema.validate(payload, schema)
-    except jsonschema.ValidationError as e:
-        raise ValueError(
-            f"book_list_get_payload validation error: {e.message}")
-    except jsonschema.SchemaError as e:
-        raise ValueError(f"Schema validation error: {e.message}")
-
-
-def validate_post_login_payload(payload):
-    schema = {
-        "type": "object",
-        "properties": {
-            "email": {"type": "string", "format": "email"},
-            "password": {"type": "string", "minLength": 1},
-        },
-        "required": ["email", "password"],
-        "additionalProperties": False
-    }
-
-    try:
-        jsonschema.validate(payload, schema)
-        if not validate_email(payload['email']):
+class PayloadValidator:
+    """
+    A JSON schema checked against its metaschema and compiled once, so
+    validating a request payload only walks the payload itself.
+    """
+
+    def __init__(self, label, schema):
+        cls = jsonschema.validators.validator_for(schema)
+        cls.check_schema(schema)
+        self.label = label
+        self.schema = schema
+        self._validator = cls(schema)
+
+    def iter_errors(self, payload):
+        return self._validator.iter_errors(payload)
+
+    def best_error(self, payload):
+        return jsonschema.exceptions.best_match(self.iter_errors(payload))
+
+    def validate(self, payload, all_errors=False):
+        if all_errors:
+            errors = sorted(self.iter_errors(payload),
+                            key=jsonschema.exceptions.relevance)
+            if errors:
+                messages = '; '.join(error.message for error in errors)
+                raise ValueError(f"{self.label} validation error: {messages}")
+            return
+        error = self.best_error(payload)
+        if error is not None:
+            raise ValueError(f"{self.label} validation error: {error.message}")
+
+
+# compiled validators, keyed by schema name
+VALIDATORS = {}
+
+
+def register_schema(name, schema, label=None):
+    validator = PayloadValidator(label or f"{name}_payload", schema)
+    VALIDATORS[name] = validator
+    return validator
+
+
+def get_validator(name):
+    return VALIDATORS[name]
+
+
+register_schema('manage_category_delete', {
+    "type": "object",
+    "properties": {
+        "name": {"type": "string",  "minLength": 1}
+    },
+    "required": ["name"],
+    "additionalProperties": False
+})
+
+register_schema('manage_category_post', {
+    "type": "object",
+    "properties": {
+        "name": {"type": "string", "minLength": 1}
+    },
+    "required": ["name"],
+    "additionalProperties": False
+})
+
+register_schema('manage_category_put', {
+    "type": "object",
+    "properties": {
+        "old_name": {"type": "string",  "minLength": 1},
+        "new_name": {"type": "string",  "minLength": 1}
+    },
+    "required": ["old_name", "new_name"],
+    "additionalProperties": False
+})
+
+# the PUT schema has always reported itself as the post payload
+register_schema('manage_books_put', {
+    "type": "object",
+    "properties": {
+        "id": {"type": "integer"},
+        "category": {"type": "string", "minLength": 1},
+        "title": {"type": "string", "minLength": 1},
+        "author_name": {"type": "string", "minLength": 1},
+        "price": {"type": "number"},
+        "stock": {"type": "integer"},
+        "year_published": {"type": "integer"}
+    },
+    "required": ["id", "category", "title", "author_name", "price", "stock", "year_published"],
+    "additionalProperties": False
+}, label='manage_books_post_payload')
+
+register_schema('manage_books_post', {
+    "type": "object",
+    "properties": {
+        "category": {"type": "string", "minLength": 1},
+        "title": {"type": "string", "minLength": 1},
+        "author_name": {"type": "string", "minLength": 1},
+        "price": {"type": "number"},
+        "stock": {"type": "integer"},
+        "year_published": {"type": "integer"}
+    },
+    "required": ["category", "title", "author_name", "price", "stock", "year_published"],
+    "additionalProperties": False
+})
+
+register_schema('manage_books_delete', {
+    "type": "object",
+    "properties": {
+        "title": {"type": "string", "minLength": 1}
+    },
+    "required": ["title"],
+    "additionalProperties": False
+})
+
+register_schema('book_list_get', {
+    "type": "object",
+    "properties": {
+        "categories": {
+            "type": "array",
+            "items": {"type": "string"}
+        }
+    },
+    "required": ["categories"],
+    "additionalProperties": False
+})
+
+register_schema('cart_items', {
+    "type": "object",
+    "properties": {
+        "book_ids": {
+            "type": "array",
+            "items": {"type": "integer"},
+            "maxItems": 100
+        }
+    },
+    "required": ["book_ids"],
+    "additionalProperties": False
+})
+
+register_schema('post_login', {
+    "type": "object",
+    "properties": {
+        "email": {"type": "string", "format": "email"},
+        "password": {"type": "string", "minLength": 1},
+    },
+    "required": ["email", "password"],
+    "additionalProperties": False
+})
+
+
+def validate_manage_category_delete_payload(payload, all_errors=False):
+    VALIDATORS['manage_category_delete'].validate(payload, all_errors)
+
+
+def validate_manage_category_post_payload(payload, all_errors=False):
+    VALIDATORS['manage_category_post'].validate(payload, all_errors)
+
+
+def validate_manage_category_put_payload(payload, all_errors=False):
+    VALIDATORS['manage_category_put'].validate(payload, all_errors)
+
+
+def validate_manage_books_put_payload(payload, all_errors=False):
+    VALIDATORS['manage_books_put'].validate(payload, all_errors)
+
+
+def validate_manage_books_post_payload(payload, all_errors=False):
+    VALIDATORS['manage_books_post'].validate(payload, all_errors)
+
+
+def validate_manage_books_delete_payload(payload, all_errors=False):
+    VALIDATORS['manage_books_delete'].validate(payload, all_errors)
+
+
+def validate_book_list_get_payload(payload, all_errors=False):
+    VALIDATORS['book_list_get'].validate(payload, all_errors)
+
+
+def validate_cart_items_payload(payload, all_errors=False):
+    VALIDATORS['cart_items'].validate(payload, all_errors)
+
+
+def validate_post_login_payload(payload, all_errors=False):
+    validator = VALIDATORS['post_login']
+    error = validator.best_error(payload)
+    if error is not None:
+        if 'email' in error.path:
             raise ValueError("Invalid email")
-    except jsonschema.ValidationError as e:
-        if 'email' in e.path:
-            raise ValueError("Invalid email")
-        else:
-            raise ValueError(
-                f"post_login_payload validation error: {e.message}")
-    except jsonschema.SchemaError as e:
-        raise ValueError(f"Schema validation error: {e.message}")
+        validator.validate(payload, all_errors)
+    if not validate_email(payload['email']):
+        raise ValueError("Invalid email")
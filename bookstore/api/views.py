@@ -1,19 +1,43 @@
-from django.http import JsonResponse
+from django.conf import settings
+from django.http import Http404, JsonResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.contrib.auth import authenticate, login, logout
 from django.core.exceptions import ObjectDoesNotExist
 from functools import wraps
+from asgiref.sync import iscoroutinefunction, sync_to_async
 from .validators import *
 from django.shortcuts import get_object_or_404
 from django.db import transaction
-from .models import CustomUser, Category, Book, CartItem
-from django.views.decorators.http import require_POST
-from django.core.paginator import Paginator
-from .serializers import BookSerializer
+from .models import CustomUser, Category, Book, CartItem, Order
+from django.views.decorators.http import require_POST, condition
+from .pagination import (paginate, BOOK_ORDERINGS, CATEGORY_ORDERINGS, ORDER_ORDERINGS, DEFAULT_PAGE_SIZE,
+                         MAX_PAGE_SIZE, TRUE_VALUES)
+from .search import search_books
+from .bulk_import import import_books
+from .export import export_queryset, iter_export_lines, CONTENT_TYPES as EXPORT_CONTENT_TYPES
+from .serializers import book_values, serialize_book_rows, serialize_orders
+from .checkout import checkout_cart
+from .catalog_cache import cached_listing, catalog_cache_stats, listing_etag, listing_last_modified
+from .tokens import issue_token, revoke_token, token_auth_enabled
+from .hashers import HashingBusy, hash_password
+from .querybudget import query_budget
+from .routers import replica_reads
+from .category_map import category_map
+from .reservations import (add_book_to_cart, add_books_to_cart, discard_cart_items, remove_books_from_cart,
+                           replace_cart, ALREADY_IN_CART, UNAVAILABLE)
 import json
 
 
 def login_required_json(view_func):
+    if iscoroutinefunction(view_func):
+        @wraps(view_func)
+        async def _async_wrapped_view(request, *args, **kwargs):
+            user = await request.auser()
+            if not user.is_authenticated:
+                return JsonResponse({'error': 'User is not logged in'}, status=401)
+            return await view_func(request, *args, **kwargs)
+        return _async_wrapped_view
+
     @wraps(view_func)
     def _wrapped_view(request, *args, **kwargs):
         if not request.user.is_authenticated:
@@ -22,6 +46,40 @@ def login_required_json(view_func):
     return _wrapped_view
 
 
+def read_condition(etag_func=None, last_modified_func=None):
+    """
+    ``condition`` for GET and HEAD requests only. Other methods skip it, so
+    an If-Match or If-Unmodified-Since header sent with a write can't turn
+    it into a 412. For async views both functions run in a thread first,
+    since they may read the cache or the database.
+    """
+    def validators(request, *args, **kwargs):
+        etag = etag_func(request, *args, **kwargs) if etag_func else None
+        last_modified = last_modified_func(request, *args, **kwargs) if last_modified_func else None
+        return etag, last_modified
+
+    def decorator(view_func):
+        conditional_view = condition(etag_func=etag_func, last_modified_func=last_modified_func)(view_func)
+        if iscoroutinefunction(view_func):
+            @wraps(view_func)
+            async def _async_wrapped_view(request, *args, **kwargs):
+                if request.method not in ('GET', 'HEAD'):
+                    return await view_func(request, *args, **kwargs)
+                etag, last_modified = await sync_to_async(validators)(request, *args, **kwargs)
+                precomputed = condition(etag_func=lambda *a, **k: etag,
+                                        last_modified_func=lambda *a, **k: last_modified)
+                return await precomputed(view_func)(request, *args, **kwargs)
+            return _async_wrapped_view
+
+        @wraps(view_func)
+        def _wrapped_view(request, *args, **kwargs):
+            if request.method in ('GET', 'HEAD'):
+                return conditional_view(request, *args, **kwargs)
+            return view_func(request, *args, **kwargs)
+        return _wrapped_view
+    return decorator
+
+
 def is_admin(user):
     return user.role == CustomUser.ADMIN
 
@@ -31,48 +89,112 @@ def custom_user_passes_test(test_func, login_url=None, redirect_field_name='next
     Decorator for views that checks that the user passes the given test,
     returning a JSON response if the test fails.
     """
+    def forbidden():
+        if custom_response:
+            return custom_response
+        return JsonResponse({'error': 'You do not have permission to access this resource.'}, status=403)
+
     def decorator(view_func):
+        if iscoroutinefunction(view_func):
+            @wraps(view_func)
+            async def _async_wrapped_view(request, *args, **kwargs):
+                if not test_func(await request.auser()):
+                    return forbidden()
+                return await view_func(request, *args, **kwargs)
+            return _async_wrapped_view
+
         @wraps(view_func)
         def _wrapped_view(request, *args, **kwargs):
             if not test_func(request.user):
-                if custom_response:
-                    return custom_response
-                return JsonResponse({'error': 'You do not have permission to access this resource.'}, status=403)
+                return forbidden()
             return view_func(request, *args, **kwargs)
         return _wrapped_view
     return decorator
 
 
+def book_page(request, books):
+    page = paginate(request, book_values(books), BOOK_ORDERINGS, 'title')
+    return {'books': serialize_book_rows(page.object_list), **page.meta()}
+
+
+def in_stock_books(category_names, categories=None):
+    if category_names:
+        categories = categories or category_map()
+        return Book.objects.filter(
+            category_id__in=categories.ids(category_names), stock__gt=0)
+    return Book.objects.filter(stock__gt=0)
+
+
+def category_id_or_404(name):
+    category_id = category_map().by_name.get(name)
+    if category_id is None:
+        raise Http404('No Category matches the given query.')
+    return category_id
+
+
+def hashing_busy(error):
+    response = JsonResponse({"error": str(error)}, status=503)
+    response['Retry-After'] = str(settings.PASSWORD_HASH_RETRY_AFTER)
+    return response
+
+
+def cart_results(results):
+    return [{'book_id': book_id, 'status': status} for book_id, status in results.items()]
+
+
 # add to cart by admin or member
+@query_budget(5)
 @csrf_exempt
 @login_required_json
 def add_to_cart(request, book_id):
     try:
         if request.method == "POST":
-            book = get_object_or_404(Book, id=book_id, stock__gt=0)
-            if not CartItem.objects.filter(user=request.user, book=book).exists():
-                CartItem.objects.create(user=request.user, book=book)
-            else:
+            result = add_book_to_cart(request.user, book_id)
+            if result == ALREADY_IN_CART:
                 return JsonResponse({'message': 'Book already exists in cart!'}, status=409)
+            if result == UNAVAILABLE:
+                return JsonResponse({'error': 'No Book matches the given query.'}, status=400)
             return JsonResponse({'message': 'Book added to cart successfully'}, status=201)
         else:
             return JsonResponse({'error': 'Method not allowed'}, status=405)
     except Exception as e:
         return JsonResponse({"error": str(e)}, status=400)
 
+# add (POST), remove (DELETE) or replace (PUT) many cart items by member or admin
+@query_budget(10)
+@csrf_exempt
+@login_required_json
+def cart_items(request):
+    try:
+        if request.method in ('POST', 'PUT', 'DELETE'):
+            data = json.loads(request.body)
+            validate_cart_items_payload(data)
+            book_ids = data['book_ids']
+            if request.method == 'POST':
+                return JsonResponse({'results': cart_results(add_books_to_cart(request.user, book_ids))}, status=200)
+            if request.method == 'DELETE':
+                return JsonResponse({'results': cart_results(remove_books_from_cart(request.user, book_ids))}, status=200)
+            results, removed = replace_cart(request.user, book_ids)
+            return JsonResponse({'results': cart_results(results), 'removed': removed}, status=200)
+        else:
+            return JsonResponse({'error': 'Method not allowed'}, status=405)
+    except Exception as e:
+        return JsonResponse({"error": str(e)}, status=400)
 
 # view cart by member or admin
+@query_budget(5)
 @login_required_json
 def view_cart(request):
     try:
         if request.method == 'GET':
-            cart_items = CartItem.objects.filter(user=request.user)
-            for item in cart_items:
-                if item.is_expired():
-                    item.delete()
-            cart_items = CartItem.objects.filter(user=request.user)
-            cart_items_data = [{'book_id': item.book.id, 'title': item.book.title,
-                                'price': item.book.price} for item in cart_items]
+            cutoff = CartItem.expiry_cutoff()
+            discard_cart_items(CartItem.objects.filter(
+                user=request.user, added_at__lt=cutoff))
+            cart_items = CartItem.objects.filter(
+                user=request.user, added_at__gte=cutoff).order_by('id')
+            cart_items_data = [{'book_id': item['book_id'], 'title': item['book__title'],
+                                'price': item['book__price']}
+                               for item in cart_items.values('book_id', 'book__title', 'book__price')]
             return JsonResponse({'cart_items': cart_items_data}, status=200)
         else:
             return JsonResponse({'error': 'Method not allowed'}, status=405)
@@ -81,34 +203,22 @@ def view_cart(request):
 
 
 # check out by member or admin
+@query_budget(12)
 @csrf_exempt
 @login_required_json
 @transaction.atomic
 def checkout(request):
     try:
         if request.method == 'PUT':
-            cart_items = CartItem.objects.filter(user=request.user)
-            expired_books, order_summary, out_of_stock = [], [], []
-            if not cart_items:
+            summary = checkout_cart(request.user)
+            if summary is None:
                 return JsonResponse({"message": "Cart is empty"}, status=200)
-            with transaction.atomic():
-                for item in cart_items:
-                    if item.is_expired():
-                        expired_books.append(item.book.title)
-                    else:
-                        book = Book.objects.get(id=item.book.id)
-                        if book.stock:
-                            order_summary.append(item.book.title)
-                            book.stock -= 1
-                            book.save()
-                        else:
-                            out_of_stock.append(item.book.title)
-                    item.delete()
             response = {
                 "message": "Transaction Summary",
-                "order_summary": order_summary,
-                "expired_books": expired_books,
-                "out_of_stock": out_of_stock
+                "order_summary": summary['order_summary'],
+                "expired_books": summary['expired_books'],
+                "out_of_stock": summary['out_of_stock'],
+                "order_id": summary['order_id']
             }
             return JsonResponse(response, status=200)
         else:
@@ -116,10 +226,27 @@ def checkout(request):
     except Exception as e:
         return JsonResponse({"error": str(e)}, status=400)
 
+# order history of the logged in user, newest first
+@query_budget(4)
+@login_required_json
+def list_orders(request):
+    try:
+        if request.method == 'GET':
+            orders = Order.objects.filter(user=request.user).prefetch_related('lines')
+            page = paginate(request, orders, ORDER_ORDERINGS, '-created_at')
+            return JsonResponse({'orders': serialize_orders(page), **page.meta()}, status=200)
+        else:
+            return JsonResponse({'error': 'Method not allowed'}, status=405)
+    except Exception as e:
+        return JsonResponse({"error": str(e)}, status=400)
+
 # manage categories by admin (CRUD)
+@query_budget(8)
 @csrf_exempt
 @login_required_json
 @custom_user_passes_test(is_admin)
+@replica_reads
+@read_condition(etag_func=listing_etag, last_modified_func=listing_last_modified)
 def manage_categories(request):
     try:
         if request.method == 'POST':
@@ -131,15 +258,10 @@ def manage_categories(request):
 
         elif request.method == 'GET':
             categories = Category.objects.all()
-            order_by = request.GET.get('order_by', 'name')
-            categories = categories.order_by(order_by)
-            page_number = request.GET.get('page', 1)
-            page_size = request.GET.get('page_size', 10)
-            paginator = Paginator(categories, page_size)
-            page_obj = paginator.get_page(page_number)
+            page = paginate(request, categories, CATEGORY_ORDERINGS, 'name')
             categories_data = [{'name': category.name}
-                               for category in page_obj]
-            return JsonResponse({'categories': categories_data}, status=200)
+                               for category in page]
+            return JsonResponse({'categories': categories_data, **page.meta()}, status=200)
 
         elif request.method == 'PUT':
             data = json.loads(request.body)
@@ -173,9 +295,12 @@ def manage_categories(request):
 
 
 # manage books by admin (CRUD)
+@query_budget(8)
 @csrf_exempt
 @login_required_json
 @custom_user_passes_test(is_admin)
+@replica_reads
+@read_condition(etag_func=listing_etag, last_modified_func=listing_last_modified)
 def manage_books(request):
     try:
         if request.method == 'POST':
@@ -187,21 +312,15 @@ def manage_books(request):
             price = data.get('price')
             category_name = data.get('category')
             stock = data.get('stock')
-            category = get_object_or_404(Category, name=category_name)
+            category_id = category_id_or_404(category_name)
             Book.objects.create(title=title, year_published=year_published,
-                                author_name=author_name, price=price, category=category, stock=stock)
+                                author_name=author_name, price=price, category_id=category_id, stock=stock)
             return JsonResponse({'message': 'Book added successfully'}, status=201)
 
         elif request.method == 'GET':
-            books = Book.objects.all()
-            order_by = request.GET.get('order_by', 'title')
-            books = books.order_by(order_by)
-            page_number = request.GET.get('page', 1)
-            page_size = request.GET.get('page_size', 10)
-            paginator = Paginator(books, page_size)
-            page_obj = paginator.get_page(page_number)
-            serializer = BookSerializer(page_obj, many=True)
-            return JsonResponse({'books': serializer.data}, status=200)
+            payload = cached_listing('manage_books', request.GET.dict(),
+                                     lambda: book_page(request, Book.objects.all()))
+            return JsonResponse(payload, status=200)
 
         elif request.method == 'PUT':
             data = json.loads(request.body)
@@ -220,8 +339,8 @@ def manage_books(request):
             book.year_published = year_published if year_published else book.year_published
             book.author_name = author_name if author_name else book.author_name
             book.price = price if price else book.price
-            book.category = get_object_or_404(
-                Category, name=category_name) if category_name else book.category
+            book.category_id = category_id_or_404(
+                category_name) if category_name else book.category_id
             book.save()
             return JsonResponse({'message': 'Book updated successfully'}, status=200)
 
@@ -242,32 +361,97 @@ def manage_books(request):
         return JsonResponse({"error": str(e)}, status=400)
 
 
+# bulk upsert books from an NDJSON or CSV body by admin, the budget grows with each chunk
+@query_budget(4)
+@csrf_exempt
+@login_required_json
+@custom_user_passes_test(is_admin)
+def import_books_view(request):
+    try:
+        if request.method == 'POST':
+            fmt = request.GET.get('format')
+            if not fmt:
+                fmt = 'csv' if request.content_type == 'text/csv' else 'ndjson'
+            report = import_books(request, fmt)
+            return JsonResponse(report.as_dict(), status=200)
+        else:
+            return JsonResponse({'error': 'Method not allowed'}, status=405)
+    except Exception as e:
+        return JsonResponse({"error": str(e)}, status=400)
+
+
+# stream the whole catalog as NDJSON or CSV by admin
+@query_budget(4)
+@login_required_json
+@custom_user_passes_test(is_admin)
+def export_books_view(request):
+    try:
+        if request.method == 'GET':
+            fmt = request.GET.get('format', 'ndjson')
+            books = export_queryset(request.GET.getlist('category'),
+                                    request.GET.get('in_stock') in TRUE_VALUES)
+            response = StreamingHttpResponse(iter_export_lines(books, fmt),
+                                             content_type=EXPORT_CONTENT_TYPES[fmt])
+            response['Content-Disposition'] = f'attachment; filename="books.{fmt}"'
+            return response
+        else:
+            return JsonResponse({'error': 'Method not allowed'}, status=405)
+    except Exception as e:
+        return JsonResponse({"error": str(e)}, status=400)
+
+
+# catalog cache counters for admin
+@query_budget(2)
+@login_required_json
+@custom_user_passes_test(is_admin)
+def cache_stats(request):
+    if request.method == 'GET':
+        return JsonResponse(catalog_cache_stats(), status=200)
+    return JsonResponse({'error': 'Method not allowed'}, status=405)
+
+
 # list all books that are in stock
+@query_budget(4)
+@replica_reads
+@read_condition(etag_func=listing_etag, last_modified_func=listing_last_modified)
 def list_books(request):
     try:
         if request.method == 'GET':
             data = json.loads(request.body)
             validate_book_list_get_payload(data)
             category_names = data['categories']
-            if category_names:
-                books = Book.objects.filter(
-                    category__name__in=category_names, stock__gt=0)
-            else:
-                books = Book.objects.filter(stock__gt=0)
-            order_by = request.GET.get('order_by', 'title')
-            books = books.order_by(order_by)
-            page_number = request.GET.get('page', 1)
-            page_size = request.GET.get('page_size', 10)
-            paginator = Paginator(books, page_size)
-            page_obj = paginator.get_page(page_number)
-            serializer = BookSerializer(page_obj, many=True)
-            return JsonResponse({'books': serializer.data}, status=200)
+            books = in_stock_books(category_names)
+            params = dict(request.GET.dict(), categories=sorted(category_names))
+            payload = cached_listing('list_books', params,
+                                     lambda: book_page(request, books))
+            return JsonResponse(payload, status=200)
+        else:
+            return JsonResponse({'error': 'Method not allowed'}, status=405)
+    except Exception as e:
+        return JsonResponse({"error": str(e)}, status=400)
+
+# search books in stock by title or author
+@query_budget(4)
+def search_books_view(request):
+    try:
+        if request.method == 'GET':
+            query = request.GET.get('q', '').strip()
+            if not query:
+                return JsonResponse({'error': 'q is required'}, status=400)
+            page_number = max(int(request.GET.get('page', 1)), 1)
+            page_size = min(int(request.GET.get('page_size', DEFAULT_PAGE_SIZE)), MAX_PAGE_SIZE)
+            if page_size < 1:
+                raise ValueError('page_size must be a positive integer')
+            books = search_books(query, (page_number - 1) * page_size, page_size + 1)
+            return JsonResponse({'books': serialize_book_rows(books[:page_size]),
+                                 'has_more': len(books) > page_size}, status=200)
         else:
             return JsonResponse({'error': 'Method not allowed'}, status=405)
     except Exception as e:
         return JsonResponse({"error": str(e)}, status=400)
 
 # create new user
+@query_budget(4)
 @require_POST
 def create_user(request):
     try:
@@ -276,15 +460,18 @@ def create_user(request):
         email = data.get('email')
         password = data.get('password')
         user = CustomUser(email=email)
-        user.set_password(password)  # This hashes the password
+        user.password = hash_password(password)
         user.save()
         return JsonResponse({'message': "user created successfully"}, status=201)
+    except HashingBusy as e:
+        return hashing_busy(e)
     except Exception as e:
         if 'UNIQUE constraint failed' in str(e):
             return JsonResponse({'error': 'Email cannot be same'}, status=400)
         return JsonResponse({"error": str(e)}, status=400)
 
 # login user
+@query_budget(10)
 def login_user(request):
     try:
         if request.method == 'POST':
@@ -294,20 +481,29 @@ def login_user(request):
             password = data.get('password')
             user = authenticate(request, email=email, password=password)
             if user is not None:
+                if token_auth_enabled():
+                    return JsonResponse({'message': 'Login successful',
+                                         'token': issue_token(user)}, status=200)
                 login(request, user)
                 return JsonResponse({'message': 'Login successful'}, status=200)
             else:
                 return JsonResponse({'error': 'Invalid username or password'}, status=400)
         else:
             return JsonResponse({'error': 'Method not allowed'}, status=405)
+    except HashingBusy as e:
+        return hashing_busy(e)
     except Exception as e:
         return JsonResponse({"error": str(e)}, status=400)
 
 # logout user
+@query_budget(4)
 def logout_user(request):
     try:
         if request.method == 'POST':
-            logout(request)
+            if getattr(request, 'auth_token', None):
+                revoke_token(request.auth_token)
+            else:
+                logout(request)
             return JsonResponse({'message': 'Logout Success'}, status=200)
         return JsonResponse({'error': 'Method not allowed'}, status=405)
     except Exception as e:
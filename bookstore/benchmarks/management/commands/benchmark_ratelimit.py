@@ -0,0 +1,64 @@
+import json
+import time
+
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand
+from django.http import HttpResponse
+from django.test import RequestFactory, override_settings
+from django.urls import resolve, reverse
+
+from api.ratelimit import RateLimitMiddleware, memory_buckets
+
+
+# the per-request budget the rate limiter was specified with
+TARGET_US = 50
+
+
+class Command(BaseCommand):
+    help = ('Measure the time RateLimitMiddleware adds to a request, for a plain route '
+            'and for a route with a concurrency cap, with each bucket store.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=20000)
+        parser.add_argument('--clients', type=int, default=1000,
+                            help='Distinct client addresses the requests are spread over.')
+
+    def handle(self, *args, **options):
+        factory = RequestFactory()
+        response = HttpResponse()
+        requests = []
+        for i in range(options['requests']):
+            for route in ('list_books', 'checkout'):
+                request = factory.get(reverse(route), REMOTE_ADDR=f'10.0.{i % options["clients"] // 256}.'
+                                                                 f'{i % options["clients"] % 256}')
+                request.user = AnonymousUser()
+                # Django resolves the route before process_view runs
+                request.resolver_match = resolve(request.path_info)
+                requests.append((route, request))
+
+        def get_response(request):
+            return response
+
+        results = {'requests': options['requests'], 'clients': options['clients'], 'target_us': TARGET_US}
+        for store in ('memory', 'cache'):
+            memory_buckets.clear()
+            # limits high enough that every request is let through
+            with override_settings(RATE_LIMIT_ENABLED=True, RATE_LIMIT_STORE=store,
+                                   RATE_LIMITS={'default': (1e9, 1e9)}, CONCURRENCY_LIMITS={'checkout': 1000}):
+                # process_view runs inside the chain the middleware wraps
+                middleware = RateLimitMiddleware(
+                    lambda request: middleware.process_view(request, None, (), {}) or response)
+                for route in ('list_books', 'checkout'):
+                    batch = [request for name, request in requests if name == route]
+                    bare = self.time_calls(get_response, batch)
+                    limited = self.time_calls(middleware, batch)
+                    results[f'{store}:{route}_us'] = round((limited - bare) / len(batch) * 1e6, 2)
+        results['within_target'] = all(value <= TARGET_US for key, value in results.items()
+                                       if key.endswith('_us') and key != 'target_us')
+        self.stdout.write(json.dumps(results, indent=2))
+
+    def time_calls(self, func, requests):
+        start = time.perf_counter()
+        for request in requests:
+            func(request)
+        return time.perf_counter() - start
@@ -0,0 +1,75 @@
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test import override_settings
+
+from api.models import Book, CartItem
+from benchmarks.runner import SCENARIOS, quiet_request_log, run_scenario
+from benchmarks.seed import EMAIL_DOMAIN, PREFIX
+
+
+# SQLite as configured before the production profile
+BASELINE = {
+    'CONN_MAX_AGE': 0,
+    'transaction_mode': None,
+    'pragmas': {'journal_mode': 'delete', 'synchronous': 'full', 'mmap_size': 0, 'cache_size': -2000},
+}
+
+
+class Command(BaseCommand):
+    help = ('Run a write heavy scenario concurrently against the seeded SQLite database, '
+            'first with default SQLite settings and then with the production profile '
+            '(WAL, busy_timeout, IMMEDIATE transactions, persistent connections).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scenario', choices=sorted(SCENARIOS), default='hot_titles')
+        parser.add_argument('--iterations', type=int, default=400)
+        parser.add_argument('--concurrency', type=int, default=8)
+        parser.add_argument('--hot-stock', type=int, default=50,
+                            help='Stock given back to the hot books before each run.')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite' or connection.settings_dict['NAME'] == ':memory:':
+            raise CommandError('Needs a file based SQLite database seeded with seed_bookstore')
+        db_settings = connections.settings['default']
+        tuned = {
+            'CONN_MAX_AGE': db_settings.get('CONN_MAX_AGE', 0),
+            'transaction_mode': db_settings.get('OPTIONS', {}).get('transaction_mode'),
+            'pragmas': settings.SQLITE_PRAGMAS,
+        }
+        original = (db_settings.get('CONN_MAX_AGE', 0), dict(db_settings.get('OPTIONS', {})))
+        results = {'scenario': options['scenario'], 'iterations': options['iterations'],
+                   'concurrency': options['concurrency']}
+        try:
+            for name, profile in (('baseline', BASELINE), ('production', tuned)):
+                self.use_profile(db_settings, profile)
+                self.reset(options['hot_stock'])
+                with override_settings(SQLITE_PRAGMAS=profile['pragmas'], ALLOWED_HOSTS=['testserver'],
+                                       RATE_LIMIT_ENABLED=False), quiet_request_log():
+                    connections.close_all()
+                    results[name] = run_scenario(options['scenario'], options['iterations'],
+                                                 options['concurrency'])
+        finally:
+            db_settings['CONN_MAX_AGE'], db_settings['OPTIONS'] = original
+            connections.close_all()
+        results['throughput_ratio'] = round(
+            results['production']['throughput_rps'] / results['baseline']['throughput_rps'], 2)
+        self.stdout.write(json.dumps(results, indent=2))
+
+    def use_profile(self, db_settings, profile):
+        db_settings['CONN_MAX_AGE'] = profile['CONN_MAX_AGE']
+        options = dict(db_settings.get('OPTIONS', {}))
+        options.pop('transaction_mode', None)
+        if profile['transaction_mode']:
+            options['transaction_mode'] = profile['transaction_mode']
+        db_settings['OPTIONS'] = options
+
+    def reset(self, hot_stock):
+        # both runs start from the same carts and stock
+        CartItem.objects.filter(user__email__endswith=f'@{EMAIL_DOMAIN}').delete()
+        Book.objects.filter(title__startswith=f'{PREFIX} book ', held__gt=0).update(held=0)
+        hot = list(Book.objects.filter(title__startswith=f'{PREFIX} book ')
+                   .order_by('id').values_list('id', flat=True)[:5])
+        Book.objects.filter(id__in=hot).update(stock=hot_stock)
@@ -0,0 +1,63 @@
+import json
+import platform
+import time
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import override_settings
+
+from api.models import Book, CartItem, Category, CustomUser
+from benchmarks.runner import SCENARIOS, quiet_request_log, replay, run_scenario
+
+
+class Command(BaseCommand):
+    help = ('Run the load scenarios against data from seed_bookstore, or replay a '
+            'request log, and print p50/p95/p99 latency and throughput as JSON.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS),
+                            help='Scenario to run, can be repeated. Defaults to all of them.')
+        parser.add_argument('--iterations', type=int, default=100)
+        parser.add_argument('--concurrency', type=int, default=1)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--replay', metavar='FILE',
+                            help='Replay a JSON lines request log instead of the scenarios.')
+        parser.add_argument('--output', metavar='FILE', help='Also write the results to FILE.')
+        parser.add_argument('--rate-limits', action='store_true',
+                            help='Keep rate limiting on, it is turned off by default.')
+
+    def handle(self, *args, **options):
+        overrides = {'ALLOWED_HOSTS': ['testserver']}
+        if not options['rate_limits']:
+            overrides['RATE_LIMIT_ENABLED'] = False
+        results = {
+            'started_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'environment': {'python': platform.python_version(), 'django': django.get_version(),
+                            'database': connection.vendor, 'async_views': settings.ASYNC_VIEWS},
+            'dataset': {'categories': Category.objects.count(), 'books': Book.objects.count(),
+                        'users': CustomUser.objects.count(), 'cart_items': CartItem.objects.count()},
+            'options': {name: options[name] for name in ('iterations', 'concurrency', 'seed')},
+        }
+        with quiet_request_log():
+            self.run_suite(options, overrides, results)
+        output = json.dumps(results, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+        self.stdout.write(output)
+
+    def run_suite(self, options, overrides, results):
+        with override_settings(**overrides):
+            if options['replay']:
+                with open(options['replay']) as f:
+                    results['replay'] = replay(f)
+            else:
+                results['scenarios'] = {}
+                for name in options['scenario'] or sorted(SCENARIOS):
+                    try:
+                        results['scenarios'][name] = run_scenario(
+                            name, options['iterations'], options['concurrency'], options['seed'])
+                    except ValueError as e:
+                        raise CommandError(str(e))
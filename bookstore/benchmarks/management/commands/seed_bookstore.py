@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from benchmarks.seed import clear_seed_data, seed_data
+
+
+class Command(BaseCommand):
+    help = ('Fill the configured database with synthetic categories, books, users and '
+            'carts for the load benchmarks. Use a throwaway database for millions of rows.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--books', type=int, default=1000000)
+        parser.add_argument('--categories', type=int, default=2000)
+        parser.add_argument('--users', type=int, default=2000)
+        parser.add_argument('--carts', type=int, default=500,
+                            help='Number of users that get a cart.')
+        parser.add_argument('--cart-size', type=int, default=3)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--clear', action='store_true',
+                            help='Delete earlier benchmark data first.')
+
+    def handle(self, *args, **options):
+        if options['clear']:
+            clear_seed_data()
+        counts = seed_data(books=options['books'], categories=options['categories'],
+                           users=options['users'], carts=options['carts'],
+                           cart_size=options['cart_size'], batch_size=options['batch_size'],
+                           seed=options['seed'], log=self.stdout.write)
+        self.stdout.write(self.style.SUCCESS(
+            ', '.join(f'{count} {name}' for name, count in counts.items())))
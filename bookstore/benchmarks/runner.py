@@ -0,0 +1,291 @@
+"""
+Scripted load scenarios driven through the Django test client, and replay of
+recorded request logs. Every request is timed, and results are plain dicts
+(latency percentiles in milliseconds, throughput in requests per second)
+meant to be dumped as JSON and diffed between releases.
+"""
+import json
+import logging
+import math
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from urllib.parse import urlencode
+
+from django.db import connections
+from django.test import Client
+from django.urls import Resolver404, resolve, reverse
+
+from api.models import Book, Category, CustomUser
+from .seed import ADMIN_EMAIL, EMAIL_DOMAIN, PREFIX
+
+
+def percentile(sorted_values, pct):
+    # nearest rank, so the result is always a measured value
+    if not sorted_values:
+        return None
+    rank = max(math.ceil(pct / 100 * len(sorted_values)), 1)
+    return sorted_values[rank - 1]
+
+
+class Recorder:
+    """Latencies and statuses of the requests made in one scenario."""
+
+    def __init__(self):
+        self.latencies = []
+        self.statuses = {}
+        self.routes = {}
+        self.route_statuses = {}
+        self.counters = {}
+
+    def request(self, client, method, path, data=None, route=None, **extra):
+        if data is not None and not isinstance(data, (str, bytes)):
+            data = json.dumps(data)
+        start = time.perf_counter()
+        response = client.generic(method, path, data or '', content_type='application/json', **extra)
+        elapsed = time.perf_counter() - start
+        self.add(elapsed, response.status_code, route)
+        return response
+
+    def add(self, elapsed, status, route=None):
+        self.latencies.append(elapsed)
+        self.statuses[str(status)] = self.statuses.get(str(status), 0) + 1
+        if route:
+            self.routes.setdefault(route, []).append(elapsed)
+            statuses = self.route_statuses.setdefault(route, {})
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def merge(self, other):
+        self.latencies += other.latencies
+        for status, count in other.statuses.items():
+            self.statuses[status] = self.statuses.get(status, 0) + count
+        for route, latencies in other.routes.items():
+            self.routes.setdefault(route, []).extend(latencies)
+        for route, statuses in other.route_statuses.items():
+            current = self.route_statuses.setdefault(route, {})
+            for status, count in statuses.items():
+                current[status] = current.get(status, 0) + count
+        for name, count in other.counters.items():
+            self.count(name, count)
+
+    def summary(self, seconds):
+        result = latency_summary(self.latencies)
+        result.update(seconds=round(seconds, 3), statuses=dict(sorted(self.statuses.items())),
+                      throughput_rps=round(len(self.latencies) / seconds, 1) if seconds else None)
+        if self.routes:
+            result['routes'] = {
+                route: dict(latency_summary(latencies),
+                            statuses=dict(sorted(self.route_statuses[route].items())))
+                for route, latencies in sorted(self.routes.items())}
+        if self.counters:
+            result['counters'] = dict(sorted(self.counters.items()))
+        return result
+
+
+def latency_summary(latencies):
+    ordered = sorted(latencies)
+
+    def ms(value):
+        return None if value is None else round(value * 1000, 3)
+    return {
+        'requests': len(ordered),
+        'p50_ms': ms(percentile(ordered, 50)),
+        'p95_ms': ms(percentile(ordered, 95)),
+        'p99_ms': ms(percentile(ordered, 99)),
+        'max_ms': ms(ordered[-1] if ordered else None),
+        'mean_ms': ms(sum(ordered) / len(ordered) if ordered else None),
+    }
+
+
+@contextmanager
+def quiet_request_log():
+    # 4xx answers are part of the load, don't log each of them
+    request_logger = logging.getLogger('django.request')
+    level = request_logger.level
+    request_logger.setLevel(logging.ERROR)
+    try:
+        yield
+    finally:
+        request_logger.setLevel(level)
+
+
+def logged_in_client(email):
+    client = Client()
+    user = CustomUser.objects.filter(email=email).first()
+    if user is not None:
+        client.force_login(user)
+    return client
+
+
+class Dataset:
+    """What the scenarios pick from: seeded categories, members and books."""
+
+    def __init__(self, rng):
+        self.rng = rng
+        self.categories = list(Category.objects.filter(name__startswith=f'{PREFIX} category ')
+                               .values_list('name', flat=True))
+        self.members = list(CustomUser.objects.filter(email__endswith=f'@{EMAIL_DOMAIN}',
+                                                      role=CustomUser.MEMBER)
+                            .values_list('email', flat=True))
+        bounds = Book.objects.filter(title__startswith=f'{PREFIX} book ').order_by('id')
+        first, last = bounds.first(), bounds.last()
+        self.book_range = (first.id, last.id) if first else None
+        if not (self.categories and self.members and self.book_range):
+            raise ValueError('No benchmark data, run `python manage.py seed_bookstore` first')
+
+    def random_book_id(self):
+        return self.rng.randint(*self.book_range)
+
+    def hot_book_ids(self, count=5):
+        return list(Book.objects.filter(title__startswith=f'{PREFIX} book ', stock__gt=0)
+                    .order_by('id').values_list('id', flat=True)[:count])
+
+
+def browse(dataset, recorder, iterations):
+    """Anonymous catalog reads: list_books cursor walks and searches."""
+    client = Client()
+    rng = dataset.rng
+    for _ in range(iterations):
+        categories = rng.sample(dataset.categories, min(3, len(dataset.categories)))
+        query = {'page_size': 20}
+        for _ in range(rng.randint(1, 3)):
+            response = recorder.request(client, 'GET', reverse('list_books'), {'categories': categories},
+                                        route='list_books', QUERY_STRING=urlencode(query))
+            cursor = response.status_code == 200 and response.json().get('next_cursor')
+            if not cursor:
+                break
+            query['cursor'] = cursor
+        recorder.request(client, 'GET', reverse('search_books'), route='search_books',
+                         QUERY_STRING=urlencode({'q': f'book {rng.randint(0, 999)}'}))
+
+
+def checkout_storm(dataset, recorder, iterations):
+    """Members fill a cart with a few books and check out."""
+    rng = dataset.rng
+    for _ in range(iterations):
+        client = logged_in_client(rng.choice(dataset.members))
+        for _ in range(rng.randint(1, 4)):
+            recorder.request(client, 'POST', reverse('add_to_cart', args=[dataset.random_book_id()]),
+                             route='add_to_cart')
+        recorder.request(client, 'GET', reverse('view_cart'), route='view_cart')
+        recorder.request(client, 'PUT', reverse('checkout'), route='checkout')
+
+
+def hot_titles(dataset, recorder, iterations):
+    """
+    Every member goes for the same few books and checks out right away, to
+    measure contention on their rows. Counts copies sold and adds refused
+    because the books sold out.
+    """
+    rng = dataset.rng
+    hot = dataset.hot_book_ids()
+    for _ in range(iterations):
+        client = logged_in_client(rng.choice(dataset.members))
+        response = recorder.request(client, 'POST', reverse('add_to_cart', args=[rng.choice(hot)]),
+                                    route='add_to_cart')
+        if response.status_code == 400:
+            recorder.count(_failure(response, 'sold_out'))
+        response = recorder.request(client, 'PUT', reverse('checkout'), route='checkout')
+        if response.status_code == 200:
+            recorder.count('sold', len(response.json().get('order_summary', [])))
+        elif response.status_code == 400:
+            recorder.count(_failure(response, 'checkout_failed'))
+
+
+def _failure(response, default):
+    # lock timeouts are counted apart from the answers the app meant to give
+    return 'database_locked' if 'locked' in response.json().get('error', '') else default
+
+
+def admin_edits(dataset, recorder, iterations):
+    """An admin pages through manage_books and edits book prices."""
+    rng = dataset.rng
+    client = logged_in_client(ADMIN_EMAIL)
+    for _ in range(iterations):
+        recorder.request(client, 'GET', reverse('manage_books'), route='manage_books',
+                         QUERY_STRING=urlencode({'order_by': rng.choice(['title', '-price', 'year_published'])}))
+        book = (Book.objects.filter(id__gte=dataset.random_book_id())
+                .select_related('category').order_by('id').first())
+        if book is None:
+            continue
+        payload = {'id': book.id, 'category': book.category.name, 'title': book.title,
+                   'author_name': book.author_name, 'price': rng.randint(100, 9999) / 100,
+                   'stock': book.stock, 'year_published': book.year_published}
+        recorder.request(client, 'PUT', reverse('manage_books'), payload, route='manage_books')
+
+
+SCENARIOS = {
+    'browse': browse,
+    'checkout_storm': checkout_storm,
+    'hot_titles': hot_titles,
+    'admin_edits': admin_edits,
+}
+
+
+def _run_worker(func, seed, iterations, worker):
+    # each worker gets its own random stream, client and DB connection
+    recorder = Recorder()
+    try:
+        func(Dataset(random.Random(f'{seed}:{worker}')), recorder, iterations)
+    finally:
+        connections.close_all()
+    return recorder
+
+
+def run_scenario(name, iterations=100, concurrency=1, seed=0):
+    """Run ``iterations`` rounds of a scenario split over ``concurrency`` threads."""
+    func = SCENARIOS[name]
+    shares = [iterations // concurrency + (i < iterations % concurrency) for i in range(concurrency)]
+    recorder = Recorder()
+    start = time.perf_counter()
+    if concurrency == 1:
+        func(Dataset(random.Random(seed)), recorder, iterations)
+    else:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            for result in executor.map(_run_worker, [func] * concurrency, [seed] * concurrency,
+                                       shares, range(concurrency)):
+                recorder.merge(result)
+    return recorder.summary(time.perf_counter() - start)
+
+
+def replay(lines):
+    """
+    Replay a request log, one JSON object per line with ``method`` and
+    ``path``, and optionally ``query`` (dict or string), ``body`` (JSON value
+    or string), ``headers`` and ``user`` (an email to log in as). Lines that
+    aren't requests are skipped and counted.
+    """
+    recorder = Recorder()
+    clients = {}
+    skipped = 0
+    start = time.perf_counter()
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            entry = json.loads(line)
+            method, path = entry['method'].upper(), entry['path']
+        except (ValueError, KeyError, TypeError, AttributeError):
+            skipped += 1
+            continue
+        user = entry.get('user')
+        if user not in clients:
+            clients[user] = logged_in_client(user) if user else Client()
+        try:
+            route = resolve(path).url_name
+        except Resolver404:
+            route = 'unmatched'
+        query = entry.get('query') or ''
+        if isinstance(query, dict):
+            query = urlencode(query)
+        headers = {f"HTTP_{k.upper().replace('-', '_')}": v for k, v in (entry.get('headers') or {}).items()}
+        recorder.request(clients[user], method, path, entry.get('body'), route=route,
+                         QUERY_STRING=query, **headers)
+    result = recorder.summary(time.perf_counter() - start)
+    result['skipped_lines'] = skipped
+    return result
@@ -0,0 +1,156 @@
+"""
+Synthetic catalog, users and carts for load benchmarks, written with
+``bulk_create`` in batches so millions of rows load in minutes. Every
+generated name starts with ``PREFIX`` so ``clear_seed_data`` can remove them
+without touching real data, and the same ``seed`` always produces the same
+rows.
+"""
+import random
+from collections import Counter
+
+from django.contrib.auth.hashers import make_password
+from django.db import connection, transaction
+from django.db.models import F
+
+from api.catalog_cache import bump_catalog_version
+from api.category_map import invalidate_category_map
+from api.models import Book, CartItem, Category, CustomUser, OrderLine
+from api.reservations import release
+
+
+PREFIX = 'bench'
+PASSWORD = 'benchmark'
+EMAIL_DOMAIN = 'bench.example.com'
+
+
+def category_name(i):
+    return f'{PREFIX} category {i}'
+
+
+def user_email(i):
+    return f'{PREFIX}{i}@{EMAIL_DOMAIN}'
+
+
+ADMIN_EMAIL = f'{PREFIX}-admin@{EMAIL_DOMAIN}'
+
+
+def _batches(items, size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def seed_data(books=1000000, categories=2000, users=2000, carts=500, cart_size=3,
+              batch_size=5000, seed=0, log=None):
+    """
+    Insert the synthetic data set and return the number of rows per model.
+    ``carts`` users get ``cart_size`` random in-stock books each.
+    """
+    rng = random.Random(seed)
+    log = log or (lambda message: None)
+    counts = {}
+
+    with transaction.atomic():
+        Category.objects.bulk_create(
+            (Category(name=category_name(i)) for i in range(categories)), batch_size=batch_size)
+        category_ids = list(Category.objects.filter(name__startswith=f'{PREFIX} category ')
+                            .order_by('id').values_list('id', flat=True))
+        counts['categories'] = len(category_ids)
+    # bulk_create sends no signals
+    invalidate_category_map()
+    log(f"categories: {counts['categories']}")
+
+    counts['books'] = 0
+    rows = (Book(title=f'{PREFIX} book {i}', year_published=rng.randint(1900, 2024),
+                 author_name=f'{PREFIX} author {rng.randrange(books // 10 + 1)}',
+                 price=f'{rng.randint(100, 9999) / 100:.2f}',
+                 category_id=rng.choice(category_ids),
+                 stock=rng.choice((0, 1, 2, 5, 10, 50)))
+            for i in range(books))
+    for batch in _batches(rows, batch_size):
+        # one transaction per batch keeps the write lock short
+        with transaction.atomic():
+            Book.objects.bulk_create(batch)
+        counts['books'] += len(batch)
+        if counts['books'] % (batch_size * 20) == 0:
+            log(f"books: {counts['books']}")
+    log(f"books: {counts['books']}")
+
+    # hashing once keeps thousands of users from taking minutes
+    password = make_password(PASSWORD)
+    with transaction.atomic():
+        CustomUser.objects.bulk_create(
+            (CustomUser(email=user_email(i), password=password) for i in range(users)),
+            batch_size=batch_size)
+        CustomUser.objects.create(email=ADMIN_EMAIL, password=password, role=CustomUser.ADMIN)
+    counts['users'] = users + 1
+    log(f"users: {counts['users']}")
+
+    stock = dict(Book.objects.filter(title__startswith=f'{PREFIX} book ', stock__gt=0)
+                 .values_list('id', 'stock'))
+    book_ids = list(stock)
+    user_ids = list(CustomUser.objects.filter(email__endswith=f'@{EMAIL_DOMAIN}', role=CustomUser.MEMBER)
+                    .order_by('id').values_list('id', flat=True)[:carts])
+    # items hold a copy like add_to_cart's, never more than a book has
+    held = Counter()
+    items = []
+    for user_id in user_ids:
+        for book_id in rng.sample(book_ids, min(cart_size, len(book_ids))):
+            if held[book_id] < stock[book_id]:
+                held[book_id] += 1
+                items.append(CartItem(user_id=user_id, book_id=book_id, holds_stock=True))
+    by_count = {}
+    for book_id, count in held.items():
+        by_count.setdefault(count, []).append(book_id)
+    with transaction.atomic():
+        CartItem.objects.bulk_create(items, batch_size=batch_size)
+        for count, ids in by_count.items():
+            for batch in _batches(ids, batch_size):
+                Book.objects.filter(id__in=batch).update(stock=F('stock') - count, held=F('held') + count)
+    counts['cart_items'] = len(items)
+    log(f"cart items: {counts['cart_items']}")
+
+    # bulk_create sends no signals
+    bump_catalog_version()
+    if connection.vendor in ('sqlite', 'postgresql'):
+        # fresh statistics, so the planner picks the partial listing index
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+    return counts
+
+
+def clear_seed_data(batch_size=5000):
+    """
+    Delete everything ``seed_data`` created. Books and categories go in id
+    batches of raw DELETEs, which skip the per-row signals and the loading
+    of every book into memory, so holds are given back and the caches
+    invalidated once instead.
+    """
+    users = CustomUser.objects.filter(email__endswith=f'@{EMAIL_DOMAIN}')
+    categories = Category.objects.filter(name__startswith=f'{PREFIX} category ')
+    books = Book.objects.filter(category__in=categories)
+    with transaction.atomic():
+        carts = CartItem.objects.filter(user__in=users)
+        # holds on books that stay, seeded books are deleted with theirs
+        release(list(carts.filter(holds_stock=True).exclude(book__in=books)
+                     .values_list('book_id', flat=True)))
+        carts.delete()
+        # nothing left for release_held_stock to do per user
+        users.delete()
+    while True:
+        ids = list(books.values_list('id', flat=True)[:batch_size])
+        if not ids:
+            break
+        # one transaction per batch keeps the write lock short
+        with transaction.atomic():
+            CartItem.objects.filter(book_id__in=ids).delete()
+            OrderLine.objects.filter(book_id__in=ids).update(book=None)
+            Book.objects.filter(id__in=ids)._raw_delete(Book.objects.db)
+    categories._raw_delete(categories.db)
+    invalidate_category_map()
+    bump_catalog_version()
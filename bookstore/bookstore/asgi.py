@@ -14,3 +14,9 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'bookstore.settings')
 
 application = get_asgi_application()
+
+# only processes serving requests sweep expired carts, not manage.py commands
+# or the tests (runserver loads this module in its serving child)
+from api.sweeper import start_cart_sweeper
+
+start_cart_sweeper()
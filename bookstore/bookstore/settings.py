@@ -37,16 +37,23 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'rest_framework',
     'api',
+    'benchmarks',
 ]
 
 MIDDLEWARE = [
+    'api.metrics.MetricsMiddleware',
+    'api.querybudget.QueryBudgetMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'api.tokens.TokenAuthenticationMiddleware',
+    'api.routers.ReplicaPinningMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'api.ratelimit.RateLimitMiddleware',
 ]
 
 ROOT_URLCONF = 'bookstore.urls'
@@ -69,6 +76,10 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'bookstore.wsgi.application'
 
+# Route list_books, view_cart, add_to_cart, login and logout to the async
+# views in api/async_views.py. Only useful when served through asgi.py.
+ASYNC_VIEWS = False
+
 
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
@@ -77,9 +88,182 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # keep connections for 10 minutes instead of one per request
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            # take the write lock at BEGIN so writers queue on busy_timeout
+            # instead of failing when a read transaction tries to write
+            # (Django 5.1+)
+            'transaction_mode': 'IMMEDIATE',
+        },
     }
 }
 
+# Catalog reads from @replica_reads views go to these DATABASES aliases, see
+# api/routers.py. To try it locally with a second SQLite file, add
+#
+#     'replica': {
+#         'ENGINE': 'django.db.backends.sqlite3',
+#         'NAME': BASE_DIR / 'replica.sqlite3',
+#         'TEST': {'MIRROR': 'default'},
+#     },
+#
+# to DATABASES, set DATABASE_REPLICAS = ['replica'] and copy the primary into
+# it with `python manage.py sync_replica`.
+DATABASE_REPLICAS = []
+
+DATABASE_ROUTERS = ['api.routers.ReplicaRouter']
+
+# After a write, the client reads from the primary for this many seconds.
+REPLICA_STICKY_SECONDS = 5
+
+REPLICA_PIN_COOKIE = 'replica_pin'
+
+# Applied to every new SQLite connection by api.sqlite.configure_sqlite.
+SQLITE_PRAGMAS = {
+    # first, so switching the journal mode waits for other connections too
+    'busy_timeout': 5000,
+    'journal_mode': 'wal',
+    'synchronous': 'normal',
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64000,  # in KiB, so 64 MB
+}
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+# Cache used for book listings, use a shared backend (e.g. Redis or
+# Memcached) when running several processes so they see the same version.
+CATALOG_CACHE_ALIAS = 'default'
+
+CATALOG_CACHE_TIMEOUT = 300
+
+
+# Sessions
+# https://docs.djangoproject.com/en/4.2/topics/http/sessions/#using-cached-sessions
+
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+
+
+# Authentication
+# CachedUserBackend keeps logged in users in a per-process cache for
+# USER_CACHE_TTL seconds and checks passwords on the hashing pool. It is the
+# only backend: any other one would hash the password again, inline, after
+# every failed login. It extends ModelBackend, so permissions still work.
+AUTHENTICATION_BACKENDS = [
+    'api.backends.CachedUserBackend',
+]
+
+USER_CACHE_TTL = 60
+
+USER_CACHE_MAX_SIZE = 10000
+
+# 'session' logs users in with a session cookie. 'token' makes login_user
+# return a signed token instead, sent back as "Authorization: Bearer <token>",
+# which is checked without any database query. The admin site always uses
+# sessions.
+AUTH_MODE = 'session'
+
+# Seconds a token stays valid.
+TOKEN_AUTH_MAX_AGE = 60 * 60
+
+
+# Rate limiting
+# Token buckets per route and client as (tokens per second, burst). Routes
+# are URL names, 'default' covers the rest. RATE_LIMIT_STORE 'memory' keeps
+# buckets per process, 'cache' shares fixed-window counters through
+# RATE_LIMIT_CACHE_ALIAS.
+
+RATE_LIMIT_ENABLED = True
+
+RATE_LIMIT_STORE = 'memory'
+
+RATE_LIMIT_CACHE_ALIAS = 'default'
+
+RATE_LIMITS = {
+    'default': (10, 30),
+    'list_books': (10, 30),
+    'search_books': (5, 20),
+    'login_user': (1, 5),
+    'create_user': (0.2, 5),
+}
+
+# Most buckets kept in memory before refilled ones are dropped.
+RATE_LIMIT_MAX_KEYS = 100000
+
+# Requests in flight allowed at once per route, across all clients.
+CONCURRENCY_LIMITS = {
+    'checkout': 8,
+    'import_books': 2,
+    'export_books': 2,
+}
+
+
+# Request metrics, served at /metrics/ in the Prometheus text format.
+# With METRICS_DIR set every worker writes its totals to a file there every
+# METRICS_FLUSH_INTERVAL seconds from a background thread, and /metrics/ adds
+# up the files of live workers. Point it at a directory only this deployment
+# uses on one host, since files whose pid is gone are removed.
+
+METRICS_ENABLED = True
+
+METRICS_DIR = None
+
+METRICS_FLUSH_INTERVAL = 1
+
+METRICS_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Only admins can read /metrics/, and scrapers that send this value in an
+# `Authorization: Bearer` header. None lets no scraper in.
+
+METRICS_TOKEN = None
+
+
+# Query budgets declared on views with @query_budget. 'log' warns about
+# requests over budget, 'reject' fails the first query past the budget so
+# its transaction rolls back and answers with a 500, 'off' stops counting.
+
+QUERY_BUDGET_MODE = 'reject' if DEBUG else 'log'
+
+
+# Password hashing
+# https://docs.djangoproject.com/en/4.2/topics/auth/passwords/
+# The first hasher hashes new passwords, the rest can still verify old ones.
+# Passwords are rehashed on login when the first hasher or its iteration
+# count changes.
+
+PASSWORD_HASHERS = [
+    'api.hashers.ConfigurablePBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+    'django.contrib.auth.hashers.ScryptPasswordHasher',
+]
+
+# PBKDF2 iterations, None keeps Django's default.
+PASSWORD_HASH_ITERATIONS = None
+
+# Hashes run on a pool of this many threads, with at most
+# PASSWORD_HASH_MAX_PENDING more waiting before logins get a 503.
+PASSWORD_HASH_WORKERS = 4
+
+PASSWORD_HASH_MAX_PENDING = 64
+
+# Seconds a client is told to wait (Retry-After) after that 503.
+PASSWORD_HASH_RETRY_AFTER = 1
+
+# `manage.py test` applies bookstore.test_runner.TEST_SETTINGS on top of
+# these settings.
+TEST_RUNNER = 'bookstore.test_runner.TestRunner'
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -122,4 +306,17 @@ STATIC_URL = 'static/'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
-AUTH_USER_MODEL = 'api.CustomUser'
\ No newline at end of file
+AUTH_USER_MODEL = 'api.CustomUser'
+
+
+# Cart expiry
+# Books left in a cart longer than this are dropped from the cart.
+
+CART_ITEM_TTL_SECONDS = 60
+
+# Seconds between runs of the in-process expired cart sweeper, None disables it.
+# It starts in the processes that load wsgi.py or asgi.py, i.e. the servers.
+# Expired rows can also be purged with `python manage.py purge_expired_carts`.
+CART_SWEEPER_INTERVAL = None
+
+CART_SWEEPER_BATCH_SIZE = 1000
@@ -0,0 +1,24 @@
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+# Tests don't need slow hashes, rate limit tests turn limiting back on, and
+# every test request is held to its view's query budget.
+TEST_SETTINGS = {
+    'PASSWORD_HASHERS': ['django.contrib.auth.hashers.MD5PasswordHasher'],
+    'RATE_LIMIT_ENABLED': False,
+    'QUERY_BUDGET_MODE': 'reject',
+}
+
+
+class TestRunner(DiscoverRunner):
+    """Runs the suite with ``TEST_SETTINGS`` applied on top of the project settings."""
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self._test_settings = override_settings(**TEST_SETTINGS)
+        self._test_settings.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self._test_settings.disable()
+        super().teardown_test_environment(**kwargs)